@@ -0,0 +1,178 @@
+"""
+Upload Admission Control
+========================
+Checks an upload before anything expensive happens to it, so one oversized or
+crafted image can't take the process's memory and CPU from every other
+session.
+
+- Byte cap: larger files are rejected before decoding.
+- Pixel cap from the header: Pillow reads only the header to get the declared
+  size. JPEGs above MAX_DECODE_PIXELS are decoded at 1/2, 1/4 or 1/8 scale via
+  libjpeg's DCT scaling (cv2.IMREAD_REDUCED_*), so the full-size bitmap is
+  never allocated. Other formats cannot be decoded reduced and are rejected.
+- Decode slots: at most DECODE_SLOTS full decodes run at once, which bounds
+  peak decode memory to DECODE_SLOTS x MAX_DECODE_PIXELS x 3 bytes.
+- Rate limits: token buckets per client (Streamlit session or API key) and
+  per shipment.
+
+Rejections raise AdmissionError carrying a translation key, the same
+`reason_*` convention the quality check uses.
+"""
+
+import os
+import sys
+import time
+import warnings
+import threading
+from io import BytesIO
+
+import metrics
+
+MAX_UPLOAD_BYTES = 25 * 1024 * 1024
+MAX_DECODE_PIXELS = 24_000_000  # ~72 MB as a BGR bitmap
+REDUCED_FACTORS = (2, 4, 8)
+DECODE_SLOTS = max(2, os.cpu_count() or 2)
+
+SESSION_BURST, SESSION_REFILL_SECONDS = 6, 20.0  # 6 uploads at once, then 1 per 20 s
+SHIPMENT_BURST, SHIPMENT_REFILL_SECONDS = 12, 20.0  # across all sessions on one link
+BUCKET_IDLE_SECONDS = 3600
+
+# Backstop for anything that reaches OpenCV without going through inspect(). OpenCV reads it
+# once when it loads, so entry points import this module before anything imports cv2.
+os.environ.setdefault("OPENCV_IO_MAX_IMAGE_PIXELS", str(MAX_DECODE_PIXELS * REDUCED_FACTORS[-1] ** 2))
+if "cv2" in sys.modules:
+    warnings.warn("cv2 was imported before admission; OPENCV_IO_MAX_IMAGE_PIXELS is not in effect",
+                  RuntimeWarning, stacklevel=2)
+
+
+class AdmissionError(Exception):
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+        metrics.inc("pod_admission_rejections_total", reason=reason)
+
+
+# ─────────────────────────────────────────────
+# SIZE / PIXEL CAPS
+# ─────────────────────────────────────────────
+def inspect(image_bytes: bytes) -> dict:
+    """Header-only probe. Returns {format, width, height, reduce}; raises AdmissionError."""
+    if len(image_bytes) > MAX_UPLOAD_BYTES:
+        raise AdmissionError("reason_too_large")
+    Image = metrics.lazy_import("PIL.Image")
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+            with Image.open(BytesIO(image_bytes)) as im:
+                fmt, (width, height) = im.format, im.size
+    except Image.DecompressionBombError:
+        raise AdmissionError("reason_too_large") from None
+    except Exception:  # noqa: BLE001 - Pillow raises a zoo of errors on junk input
+        raise AdmissionError("reason_unreadable") from None
+
+    pixels = width * height
+    reduce = 1
+    if pixels > MAX_DECODE_PIXELS:
+        if fmt != "JPEG":
+            raise AdmissionError("reason_too_large")
+        reduce = next((f for f in REDUCED_FACTORS if pixels / (f * f) <= MAX_DECODE_PIXELS), 0)
+        if not reduce:
+            raise AdmissionError("reason_too_large")
+        metrics.inc("pod_admission_downscaled_total", factor=str(reduce))
+    return {"format": fmt, "width": width, "height": height, "reduce": reduce}
+
+
+_decode_slots = threading.BoundedSemaphore(DECODE_SLOTS)
+
+
+def decode(image_bytes: bytes, info: dict, grayscale: bool = False):
+    """cv2 decode honouring the reduction factor from inspect(); None if undecodable."""
+    cv2 = metrics.lazy_import("cv2")
+    np = metrics.lazy_import("numpy")
+    reduce = info["reduce"]
+    if reduce == 1:
+        flags = cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_COLOR
+    else:
+        flags = getattr(cv2, f"IMREAD_REDUCED_{'GRAYSCALE' if grayscale else 'COLOR'}_{reduce}")
+    with metrics.timer("pod_admission_slot_wait_seconds"):
+        _decode_slots.acquire()
+    try:
+        return cv2.imdecode(np.frombuffer(image_bytes, np.uint8), flags)
+    finally:
+        _decode_slots.release()
+
+
+# ─────────────────────────────────────────────
+# RATE LIMITS
+# ─────────────────────────────────────────────
+class TokenBucket:
+    __slots__ = ("capacity", "refill_seconds", "tokens", "updated")
+
+    def __init__(self, capacity: int, refill_seconds: float, now: float):
+        self.capacity = capacity
+        self.refill_seconds = refill_seconds
+        self.tokens = float(capacity)
+        self.updated = now
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + max(0.0, now - self.updated) / self.refill_seconds)
+        self.updated = max(self.updated, now)
+
+    def available(self, now: float, count: int = 1) -> bool:
+        self._refill(now)
+        return self.tokens >= count
+
+    def take(self, count: int = 1):
+        self.tokens -= count
+
+
+class RateLimiter:
+    def __init__(self):
+        self._buckets: dict[tuple, TokenBucket] = {}
+        self._lock = threading.Lock()
+        self._last_prune = time.monotonic()
+
+    def _bucket(self, key: tuple, now: float, capacity: int, refill_seconds: float) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(capacity, refill_seconds, now)
+        return bucket
+
+    def _prune(self, now: float):
+        if now - self._last_prune < 60:
+            return
+        self._last_prune = now
+        for key, bucket in list(self._buckets.items()):
+            if now - bucket.updated > BUCKET_IDLE_SECONDS:
+                del self._buckets[key]
+
+    def admit(self, client_id: str | None, shipment_key: str, count: int = 1,
+              client_burst: int = SESSION_BURST, client_refill_seconds: float = SESSION_REFILL_SECONDS):
+        """Charge `count` uploads to the client and shipment buckets, or raise AdmissionError."""
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            buckets = [self._bucket(("shipment", shipment_key), now, SHIPMENT_BURST, SHIPMENT_REFILL_SECONDS)]
+            if client_id is not None:
+                buckets.append(self._bucket(("client", client_id), now, client_burst, client_refill_seconds))
+            # All-or-nothing, so a rejected upload doesn't drain the other bucket
+            if not all(b.available(now, count) for b in buckets):
+                raise AdmissionError("reason_rate_limited")
+            for bucket in buckets:
+                bucket.take(count)
+
+
+_limiter = RateLimiter()
+
+
+def admit(client_id: str | None, shipment_key: str, count: int = 1, **client_limits):
+    """Charge `count` uploads to a client (session, API key, ...) and a shipment, all or none."""
+    _limiter.admit(client_id, shipment_key, count, **client_limits)
+
+
+def admit_upload(shipment_key: str):
+    """Charge a new upload from the current Streamlit session to its rate limits."""
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+    ctx = get_script_run_ctx(suppress_warning=True)
+    admit(ctx.session_id if ctx is not None else None, shipment_key)
@@ -0,0 +1,341 @@
+"""
+POD Ingestion API
+=================
+Headless HTTP API for the driver mobile app and partner integrations: POST the
+photo directly instead of driving a Streamlit session.
+
+It reuses the exact code paths of the Streamlit page: `get_shipment`,
+`analyze_image_quality` (with admission control), `save_single_pod` /
+`save_pod_image` and `save_pod_metadata`, so submissions land in the same
+storage, duplicate index and event log. Requests are handled on the event
+loop. Quality analysis and storage run on a bounded thread pool: OpenCV
+releases the GIL in decode/filter/encode, and the decoded frame stays
+in-process for the optional document crop. When the pool's queue is full,
+new work gets 503 + Retry-After rather than piling up.
+
+Endpoints (photo bodies are the raw image bytes, e.g. Content-Type: image/jpeg):
+    GET  /healthz
+    GET  /v1/shipments/{key}                 shipment summary + submission status
+    POST /v1/shipments/{key}/quality-check   quality verdict only, nothing stored
+    POST /v1/shipments/{key}/pod?lang=ar     check and, if it passes, store the POD
+    POST /v1/shipments/{key}/pod/fallback    multipart, 3 `photos` parts, stored unchecked
+
+Set POD_API_KEYS (comma-separated) to require `Authorization: Bearer <key>`.
+The API refuses to start without keys unless POD_API_ALLOW_OPEN=1 is set.
+
+Usage:
+    uvicorn api:app --host 0.0.0.0 --port 8600
+    curl -X POST --data-binary @pod.jpg -H "Content-Type: image/jpeg" \\
+        "http://localhost:8600/v1/shipments/<key>/pod?lang=en"
+"""
+
+import os
+import asyncio
+import logging
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import UploadFile
+from starlette.formparsers import MultiPartException, MultiPartParser
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+import app as pod
+import metrics
+import admission
+import shards
+
+logger = logging.getLogger("pod.api")
+
+API_KEYS = {k.strip() for k in os.environ.get("POD_API_KEYS", "").split(",") if k.strip()}
+ALLOW_OPEN = os.environ.get("POD_API_ALLOW_OPEN", "0") == "1"  # explicit opt-in to serve without keys
+WORKERS = int(os.environ.get("POD_API_WORKERS", os.cpu_count() or 2))
+MAX_QUEUED = int(os.environ.get("POD_API_MAX_QUEUED", WORKERS * 4))
+FALLBACK_PHOTOS = 3
+MULTIPART_OVERHEAD_BYTES = 64 * 1024  # boundaries and part headers around the fallback photos
+# One partner key uploads for many drivers, so it gets a far larger bucket than a session
+CLIENT_BURST = int(os.environ.get("POD_API_CLIENT_BURST", 200))
+CLIENT_RATE = float(os.environ.get("POD_API_CLIENT_RATE", 20))  # uploads/s refill
+
+_executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="pod-api")
+_in_flight = 0
+_submitting: set[str] = set()  # shipment keys with a submission in progress
+
+
+class ApiError(Exception):
+    def __init__(self, status: int, error: str, **fields):
+        super().__init__(error)
+        self.status = status
+        self.body = {"error": error, **fields}
+
+
+# ─────────────────────────────────────────────
+# HELPERS
+# ─────────────────────────────────────────────
+def _client_id(request) -> str:
+    auth = request.headers.get("authorization", "")
+    key = auth[len("Bearer "):].strip() if auth.startswith("Bearer ") else ""
+    if (API_KEYS or not ALLOW_OPEN) and key not in API_KEYS:
+        raise ApiError(401, "unauthorized")
+    return f"key:{key}" if key else f"ip:{request.client.host if request.client else 'unknown'}"
+
+
+def _language(request) -> str:
+    lang = request.query_params.get("lang", "en")
+    return lang if lang in pod.TRANSLATIONS else "en"
+
+
+async def _offload(fn, *args, **kwargs):
+    """Run fn on the worker pool, shedding load once MAX_QUEUED jobs are waiting."""
+    global _in_flight
+    if _in_flight >= MAX_QUEUED:
+        metrics.inc("pod_api_shed_total")
+        raise ApiError(503, "busy", retry_after=1)
+    _in_flight += 1
+    metrics.set_gauge("pod_api_in_flight", _in_flight)
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, lambda: fn(*args, **kwargs))
+    finally:
+        _in_flight -= 1
+        metrics.set_gauge("pod_api_in_flight", _in_flight)
+
+
+def _check_length(request, limit: int):
+    """Reject a declared Content-Length over limit before reading the body."""
+    declared = request.headers.get("content-length")
+    if declared is None:
+        return
+    if not declared.isdigit():
+        raise ApiError(400, "invalid content-length")
+    if int(declared) > limit:
+        raise ApiError(413, "reason_too_large")
+
+
+async def _limited_stream(request, limit: int):
+    """The request body, cut off with 413 once it passes limit (chunked bodies declare no length)."""
+    _check_length(request, limit)
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > limit:
+            raise ApiError(413, "reason_too_large")
+        yield chunk
+
+
+async def _read_photo(request) -> bytes:
+    chunks = [chunk async for chunk in _limited_stream(request, admission.MAX_UPLOAD_BYTES)]
+    if not any(chunks):
+        raise ApiError(400, "empty body")
+    return b"".join(chunks)
+
+
+class _PhotoPartParser(MultiPartParser):
+    """Multipart parser that stops at the first file part over MAX_UPLOAD_BYTES.
+
+    Starlette's max_part_size only covers plain fields; file parts are spooled
+    to disk with no limit.
+    """
+
+    def on_part_begin(self):
+        super().on_part_begin()
+        self.part_bytes = 0
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        self.part_bytes += end - start
+        if self.part_bytes > admission.MAX_UPLOAD_BYTES:
+            raise ApiError(413, "reason_too_large")
+        super().on_part_data(data, start, end)
+
+
+async def _read_fallback_photos(request) -> list[bytes]:
+    if not request.headers.get("content-type", "").startswith("multipart/form-data"):
+        raise ApiError(400, "expected multipart/form-data")
+    limit = admission.MAX_UPLOAD_BYTES * FALLBACK_PHOTOS + MULTIPART_OVERHEAD_BYTES
+    parser = _PhotoPartParser(request.headers, _limited_stream(request, limit), max_files=FALLBACK_PHOTOS,
+                              max_fields=10, max_part_size=64 * 1024)
+    try:
+        form = await parser.parse()
+    except MultiPartException as e:
+        raise ApiError(400, e.message) from None
+    try:
+        uploads = form.getlist("photos")
+        if len(uploads) != FALLBACK_PHOTOS or not all(isinstance(u, UploadFile) for u in uploads):
+            raise ApiError(400, f"expected {FALLBACK_PHOTOS} photos as file parts")
+        return [await upload.read() for upload in uploads]
+    finally:
+        await form.close()
+
+
+async def _shipment(key: str) -> dict:
+    shipment = await run_in_threadpool(pod.get_shipment, key)
+    if shipment is None:
+        raise ApiError(404, "shipment_not_found")
+    return shipment
+
+
+class _Submission:
+    """Reject a second concurrent or repeated submission for the same shipment."""
+
+    def __init__(self, key: str):
+        self.key = key
+
+    async def __aenter__(self):
+        if self.key in _submitting:
+            raise ApiError(409, "submission_in_progress")
+        _submitting.add(self.key)
+        try:
+            existing = await run_in_threadpool(pod.get_existing_submission, self.key)
+        except BaseException:
+            _submitting.discard(self.key)
+            raise
+        if existing:
+            _submitting.discard(self.key)
+            raise ApiError(409, "already_submitted", uploaded_at=existing.get("uploaded_at"))
+
+    async def __aexit__(self, *exc):
+        _submitting.discard(self.key)
+
+
+def _admit(client_id: str, key: str, count: int = 1):
+    try:
+        admission.admit(client_id, key, count, client_burst=CLIENT_BURST, client_refill_seconds=1 / CLIENT_RATE)
+    except admission.AdmissionError as e:
+        raise ApiError(429, e.reason, retry_after=int(admission.SHIPMENT_REFILL_SECONDS)) from None
+
+
+def _verdict(result: dict, lang: str) -> dict:
+    table = pod.TRANSLATIONS[lang]
+    return {
+        "passed": result["passed"],
+        "reasons": result["reasons"],
+        "messages": [table.get(r, r) for r in result["reasons"]],
+        "scores": {k: (float(v) if not isinstance(v, str) else v) for k, v in result["scores"].items()},
+    }
+
+
+def _check_and_store(key: str, shipment: dict, image_bytes: bytes, lang: str, client_id: str):
+    """Worker-pool job: quality check, then store exactly like the Streamlit submit button."""
+    result = pod.analyze_image_quality(image_bytes, keep_artifacts=pod.POD_PROCESSING_ENABLED)
+    pod.record_quality_check(shipment, result, source="api")
+    if not result["passed"]:
+        return result, None
+    file_paths, extra = pod.save_single_pod(key, image_bytes, result)
+    extra.update(source="api", client=client_id)
+    meta_path = pod.save_pod_metadata(key, shipment, file_paths, mode="single", extra=extra, language=lang)
+    return result, {"file_paths": file_paths, "metadata_path": meta_path}
+
+
+def _store_fallback(key: str, shipment: dict, photos: list, lang: str, client_id: str):
+    file_paths = [pod.save_pod_image(key, data, index=i) for i, data in enumerate(photos)]
+    extra = {"source": "api", "client": client_id}
+    meta_path = pod.save_pod_metadata(key, shipment, file_paths, mode="fallback_triple", extra=extra, language=lang)
+    return {"file_paths": file_paths, "metadata_path": meta_path}
+
+
+# ─────────────────────────────────────────────
+# ENDPOINTS
+# ─────────────────────────────────────────────
+def endpoint(name: str):
+    """Time the handler and turn ApiError (and unreachable storage) into a JSON error response."""
+    def decorator(handler):
+        async def wrapper(request):
+            with metrics.timer("pod_api_request_seconds", endpoint=name):
+                try:
+                    try:
+                        response = await handler(request)
+                    except shards.ShardError:
+                        raise ApiError(503, "reason_storage_unavailable", retry_after=int(shards.DOWN_SECONDS)) from None
+                except ApiError as e:
+                    headers = {"Retry-After": str(e.body["retry_after"])} if "retry_after" in e.body else None
+                    response = JSONResponse(e.body, status_code=e.status, headers=headers)
+            metrics.inc("pod_api_requests_total", endpoint=name, status=str(response.status_code))
+            return response
+        return wrapper
+    return decorator
+
+
+@endpoint("healthz")
+async def healthz(request):
+    return JSONResponse({"ok": True, "shipments_source": pod.get_shipment_store().source})
+
+
+@endpoint("shipment")
+async def get_shipment(request):
+    _client_id(request)
+    key = request.path_params["key"]
+    shipment = await _shipment(key)
+    existing = await run_in_threadpool(pod.get_existing_submission, key)
+    return JSONResponse({
+        "shipment_key": key,
+        "carrier": shipment.get("carrier", ""),
+        "vehicle_plate": shipment.get("vehicle_plate", ""),
+        "pickup_city": shipment.get("pickup_city", ""),
+        "destination_city": shipment.get("destination_city", ""),
+        "submitted": existing is not None,
+        "uploaded_at": existing.get("uploaded_at") if existing else None,
+    })
+
+
+@endpoint("quality_check")
+async def quality_check(request):
+    client_id = _client_id(request)
+    key = request.path_params["key"]
+    shipment = await _shipment(key)
+    image_bytes = await _read_photo(request)
+    _admit(client_id, key)
+    result = await _offload(pod.analyze_image_quality, image_bytes)
+    await run_in_threadpool(pod.record_quality_check, shipment, result, source="api")
+    return JSONResponse(_verdict(result, _language(request)))
+
+
+@endpoint("pod")
+async def submit_pod(request):
+    client_id = _client_id(request)
+    key = request.path_params["key"]
+    lang = _language(request)
+    shipment = await _shipment(key)
+    image_bytes = await _read_photo(request)
+    async with _Submission(key):
+        _admit(client_id, key)
+        result, stored = await _offload(_check_and_store, key, shipment, image_bytes, lang, client_id)
+    body = _verdict(result, lang)
+    if stored is None:
+        return JSONResponse(body, status_code=422)
+    return JSONResponse({**body, **stored}, status_code=201)
+
+
+@endpoint("pod_fallback")
+async def submit_fallback(request):
+    client_id = _client_id(request)
+    key = request.path_params["key"]
+    lang = _language(request)
+    shipment = await _shipment(key)
+    photos = await _read_fallback_photos(request)
+    async with _Submission(key):
+        # Screen all photos first, then charge them together, so a rejected set costs nothing
+        for data in photos:
+            try:
+                admission.inspect(data)
+            except admission.AdmissionError as e:
+                raise ApiError(422, e.reason) from None
+        _admit(client_id, key, FALLBACK_PHOTOS)
+        stored = await _offload(_store_fallback, key, shipment, photos, lang, client_id)
+    return JSONResponse(stored, status_code=201)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    if not API_KEYS and not ALLOW_OPEN:
+        raise RuntimeError("POD_API_KEYS is not set; set it, or POD_API_ALLOW_OPEN=1 to serve without auth")
+    yield
+
+
+app = Starlette(lifespan=lifespan, routes=[
+    Route("/healthz", healthz),
+    Route("/v1/shipments/{key}", get_shipment),
+    Route("/v1/shipments/{key}/quality-check", quality_check, methods=["POST"]),
+    Route("/v1/shipments/{key}/pod", submit_pod, methods=["POST"]),
+    Route("/v1/shipments/{key}/pod/fallback", submit_fallback, methods=["POST"]),
+])
@@ -12,32 +12,81 @@ Usage:
 
 import streamlit as st
 import streamlit.components.v1 as components
-import requests
-import pandas as pd
-import cv2
-import numpy as np
-from PIL import Image
 from io import BytesIO
 from datetime import datetime
 import os
 import json
 import base64
 
+import metrics
+import phash
+import shipment_store
+import templates
+import docproc
+import upload_buffers
+import resumable
+import eventlog
+import admission
+import archive
+import redash
+import calibration
+import shards
+
+# cv2, numpy, pandas and requests are imported on first use via
+# metrics.lazy_import so a cold start reaches the language screen without them.
+
 
 # ─────────────────────────────────────────────
 # CONFIG
 # ─────────────────────────────────────────────
-REDASH_API_URL = (
+REDASH_API_URL = os.environ.get("POD_REDASH_URL") or (
     "https://redash.trella.co/api/queries/4922/results.csv"
     "?api_key=TX9ND3NoDL0xHNFcbFKvWwPMQAnouCXcywp1tAdz"
 )
-POD_STORAGE_DIR = "pod_uploads"
+# Parameterized, paged copy of the query (see redash.py); fetches only drop-off shipments
+REDASH_DELTA_URL = os.environ.get("POD_REDASH_DELTA_URL")
+POD_STORAGE_DIR = os.environ.get("POD_STORAGE_DIR", "pod_uploads")
+# Storage nodes for shipment files (see shards.py); local POD_STORAGE_DIR when unset.
+# The event log, phash index and calibration stay per app node in POD_STORAGE_DIR.
+SHARD_NODES = [n.strip() for n in os.environ.get("POD_SHARD_NODES", "").split(",") if n.strip()]
+SHARD_REPLICAS = int(os.environ.get("POD_SHARD_REPLICAS", 2))
+SHIPMENT_SNAPSHOT_PATH = os.environ.get(
+    "POD_SNAPSHOT_PATH", os.path.join(POD_STORAGE_DIR, "_shipments_snapshot.json")
+)
+SHIPMENT_TTL_SECONDS = 300
+SHIPMENT_FULL_SYNC_SECONDS = 3600  # delta mode: full drop-off fetch this often
+FAST_START = os.environ.get("POD_FAST_START", "1") != "0"  # boot from the persisted snapshot
 MAX_QUALITY_ATTEMPTS = 3
 BLUR_THRESHOLD = 80.0
 DARK_THRESHOLD = 40.0
 BRIGHT_THRESHOLD = 240.0
 MIN_EDGE_RATIO = 0.02
 MIN_RESOLUTION = (640, 480)
+# Per-resolution-class thresholds fitted by calibration.py, hot-reloaded
+ADAPTIVE_THRESHOLDS = os.environ.get("POD_ADAPTIVE_THRESHOLDS", "0") == "1"
+DUPLICATE_MAX_DISTANCE = 6  # pHash bits; flag photos this close to another shipment's POD
+
+# Post-check processing: crop to the document and re-encode as compact WebP
+POD_PROCESSING_ENABLED = os.environ.get("POD_PROCESS_IMAGES", "0") == "1"
+POD_KEEP_ORIGINAL = os.environ.get("POD_KEEP_ORIGINAL", "0") == "1"
+POD_TARGET_BYTES = 350_000
+POD_MAX_SIDE = 2200
+
+# Upload buffers: spill photos to a temp spool beyond these in-memory budgets
+UPLOAD_SESSION_BUDGET = int(os.environ.get("POD_UPLOAD_SESSION_BUDGET", 24 * 1024 * 1024))
+UPLOAD_GLOBAL_BUDGET = int(os.environ.get("POD_UPLOAD_GLOBAL_BUDGET", 512 * 1024 * 1024))
+upload_buffers.configure(UPLOAD_SESSION_BUDGET, UPLOAD_GLOBAL_BUDGET, os.environ.get("POD_UPLOAD_SPOOL_DIR"))
+
+# Resumable chunked uploads for weak links (see resumable.py); off unless a port is set
+RESUMABLE_PORT = int(os.environ.get("POD_RESUMABLE_PORT", "0"))
+RESUMABLE_PUBLIC_URL = os.environ.get("POD_RESUMABLE_URL")  # unset: the app's own host on RESUMABLE_PORT
+RESUMABLE_ENABLED = False
+if RESUMABLE_PORT:
+    try:
+        resumable.start_server(RESUMABLE_PORT, POD_STORAGE_DIR)
+        RESUMABLE_ENABLED = True
+    except OSError as e:
+        resumable.logger.warning("resumable upload endpoint not started on port %s: %s", RESUMABLE_PORT, e)
 
 # ─────────────────────────────────────────────
 # TRANSLATIONS
@@ -72,6 +121,10 @@ TRANSLATIONS = {
         "reason_bright": "Too bright — avoid direct light on the document",
         "reason_low_res": "Resolution too low — move closer to the document",
         "reason_no_document": "No document detected — make sure it's fully visible",
+        "reason_too_large": "Photo file is too large — use your camera's normal photo setting",
+        "reason_unreadable": "Couldn't read this photo — please take a new one",
+        "reason_rate_limited": "Too many uploads — please wait a minute and try again",
+        "reason_storage_unavailable": "Couldn't reach storage — please wait a moment and try again",
         "attempts_remaining": "{} attempts remaining",
         "retake": "Please retake the photo",
         "fallback_title": "Upload 3 Photos Instead",
@@ -89,6 +142,12 @@ TRANSLATIONS = {
         "already_submitted_note": "Need to re-upload? Contact dispatch.",
         "distance": "Distance",
         "upload_hint": "Tap above to take a photo or choose from gallery",
+        "resumable_pick": "Take Photo",
+        "resumable_uploading": "Uploading",
+        "resumable_waiting": "Connection lost — will resume automatically...",
+        "resumable_done": "Upload complete. Tap Continue below.",
+        "resumable_failed": "Upload failed — please take the photo again",
+        "resumable_continue": "Continue",
     },
     "ar": {
         "confirm_details": "تفاصيل الشحنة",
@@ -119,6 +178,10 @@ TRANSLATIONS = {
         "reason_bright": "ساطعة جداً — تجنب الضوء المباشر",
         "reason_low_res": "الدقة منخفضة — اقترب من المستند",
         "reason_no_document": "لم يُكتشف مستند — تأكد من ظهوره بالكامل",
+        "reason_too_large": "حجم الصورة كبير جدًا — استخدم إعداد الكاميرا العادي",
+        "reason_unreadable": "تعذّرت قراءة الصورة — يرجى التقاط صورة جديدة",
+        "reason_rate_limited": "عدد كبير من محاولات الرفع — انتظر دقيقة ثم حاول مرة أخرى",
+        "reason_storage_unavailable": "تعذّر الوصول إلى التخزين — انتظر قليلاً ثم حاول مرة أخرى",
         "attempts_remaining": "{} محاولات متبقية",
         "retake": "يرجى إعادة التصوير",
         "fallback_title": "ارفع ٣ صور بدلاً من ذلك",
@@ -136,6 +199,12 @@ TRANSLATIONS = {
         "already_submitted_note": "تحتاج إعادة الرفع؟ تواصل مع فريق التشغيل.",
         "distance": "المسافة",
         "upload_hint": "انقر أعلاه لالتقاط صورة أو الاختيار من المعرض",
+        "resumable_pick": "التقط صورة",
+        "resumable_uploading": "جارٍ الرفع",
+        "resumable_waiting": "انقطع الاتصال — سيتم الاستئناف تلقائيًا...",
+        "resumable_done": "اكتمل الرفع. اضغط متابعة بالأسفل.",
+        "resumable_failed": "فشل الرفع — يرجى التقاط الصورة مرة أخرى",
+        "resumable_continue": "متابعة",
     },
     "ur": {
         "confirm_details": "شپمنٹ کی تفصیلات",
@@ -166,6 +235,10 @@ TRANSLATIONS = {
         "reason_bright": "بہت روشن — براہ راست روشنی سے بچیں",
         "reason_low_res": "ریزولیوشن کم — دستاویز کے قریب جائیں",
         "reason_no_document": "دستاویز نہیں ملی — پوری دستاویز دکھائیں",
+        "reason_too_large": "تصویر کی فائل بہت بڑی ہے — کیمرے کی عام سیٹنگ استعمال کریں",
+        "reason_unreadable": "یہ تصویر پڑھی نہیں جا سکی — براہ کرم نئی تصویر لیں",
+        "reason_rate_limited": "بہت زیادہ اپ لوڈز — ایک منٹ انتظار کریں اور دوبارہ کوشش کریں",
+        "reason_storage_unavailable": "اسٹوریج سے رابطہ نہیں ہو سکا — تھوڑی دیر انتظار کریں اور دوبارہ کوشش کریں",
         "attempts_remaining": "{} کوششیں باقی",
         "retake": "دوبارہ تصویر لیں",
         "fallback_title": "اس کے بجائے ٣ تصاویر اپ لوڈ کریں",
@@ -183,12 +256,25 @@ TRANSLATIONS = {
         "already_submitted_note": "دوبارہ اپ لوڈ کرنا ہے؟ ڈسپیچ سے رابطہ کریں۔",
         "distance": "فاصلہ",
         "upload_hint": "اوپر ٹیپ کریں تصویر لینے یا گیلری سے منتخب کرنے کے لیے",
+        "resumable_pick": "تصویر لیں",
+        "resumable_uploading": "اپ لوڈ ہو رہا ہے",
+        "resumable_waiting": "کنکشن ٹوٹ گیا — خودبخود دوبارہ شروع ہوگا...",
+        "resumable_done": "اپ لوڈ مکمل۔ نیچے جاری رکھیں دبائیں۔",
+        "resumable_failed": "اپ لوڈ ناکام — براہ کرم تصویر دوبارہ لیں",
+        "resumable_continue": "جاری رکھیں",
     },
 }
 
 
+templates.set_translations(TRANSLATIONS)
+
+
+def current_language() -> str:
+    return st.session_state.get("language", "en")
+
+
 def t(key: str) -> str:
-    lang = st.session_state.get("language", "en")
+    lang = current_language()
     return TRANSLATIONS.get(lang, TRANSLATIONS["en"]).get(key, key)
 
 
@@ -391,93 +477,219 @@ div[data-testid="stMetricValue"] { direction: ltr; }
 # ─────────────────────────────────────────────
 # DATA FETCHING
 # ─────────────────────────────────────────────
-@st.cache_data(ttl=300)
-def fetch_shipment_data() -> pd.DataFrame:
+def fetch_shipment_records() -> list[dict]:
+    requests = metrics.lazy_import("requests")
+    pd = metrics.lazy_import("pandas")
     try:
-        resp = requests.get(REDASH_API_URL, timeout=30)
-        resp.raise_for_status()
-        return pd.read_csv(BytesIO(resp.content))
+        with metrics.timer("pod_redash_fetch_seconds"):
+            resp = requests.get(REDASH_API_URL, timeout=30)
+            resp.raise_for_status()
     except Exception:
-        return pd.DataFrame()
+        metrics.inc("pod_redash_fetch_errors_total")
+        raise
+    metrics.inc("pod_redash_fetch_bytes_total", len(resp.content))
+    with metrics.timer("pod_csv_parse_seconds"):
+        df = pd.read_csv(BytesIO(resp.content))
+        # Plain JSON types (NaN -> None) so records can go straight into the snapshot
+        return json.loads(df.to_json(orient="records"))
+
+
+def fetch_shipment_changes(since: str | None) -> tuple[list[dict], list[str], str]:
+    """Drop-off shipments changed since the watermark (all of them when since is None).
+
+    Returns (records to upsert, keys that left drop-off, new watermark).
+    """
+    if since is None:
+        # The watermark is the newest drop-off updated_at, a server timestamp. It can lag
+        # behind other rows, so the first delta re-reads those; the merge is idempotent.
+        rows, watermark = redash.fetch(REDASH_DELTA_URL, redash.DROPOFF_STATUS)
+        return rows, [], watermark
+    rows, watermark = redash.fetch(REDASH_DELTA_URL, redash.ANY_STATUS, redash.overlap(since))
+    upserts = [r for r in rows if r.get("status") == redash.DROPOFF_STATUS]
+    removed = [r["key"] for r in rows if r.get("status") != redash.DROPOFF_STATUS]
+    return upserts, removed, max(watermark, since)
+
+
+def get_shipment_store() -> shipment_store.ShipmentStore:
+    return shipment_store.get_store(
+        fetch_shipment_records, SHIPMENT_SNAPSHOT_PATH, SHIPMENT_TTL_SECONDS, boot_from_snapshot=FAST_START,
+        fetch_changes=fetch_shipment_changes if REDASH_DELTA_URL else None,
+        full_sync_seconds=SHIPMENT_FULL_SYNC_SECONDS,
+    )
 
 
+@metrics.timed("pod_get_shipment_seconds")
 def get_shipment(shipment_key: str) -> dict | None:
-    df = fetch_shipment_data()
-    if df.empty:
-        return None
-    match = df[df["key"] == shipment_key]
-    if match.empty:
-        return None
-    return match.iloc[0].to_dict()
+    return get_shipment_store().get(shipment_key)
 
 
 # ─────────────────────────────────────────────
 # IMAGE QUALITY ANALYSIS
 # ─────────────────────────────────────────────
-def analyze_image_quality(image_bytes: bytes) -> dict:
-    nparr = np.frombuffer(image_bytes, np.uint8)
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+def default_thresholds() -> dict:
+    return {
+        "BLUR_THRESHOLD": BLUR_THRESHOLD,
+        "DARK_THRESHOLD": DARK_THRESHOLD,
+        "BRIGHT_THRESHOLD": BRIGHT_THRESHOLD,
+        "MIN_EDGE_RATIO": MIN_EDGE_RATIO,
+    }
+
+
+def quality_thresholds(width: int, height: int) -> dict:
+    """Thresholds for a photo of this declared size: calibrated per segment if enabled."""
+    if not ADAPTIVE_THRESHOLDS:
+        return default_thresholds()
+    return calibration.get_thresholds(POD_STORAGE_DIR).lookup(width, height, default_thresholds())
+
+
+@metrics.timed("pod_quality_analysis_seconds")
+def analyze_image_quality(image_bytes: bytes, keep_artifacts: bool = False) -> dict:
+    cv2 = metrics.lazy_import("cv2")
+    np = metrics.lazy_import("numpy")
+    try:
+        info = admission.inspect(image_bytes)
+    except admission.AdmissionError as e:
+        metrics.inc("pod_quality_checks_total", result="rejected")
+        return {"passed": False, "reasons": [e.reason], "scores": {}}
+    with metrics.timer("pod_quality_stage_seconds", stage="decode"):
+        img = admission.decode(image_bytes, info)
     if img is None:
+        metrics.inc("pod_quality_checks_total", result="undecodable")
         return {"passed": False, "reasons": ["reason_no_document"], "scores": {}}
 
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    with metrics.timer("pod_quality_stage_seconds", stage="grayscale"):
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
     h, w = img.shape[:2]
     reasons = []
     scores = {}
 
-    scores["resolution"] = f"{w}x{h}"
-    if w < MIN_RESOLUTION[0] or h < MIN_RESOLUTION[1]:
+    # Judge resolution on the declared size; very large JPEGs are decoded reduced.
+    # The header size ignores EXIF orientation, so compare short and long sides.
+    scores["resolution"] = f"{info['width']}x{info['height']}"
+    limits = quality_thresholds(info["width"], info["height"])
+    short_side, long_side = sorted((info["width"], info["height"]))
+    if short_side < min(MIN_RESOLUTION) or long_side < max(MIN_RESOLUTION):
         reasons.append("reason_low_res")
 
-    laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
+    with metrics.timer("pod_quality_stage_seconds", stage="laplacian"):
+        laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
     scores["sharpness"] = round(laplacian_var, 1)
-    if laplacian_var < BLUR_THRESHOLD:
+    if laplacian_var < limits["BLUR_THRESHOLD"]:
         reasons.append("reason_blurry")
 
     mean_brightness = np.mean(gray)
     scores["brightness"] = round(mean_brightness, 1)
-    if mean_brightness < DARK_THRESHOLD:
+    if mean_brightness < limits["DARK_THRESHOLD"]:
         reasons.append("reason_dark")
-    elif mean_brightness > BRIGHT_THRESHOLD:
+    elif mean_brightness > limits["BRIGHT_THRESHOLD"]:
         reasons.append("reason_bright")
 
-    edges = cv2.Canny(gray, 50, 150)
+    with metrics.timer("pod_quality_stage_seconds", stage="canny"):
+        edges = cv2.Canny(gray, 50, 150)
     edge_ratio = np.count_nonzero(edges) / (h * w)
     scores["edge_ratio"] = round(edge_ratio, 4)
-    if edge_ratio < MIN_EDGE_RATIO:
+    if edge_ratio < limits["MIN_EDGE_RATIO"]:
         reasons.append("reason_no_document")
 
     block_size = 4
     bh, bw = h // block_size, w // block_size
     blurry_blocks = 0
     total_blocks = block_size * block_size
-    for i in range(block_size):
-        for j in range(block_size):
-            block = gray[i * bh:(i + 1) * bh, j * bw:(j + 1) * bw]
-            if cv2.Laplacian(block, cv2.CV_64F).var() < BLUR_THRESHOLD * 0.5:
-                blurry_blocks += 1
+    with metrics.timer("pod_quality_stage_seconds", stage="block_blur"):
+        for i in range(block_size):
+            for j in range(block_size):
+                block = gray[i * bh:(i + 1) * bh, j * bw:(j + 1) * bw]
+                if cv2.Laplacian(block, cv2.CV_64F).var() < limits["BLUR_THRESHOLD"] * 0.5:
+                    blurry_blocks += 1
     if blurry_blocks > total_blocks * 0.6 and "reason_blurry" not in reasons:
         reasons.append("reason_blurry")
 
-    return {"passed": len(reasons) == 0, "reasons": reasons, "scores": scores}
+    metrics.inc("pod_quality_checks_total", result="pass" if not reasons else "fail")
+    for reason in reasons:
+        metrics.inc("pod_quality_rejections_total", reason=reason)
+    result = {"passed": len(reasons) == 0, "reasons": reasons, "scores": scores}
+    if keep_artifacts:
+        # Decoded frame + edge map, reused by docproc instead of decoding again
+        result["artifacts"] = {"image": img, "edges": edges}
+    return result
 
 
 # ─────────────────────────────────────────────
 # STORAGE
 # ─────────────────────────────────────────────
-def save_pod_image(shipment_key: str, image_bytes: bytes, index: int = 0) -> str:
-    shipment_dir = os.path.join(POD_STORAGE_DIR, shipment_key)
-    os.makedirs(shipment_dir, exist_ok=True)
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filepath = os.path.join(shipment_dir, f"pod_{index}_{timestamp}.jpg")
+def write_pod_file(shipment_key: str, name: str, data: bytes) -> str:
+    """Store one shipment file, on its shard nodes or locally. Returns its recorded path."""
+    filepath = os.path.join(POD_STORAGE_DIR, shipment_key, name)
+    if SHARD_NODES:
+        shards.get_client(SHARD_NODES, SHARD_REPLICAS).put(shipment_key, name, data)
+        return filepath
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
     with open(filepath, "wb") as f:
-        f.write(image_bytes)
+        f.write(data)
     return filepath
 
 
-def save_pod_metadata(shipment_key: str, shipment_data: dict, file_paths: list, mode: str):
-    shipment_dir = os.path.join(POD_STORAGE_DIR, shipment_key)
-    os.makedirs(shipment_dir, exist_ok=True)
+def read_pod_file(filepath: str) -> bytes | None:
+    """A stored file by its recorded path: from its shard nodes, directory or archive pack."""
+    if SHARD_NODES:
+        shipment_dir, name = os.path.split(filepath)
+        return shards.get_client(SHARD_NODES, SHARD_REPLICAS).get(os.path.basename(shipment_dir), name)
+    return archive.read_file(filepath)
+
+
+@metrics.timed("pod_save_image_seconds")
+def save_pod_image(shipment_key: str, image_bytes: bytes, index: int = 0, ext: str = "jpg",
+                   suffix: str = "", detect_duplicates: bool = True) -> str:
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    filepath = write_pod_file(shipment_key, f"pod_{index}_{timestamp}{suffix}.{ext}", image_bytes)
+    metrics.inc("pod_saved_image_bytes_total", len(image_bytes))
+    if detect_duplicates:
+        try:
+            phash.index_image(POD_STORAGE_DIR, shipment_key, filepath, image_bytes, DUPLICATE_MAX_DISTANCE)
+        except OSError:
+            pass  # duplicate detection must never block a submission
+    return filepath
+
+
+def save_single_pod(shipment_key: str, image_bytes: bytes, quality_result: dict) -> tuple[list, dict]:
+    """Store a photo that passed the quality check, cropped/re-encoded if enabled.
+
+    Returns (file_paths, extra metadata).
+    """
+    artifacts = quality_result.get("artifacts")
+    if not POD_PROCESSING_ENABLED or not artifacts:
+        return [save_pod_image(shipment_key, image_bytes, index=0)], {}
+    try:
+        processed, info = docproc.process_document(
+            artifacts["image"], artifacts["edges"], POD_TARGET_BYTES, POD_MAX_SIDE
+        )
+    except Exception:  # noqa: BLE001 - cv2.error/ValueError; never lose the POD over processing
+        metrics.inc("pod_docproc_errors_total")
+        return [save_pod_image(shipment_key, image_bytes, index=0)], {}
+    filepath = save_pod_image(shipment_key, processed, index=0, ext="webp")
+    info["original_bytes"] = len(image_bytes)
+    info["stored_bytes"] = len(processed)
+    info["original_path"] = None
+    if POD_KEEP_ORIGINAL:
+        info["original_path"] = save_pod_image(
+            shipment_key, image_bytes, index=0, suffix="_original", detect_duplicates=False
+        )
+    return [filepath], {"processing": info}
+
+
+def save_pod_metadata(shipment_key: str, shipment_data: dict, file_paths: list, mode: str,
+                      extra: dict | None = None, language: str | None = None):
+    phash_index = phash.get_index(POD_STORAGE_DIR)
+    duplicate_matches = [
+        {
+            "file_path": fp,
+            "matched_shipment_key": match["shipment_key"],
+            "matched_file": match["file"],
+            "distance": match["distance"],
+        }
+        for fp in file_paths
+        for match in phash_index.pop_matches(fp)
+    ]
     metadata = {
         "shipment_key": shipment_key,
         "job_key": shipment_data.get("job_key", ""),
@@ -491,59 +703,64 @@ def save_pod_metadata(shipment_key: str, shipment_data: dict, file_paths: list,
         "commodity": shipment_data.get("commodity", ""),
         "upload_mode": mode,
         "file_paths": file_paths,
+        "duplicate_matches": duplicate_matches,
         "uploaded_at": datetime.now().isoformat(),
-        "language": st.session_state.get("language", "en"),
+        "language": language or st.session_state.get("language", "en"),
+        **(extra or {}),
     }
-    meta_path = os.path.join(shipment_dir, "metadata.json")
-    with open(meta_path, "w", encoding="utf-8") as f:
-        json.dump(metadata, f, ensure_ascii=False, indent=2)
+    meta_path = write_pod_file(
+        shipment_key, "metadata.json", json.dumps(metadata, ensure_ascii=False, indent=2).encode("utf-8")
+    )
+    try:
+        eventlog.get_log(POD_STORAGE_DIR).append(eventlog.submission_record(metadata, meta_path))
+    except OSError as e:
+        # metadata.json is the source of truth; `eventlog.py backfill` can reconcile
+        eventlog.logger.warning("event log append failed for %s: %s", shipment_key, e)
+        metrics.inc("pod_eventlog_errors_total")
     return meta_path
 
 
+def record_quality_check(shipment: dict, result: dict, source: str = "ui", attempt: int | None = None):
+    """Append the verdict to the event log for the ops dashboard; never blocks on fsync."""
+    try:
+        eventlog.get_log(POD_STORAGE_DIR).append(eventlog.quality_record(shipment, result, source, attempt), wait=False)
+    except OSError as e:
+        eventlog.logger.warning("event log append failed for %s: %s", shipment.get("key"), e)
+        metrics.inc("pod_eventlog_errors_total")
+
+
 def get_existing_submission(shipment_key: str) -> dict | None:
-    meta_path = os.path.join(POD_STORAGE_DIR, shipment_key, "metadata.json")
-    if os.path.exists(meta_path):
+    """The shipment's metadata, or None if not submitted. Raises ShardError if storage is unreachable."""
+    if SHARD_NODES:
+        data = shards.get_client(SHARD_NODES, SHARD_REPLICAS).get(shipment_key, "metadata.json")
         try:
-            with open(meta_path, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except (json.JSONDecodeError, IOError):
+            return json.loads(data) if data is not None else None
+        except json.JSONDecodeError:
             return None
-    return None
+    meta_path = os.path.join(POD_STORAGE_DIR, shipment_key, "metadata.json")
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return archive.get_store(POD_STORAGE_DIR).read_metadata(shipment_key)
+    except (json.JSONDecodeError, IOError):
+        return None
 
 
 # ─────────────────────────────────────────────
 # UI HELPERS
 # ─────────────────────────────────────────────
 def render_header():
-    col1, col2, col3 = st.columns([1, 1, 1])
-    with col2:
-        if os.path.exists("trella.png"):
-            st.image("trella.png", width=120)
-        else:
-            st.markdown('<div class="app-logo" style="text-align:center;">trella<span>.</span></div>', unsafe_allow_html=True)
-    
-    st.markdown("""
-    <div class="app-header" style="padding-top: 0;">
-        <div class="app-subtitle">Proof of Delivery</div>
-    </div>
-    """, unsafe_allow_html=True)
+    st.markdown(templates.render("header", current_language()), unsafe_allow_html=True)
 
 
 def render_steps(current: int):
-    dots = []
-    for i in range(1, 4):
-        if i < current:
-            dots.append('<div class="step-dot done"></div>')
-        elif i == current:
-            dots.append('<div class="step-dot active"></div>')
-        else:
-            dots.append('<div class="step-dot"></div>')
-    st.markdown(f'<div class="steps">{"".join(dots)}</div>', unsafe_allow_html=True)
+    st.markdown(templates.steps_html(current), unsafe_allow_html=True)
 
 
 def apply_rtl():
     if is_rtl():
-        st.markdown(RTL_CSS, unsafe_allow_html=True)
+        st.markdown(templates.minify_css(RTL_CSS), unsafe_allow_html=True)
 
 
 # ─────────────────────────────────────────────
@@ -588,88 +805,40 @@ def render_confirmation(shipment: dict):
     render_header()
     render_steps(2)
 
-    rtl_class = "rtl" if is_rtl() else ""
-    carrier = shipment.get("carrier", "N/A")
-    mobile = shipment.get("carrier_mobile", "N/A")
-    plate = shipment.get("vehicle_plate", "N/A")
+    lang = current_language()
 
     # Driver card
-    st.markdown(f"""
-    <div class="pod-card pod-card-blue {rtl_class}">
-        <div style="display:flex; flex-direction:column; align-items:center; gap:0.5rem; margin-bottom:0.75rem; text-align:center;">
-            <div style="width:56px;height:56px;border-radius:50%;background:var(--trella-light);
-                display:flex;align-items:center;justify-content:center;font-size:1.6rem;flex-shrink:0;">🚛</div>
-            <div>
-                <div style="font-size:1.15rem;font-weight:700;color:#1F2937; margin-bottom: 2px;">{carrier}</div>
-                <div style="font-size:0.9rem;color:var(--trella-gray);">{mobile} &nbsp;·&nbsp; {plate}</div>
-            </div>
-        </div>
-        <div style="text-align: center;">
-            <span class="status-badge status-dropoff">● {t('at_dropoff')}</span>
-        </div>
-    </div>
-    """, unsafe_allow_html=True)
+    st.markdown(templates.render(
+        "driver_card", lang,
+        carrier=shipment.get("carrier", "N/A"),
+        mobile=shipment.get("carrier_mobile", "N/A"),
+        plate=shipment.get("vehicle_plate", "N/A"),
+    ), unsafe_allow_html=True)
 
     # Route card
-    pickup_city = shipment.get("pickup_city", "")
-    pickup_name = shipment.get("pickup_name", "")
-    dest_city = shipment.get("destination_city", "")
-    dest_name = shipment.get("destination_name", "")
-
-    st.markdown(f"""
-    <div class="route-card {rtl_class}">
-        <div class="route-point">
-            <div class="route-dot origin"></div>
-            <div>
-                <div class="route-city">{pickup_city}</div>
-                <div class="route-name">{pickup_name}</div>
-            </div>
-        </div>
-        <div class="route-line"></div>
-        <div class="route-point">
-            <div class="route-dot dest"></div>
-            <div>
-                <div class="route-city">{dest_city}</div>
-                <div class="route-name">{dest_name}</div>
-            </div>
-        </div>
-    </div>
-    """, unsafe_allow_html=True)
+    st.markdown(templates.render(
+        "route_card", lang,
+        pickup_city=shipment.get("pickup_city", ""),
+        pickup_name=shipment.get("pickup_name", ""),
+        dest_city=shipment.get("destination_city", ""),
+        dest_name=shipment.get("destination_name", ""),
+    ), unsafe_allow_html=True)
 
     # Details card
-    entity = shipment.get("entity", "N/A")
-    commodity = shipment.get("commodity", "N/A")
-    weight = shipment.get("weight", 0)
     distance = shipment.get("distance", 0)
     try:
         distance = f"{float(distance):,.0f} km"
     except (ValueError, TypeError):
         distance = str(distance)
 
-    st.markdown(f"""
-    <div class="pod-card {rtl_class}">
-        <div class="detail-row">
-            <span class="detail-label">{t('shipper')}</span>
-            <span class="detail-value">{entity}</span>
-        </div>
-        <div class="detail-row">
-            <span class="detail-label">{t('commodity')}</span>
-            <span class="detail-value">{commodity}</span>
-        </div>
-        <div class="detail-row">
-            <span class="detail-label">{t('weight')}</span>
-            <span class="detail-value">{weight} t</span>
-        </div>
-        <div class="detail-row">
-            <span class="detail-label">{t('distance')}</span>
-            <span class="detail-value">{distance}</span>
-        </div>
-        <div class="detail-row">
-            <span class="detail-label">{t('shipment_ref')}</span>
-            <span class="detail-value" style="font-size:0.8rem;font-family:monospace;">{shipment.get('key', 'N/A')}</span>
-        </div>
-    </div>
-    """, unsafe_allow_html=True)
+    st.markdown(templates.render(
+        "details_card", lang,
+        entity=shipment.get("entity", "N/A"),
+        commodity=shipment.get("commodity", "N/A"),
+        weight=shipment.get("weight", 0),
+        distance=distance,
+        key=shipment.get("key", "N/A"),
+    ), unsafe_allow_html=True)
 
     st.markdown('<div class="divider"></div>', unsafe_allow_html=True)
 
@@ -683,12 +852,30 @@ def render_confirmation(shipment: dict):
 # ─────────────────────────────────────────────
 # STEP 3 — POD UPLOAD (native camera)
 # ─────────────────────────────────────────────
+def upload_rejection(shipment_key: str, upload_id: str, image_bytes: bytes) -> str | None:
+    """Admission check for a new upload: rate limits (charged once per upload) and size caps."""
+    admitted = st.session_state.setdefault("admitted_uploads", set())
+    try:
+        if upload_id not in admitted:
+            admission.admit_upload(shipment_key)
+            admitted.add(upload_id)
+        admission.inspect(image_bytes)
+    except admission.AdmissionError as e:
+        return e.reason
+    return None
+
+
+def render_rejection(reason: str):
+    reasons_html = f"<div>⚠️ {t(reason)}</div>"
+    st.markdown(templates.render("quality_fail", current_language(), reasons_html=reasons_html), unsafe_allow_html=True)
+
+
 def render_upload(shipment: dict):
     apply_rtl()
     render_header()
     render_steps(3)
 
-    rtl_class = "rtl" if is_rtl() else ""
+    lang = current_language()
 
     if "quality_attempts" not in st.session_state:
         st.session_state.quality_attempts = 0
@@ -696,16 +883,12 @@ def render_upload(shipment: dict):
         st.session_state.in_fallback_mode = False
 
     if st.session_state.in_fallback_mode:
+        upload_buffers.release("pod")
         render_fallback_upload(shipment)
         return
 
-    st.markdown(f'<h3 style="margin:0 0 0.25rem; text-align: center;">{t("upload_title")}</h3>', unsafe_allow_html=True)
-
-    # Tips as compact pills
-    tips = ["tip_surface", "tip_steady", "tip_edges", "tip_glare", "tip_lens", "tip_light"]
-    icons = ["☀️", "📐", "📄", "🚫", "🔍", "🌤️"]
-    pills = "".join(f'<span class="tip-pill">{icons[i]} {t(tip)}</span>' for i, tip in enumerate(tips))
-    st.markdown(f'<div class="tips-grid">{pills}</div>', unsafe_allow_html=True)
+    # Title + tips as compact pills
+    st.markdown(templates.render("upload_intro", lang), unsafe_allow_html=True)
 
     # Attempts remaining
     remaining = MAX_QUALITY_ATTEMPTS - st.session_state.quality_attempts
@@ -717,86 +900,126 @@ def render_upload(shipment: dict):
 
     st.markdown('<div class="divider"></div>', unsafe_allow_html=True)
 
-    # ── File uploader (triggers native camera on mobile via OS file picker) ──
-    uploaded_file = st.file_uploader(
-        t("take_photo"),
-        type=["jpg", "jpeg", "png", "heic", "heif"],
-        key=f"pod_upload_{st.session_state.quality_attempts}",
-        help=t("upload_hint"),
-    )
-
-    st.markdown(f"""
-    <p style="text-align:center; font-size:0.82rem; color:var(--trella-gray); margin-top:0.25rem;">
-        📷 {t('upload_hint')}
-    </p>
-    """, unsafe_allow_html=True)
+    if RESUMABLE_ENABLED:
+        image_bytes = render_resumable_input(shipment)
+        upload_id = st.session_state.get("resumable_upload_id")
+    else:
+        # ── File uploader (triggers native camera on mobile via OS file picker) ──
+        uploaded_file = st.file_uploader(
+            t("take_photo"),
+            type=["jpg", "jpeg", "png", "heic", "heif"],
+            key=f"pod_upload_{st.session_state.quality_attempts}",
+            help=t("upload_hint"),
+        )
 
-    if uploaded_file is not None:
-        image_bytes = uploaded_file.getvalue()
-        st.image(image_bytes, use_container_width=True)
+        st.markdown(templates.render("upload_hint", lang), unsafe_allow_html=True)
+        # A new attempt's uploader replaces the previous one; drop the rejected photo
+        upload_buffers.track("pod", uploaded_file)
+        image_bytes = uploaded_file.getvalue() if uploaded_file is not None else None
+        upload_id = uploaded_file.file_id if uploaded_file is not None else None
+
+    if image_bytes is not None:
+        rejection = upload_rejection(shipment["key"], upload_id, image_bytes)
+        if rejection == "reason_rate_limited":
+            # Not the driver's photo at fault; don't spend a quality attempt on it
+            render_rejection(rejection)
+            return
+        if rejection is None:
+            st.image(image_bytes, use_container_width=True)
 
         with st.spinner(t("analyzing")):
-            result = analyze_image_quality(image_bytes)
+            result = analyze_image_quality(image_bytes, keep_artifacts=POD_PROCESSING_ENABLED)
+        # Reruns re-analyse the same upload; record each upload's verdict once
+        recorded = st.session_state.setdefault("recorded_checks", set())
+        if upload_id not in recorded:
+            recorded.add(upload_id)
+            record_quality_check(shipment, result, attempt=st.session_state.quality_attempts + 1)
 
         if result["passed"]:
-            st.markdown(f"""
-            <div class="quality-pass">
-                <span style="font-size:1.2rem;">✅</span> {t('quality_passed')}
-            </div>
-            """, unsafe_allow_html=True)
+            st.markdown(templates.render("quality_pass", lang), unsafe_allow_html=True)
 
             if st.button(t("submit_pod"), type="primary", use_container_width=True):
                 with st.spinner("..."):
-                    filepath = save_pod_image(shipment["key"], image_bytes, index=0)
-                    save_pod_metadata(shipment["key"], shipment, [filepath], mode="single")
+                    try:
+                        file_paths, extra = save_single_pod(shipment["key"], image_bytes, result)
+                        save_pod_metadata(shipment["key"], shipment, file_paths, mode="single", extra=extra)
+                    except shards.ShardError:
+                        # The photo is still in the uploader; the driver just taps submit again
+                        render_rejection("reason_storage_unavailable")
+                        return
+                    upload_buffers.release()
+                    discard_resumable_upload()
                     st.session_state.step = "success"
                     st.rerun()
         else:
             reasons_html = "".join(f"<div>⚠️ {t(r)}</div>" for r in result["reasons"])
-            st.markdown(f"""
-            <div class="quality-fail {rtl_class}">
-                <div style="font-weight:700; margin-bottom:0.5rem;">❌ {t('quality_failed')}</div>
-                {reasons_html}
-            </div>
-            """, unsafe_allow_html=True)
+            st.markdown(templates.render("quality_fail", lang, reasons_html=reasons_html), unsafe_allow_html=True)
 
+            discard_resumable_upload()
             st.session_state.quality_attempts += 1
             if st.session_state.quality_attempts >= MAX_QUALITY_ATTEMPTS:
                 st.session_state.in_fallback_mode = True
                 st.rerun()
             else:
                 st.markdown(f'<span class="attempts-badge">🔄 {t("retake")}</span>', unsafe_allow_html=True)
+                if RESUMABLE_ENABLED:
+                    st.button(t("resumable_pick"), use_container_width=True)  # fresh upload widget
+
+
+def render_resumable_input(shipment: dict) -> bytes | None:
+    """Chunked, resumable upload widget; returns the photo once fully received."""
+    store = resumable.get_store(POD_STORAGE_DIR)
+    upload_id = st.session_state.get("resumable_upload_id")
+    if upload_id is None:
+        upload_id = st.session_state.resumable_upload_id = store.reserve(shipment["key"])
+
+    path = store.complete_path(upload_id)
+    if path is not None:
+        with open(path, "rb") as f:
+            return f.read()
+
+    labels = {name: t(f"resumable_{name}") for name in ("pick", "uploading", "waiting", "done", "failed")}
+    components.html(resumable.client_html(RESUMABLE_PUBLIC_URL, upload_id, labels, RESUMABLE_PORT), height=130)
+    st.button(t("resumable_continue"), use_container_width=True)  # rerun picks up the finished upload
+    return None
+
+
+def discard_resumable_upload():
+    upload_id = st.session_state.pop("resumable_upload_id", None)
+    if upload_id is not None:
+        resumable.get_store(POD_STORAGE_DIR).discard(upload_id)
 
 
 def render_fallback_upload(shipment: dict):
     apply_rtl()
-    rtl_class = "rtl" if is_rtl() else ""
-
-    st.markdown(f"""
-    <div class="quality-fail {rtl_class}" style="border-color: var(--trella-orange); background: #FFFBEB;">
-        <div style="font-weight:700; font-size:1.05rem; margin-bottom:0.35rem; color: #92400E;">
-            📸 {t('fallback_title')}
-        </div>
-        <div style="color: #78350F;">{t('fallback_message')}</div>
-    </div>
-    """, unsafe_allow_html=True)
+    st.markdown(templates.render("fallback_banner", current_language()), unsafe_allow_html=True)
 
     photos = []
     for i in range(1, 4):
         label = f"{t('fallback_photo').format(i)} / 3"
         photo = st.file_uploader(label, type=["jpg", "jpeg", "png", "heic", "heif"], key=f"fallback_{i}")
+        upload_buffers.track(f"fallback_{i}", photo)
         if photo:
+            rejection = upload_rejection(shipment["key"], photo.file_id, photo.getvalue())
+            if rejection is not None:
+                render_rejection(rejection)
+                continue
             photos.append(photo)
             st.image(photo, caption=label, use_container_width=True)
 
     if len(photos) == 3:
         if st.button(t("submit_fallback"), type="primary", use_container_width=True):
             with st.spinner("..."):
-                file_paths = []
-                for idx, photo in enumerate(photos):
-                    filepath = save_pod_image(shipment["key"], photo.getvalue(), index=idx)
-                    file_paths.append(filepath)
-                save_pod_metadata(shipment["key"], shipment, file_paths, mode="fallback_triple")
+                try:
+                    file_paths = []
+                    for idx, photo in enumerate(photos):
+                        filepath = save_pod_image(shipment["key"], photo.getvalue(), index=idx)
+                        file_paths.append(filepath)
+                    save_pod_metadata(shipment["key"], shipment, file_paths, mode="fallback_triple")
+                except shards.ShardError:
+                    render_rejection("reason_storage_unavailable")
+                    return
+                upload_buffers.release()
                 st.session_state.step = "success"
                 st.rerun()
     elif len(photos) > 0:
@@ -822,47 +1045,29 @@ def render_already_submitted(submission: dict, shipment: dict):
         formatted_date = uploaded_at
 
     file_count = len(submission.get("file_paths", []))
-    rtl_class = "rtl" if is_rtl() else ""
-
-    st.markdown(f"""
-    <div class="success-container">
-        <div class="success-check">
-            <svg viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="3"
-                 stroke-linecap="round" stroke-linejoin="round">
-                <polyline points="20 6 9 17 4 12"></polyline>
-            </svg>
-        </div>
-        <div class="success-title">{t('already_submitted_title')}</div>
-        <div class="success-msg">{t('already_submitted_msg').format(formatted_date)}</div>
-        <div style="margin-top:0.5rem;">
-            <span class="status-badge status-dropoff">{file_count} photo{'s' if file_count != 1 else ''}</span>
-        </div>
-    </div>
-    """, unsafe_allow_html=True)
+    lang = current_language()
+
+    st.markdown(templates.render(
+        "already_submitted", lang,
+        submitted_msg=t("already_submitted_msg").format(formatted_date),
+        file_count=file_count,
+        plural="s" if file_count != 1 else "",
+    ), unsafe_allow_html=True)
 
     file_paths = submission.get("file_paths", [])
     if file_paths:
         cols = st.columns(min(len(file_paths), 3))
         for idx, fp in enumerate(file_paths):
-            if os.path.exists(fp):
+            data = read_pod_file(fp)
+            if data is not None:
                 with cols[idx % 3]:
-                    st.image(fp, use_container_width=True)
+                    st.image(data, use_container_width=True)
 
-    st.markdown(f"""
-    <div class="pod-card pod-card-accent {rtl_class}" style="margin-top:1rem;">
-        <div class="detail-row">
-            <span class="detail-label">{t('driver_name')}</span>
-            <span class="detail-value">{shipment.get('carrier', 'N/A')}</span>
-        </div>
-        <div class="detail-row">
-            <span class="detail-label">{t('destination')}</span>
-            <span class="detail-value">{shipment.get('destination_city', '')}</span>
-        </div>
-    </div>
-    <p style="text-align:center; font-size:0.85rem; color:var(--trella-gray); margin-top:1rem;">
-        {t('already_submitted_note')}
-    </p>
-    """, unsafe_allow_html=True)
+    st.markdown(templates.render(
+        "already_submitted_details", lang,
+        carrier=shipment.get("carrier", "N/A"),
+        destination_city=shipment.get("destination_city", ""),
+    ), unsafe_allow_html=True)
 
 
 # ─────────────────────────────────────────────
@@ -872,18 +1077,7 @@ def render_success():
     apply_rtl()
     render_header()
 
-    st.markdown(f"""
-    <div class="success-container">
-        <div class="success-check">
-            <svg viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="3"
-                 stroke-linecap="round" stroke-linejoin="round">
-                <polyline points="20 6 9 17 4 12"></polyline>
-            </svg>
-        </div>
-        <div class="success-title">{t('success_title')}</div>
-        <div class="success-msg">{t('success_message')}</div>
-    </div>
-    """, unsafe_allow_html=True)
+    st.markdown(templates.render("success", current_language()), unsafe_allow_html=True)
     st.balloons()
 
 
@@ -897,10 +1091,11 @@ def main():
         layout="centered",
         initial_sidebar_state="collapsed",
     )
-    st.markdown(GLOBAL_CSS, unsafe_allow_html=True)
+    st.markdown(templates.minify_css(GLOBAL_CSS), unsafe_allow_html=True)
 
     params = st.query_params
     shipment_key = params.get("shipment", None)
+    metrics.annotate(shipment=shipment_key)
 
     if not shipment_key:
         render_header()
@@ -916,10 +1111,6 @@ def main():
         st.stop()
 
     shipment = get_shipment(shipment_key)
-    if shipment is None:
-        st.cache_data.clear()
-        shipment = get_shipment(shipment_key)
-
     if shipment is None:
         render_header()
         st.markdown(f"""
@@ -934,7 +1125,13 @@ def main():
         """, unsafe_allow_html=True)
         st.stop()
 
-    existing = get_existing_submission(shipment_key)
+    try:
+        existing = get_existing_submission(shipment_key)
+    except shards.ShardError:
+        # Not knowing is not "not submitted": a second upload would overwrite the first
+        render_header()
+        render_rejection("reason_storage_unavailable")
+        st.stop()
     if existing and st.session_state.get("step") != "success":
         render_already_submitted(existing, shipment)
         st.stop()
@@ -943,6 +1140,7 @@ def main():
         st.session_state.step = "language"
 
     step = st.session_state.step
+    metrics.annotate(step=step)
     if step == "language":
         render_language_selection()
     elif step == "confirm":
@@ -957,4 +1155,8 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    try:
+        with metrics.request_scope("rerun"):
+            main()
+    finally:
+        metrics.mark_first_render(shipments_source=get_shipment_store().source)
@@ -0,0 +1,550 @@
+"""
+POD Archive Packs
+=================
+Compacts old shipment directories (`<storage>/<shipment_key>/`) into large
+append-only pack files, so the number of inodes and the backup time stop
+growing with every shipment.
+
+Packs live in `<storage>/_packs/`. Each `pack-<seq>.pack` is a run of
+entries (16-byte header, key, file name, file bytes) and grows until it
+reaches PACK_BYTES. Its sidecar `pack-<seq>.idx` holds fixed-width records
+(key, name, offset, size, crc32) sorted by (key, name), so a lookup is a
+binary search over the memory-mapped index followed by a slice of the
+memory-mapped pack. No pack file is loaded into memory.
+
+Compaction is crash-safe. Entries are appended and fsynced, then the index
+is rewritten and swapped in with a rename. Only after that are the source
+directories deleted. Bytes after the end recorded in the index belong to an
+interrupted run and are truncated by the next one. Entries are
+self-describing, so a pack whose index is missing, or that is shorter than
+its index says, gets its index rebuilt from the intact entries. Because packs only ever
+grow at the tail, incremental backups (`rsync --append-verify`) copy just
+the new bytes.
+
+Packs are never rewritten, so `forget(key)` (used when a shard node gives
+a key up) appends a tombstone to `_packs/tombstones` instead. It hides the
+key's entries written before it; anything archived for the key later is
+visible again.
+
+File paths in metadata.json, the duplicate index and the event log keep
+their original `<storage>/<key>/<name>` form. `read_file()` and
+`get_existing_submission()` fall back to the packs once the directory is
+gone.
+
+Usage:
+    python archive.py compact --older-than 90        # archive shipments older than 90 days
+    python archive.py compact --older-than 90 --dry-run
+    python archive.py ls <shipment_key>
+    python archive.py cat <shipment_key> metadata.json
+    python archive.py verify                         # re-check every crc32
+"""
+
+import os
+import sys
+import json
+import mmap
+import time
+import shutil
+import struct
+import logging
+import zlib
+import argparse
+import threading
+from datetime import datetime, timedelta
+
+try:
+    import fcntl
+except ImportError:  # non-POSIX: no cross-process lock, run one compactor at a time
+    fcntl = None
+
+import metrics
+
+logger = logging.getLogger("pod.archive")
+
+PACK_BYTES = 1024 * 1024 * 1024
+PUBLISH_EVERY = 1000  # shipments between index swaps during a long run
+KEY_BYTES, NAME_BYTES = 48, 64
+METADATA_FILE = "metadata.json"
+TOMBSTONES_FILE = "tombstones"
+RELOAD_SETTLE_NS = 2_000_000_000
+
+_ENTRY = struct.Struct("<4sHHII")  # magic, key length, name length, crc32, size
+_ENTRY_MAGIC = b"PODP"
+_INDEX_HEADER = struct.Struct("<8sQQ")  # magic, data end, record count
+_INDEX_MAGIC = b"PODIDX1\0"
+_RECORD = struct.Struct(f"<{KEY_BYTES}s{NAME_BYTES}sQII")  # key, name, offset, size, crc32
+_SORT_BYTES = KEY_BYTES + NAME_BYTES
+
+
+def _pack_name(seq: int) -> str:
+    return f"pack-{seq:06d}"
+
+
+class _Pack:
+    """Read-only view of one pack and its index, both memory-mapped."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path + ".idx", "rb") as f:
+            self._idx = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.data_end, self.count = _INDEX_HEADER.unpack_from(self._idx)
+        if magic != _INDEX_MAGIC:
+            raise ValueError(f"{path}.idx: bad magic")
+        self._data = None
+        if self.data_end:
+            with open(path + ".pack", "rb") as f:
+                self._data = mmap.mmap(f.fileno(), self.data_end, access=mmap.ACCESS_READ)
+
+    def _sort_key(self, i: int) -> bytes:
+        start = _INDEX_HEADER.size + i * _RECORD.size
+        return self._idx[start:start + _SORT_BYTES]
+
+    def record(self, i: int) -> tuple[str, str, int, int, int]:
+        key, name, offset, size, crc = _RECORD.unpack_from(self._idx, _INDEX_HEADER.size + i * _RECORD.size)
+        return key.rstrip(b"\0").decode(), name.rstrip(b"\0").decode(), offset, size, crc
+
+    def records(self):
+        for i in range(self.count):
+            yield self.record(i)
+
+    def _lower_bound(self, target: bytes) -> int:
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._sort_key(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def find(self, key: str, name: str) -> tuple | None:
+        target = _RECORD.pack(key.encode(), name.encode(), 0, 0, 0)[:_SORT_BYTES]
+        i = self._lower_bound(target)
+        if i < self.count and self._sort_key(i) == target:
+            return self.record(i)
+        return None
+
+    def names(self, key: str) -> list[str]:
+        padded = key.encode().ljust(KEY_BYTES, b"\0")
+        names = []
+        i = self._lower_bound(padded)
+        while i < self.count and self._sort_key(i)[:KEY_BYTES] == padded:
+            names.append(self.record(i)[1])
+            i += 1
+        return names
+
+    def read(self, offset: int, size: int) -> bytes:
+        return self._data[offset:offset + size]
+
+
+class ArchiveStore:
+    def __init__(self, storage_dir: str):
+        self.storage_dir = storage_dir
+        self.root = os.path.join(storage_dir, "_packs")
+        self._packs: list[_Pack] = []  # newest first
+        self._version = None
+        self._lock = threading.Lock()
+        # key -> (pack, data end) when forgotten; its entries before that are hidden
+        self._tombstones: dict[str, tuple[str, int]] = {}
+        self._tombstones_size = 0
+
+    # ── reader ──
+    def _reload_tombstones(self):
+        """Re-read the tombstones if another process appended to them."""
+        path = os.path.join(self.root, TOMBSTONES_FILE)
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            return
+        if size == self._tombstones_size:
+            return
+        with self._lock:
+            with open(path, "rb") as f:
+                data = f.read()
+            tombstones = {}
+            for line in data.decode(errors="replace").splitlines():
+                parts = line.split()
+                if len(parts) == 3 and parts[2].isdigit():  # a torn last line is ignored
+                    tombstones[parts[0]] = (parts[1], int(parts[2]))
+            self._tombstones, self._tombstones_size = tombstones, len(data)
+
+    def _hidden(self, key: str, pack: _Pack, offset: int) -> bool:
+        tombstone = self._tombstones.get(key)
+        return tombstone is not None and (os.path.basename(pack.path), offset) < tombstone
+
+    def _reload(self):
+        """Re-open the packs if an index was published since the last look."""
+        try:
+            version = os.stat(self.root).st_mtime_ns
+        except FileNotFoundError:
+            return
+        self._reload_tombstones()
+        if version == self._version:
+            return
+        with self._lock:
+            if version == self._version:
+                return
+            packs = []
+            for name in sorted(os.listdir(self.root), reverse=True):
+                if name.startswith("pack-") and name.endswith(".idx"):
+                    try:
+                        packs.append(_Pack(os.path.join(self.root, name[:-len(".idx")])))
+                    except (OSError, ValueError) as e:
+                        logger.warning("skipping pack %s: %s", name, e)
+            # mtime has coarse granularity: keep re-checking until it is safely in the past
+            settled = time.time_ns() - version > RELOAD_SETTLE_NS
+            self._packs, self._version = packs, version if settled else None
+
+    def _find(self, key: str, name: str):
+        self._reload()
+        for pack in self._packs:
+            record = pack.find(key, name)
+            if record is not None:
+                return None if self._hidden(key, pack, record[2]) else (pack, record)
+        return None
+
+    def lookup(self, key: str, name: str) -> dict | None:
+        if len(key.encode()) > KEY_BYTES or len(name.encode()) > NAME_BYTES:
+            return None
+        found = self._find(key, name)
+        if found is None:
+            return None
+        pack, (_, _, offset, size, crc) = found
+        return {"pack": os.path.basename(pack.path), "offset": offset, "size": size, "crc32": crc}
+
+    def read(self, key: str, name: str) -> bytes | None:
+        if len(key.encode()) > KEY_BYTES or len(name.encode()) > NAME_BYTES:
+            return None
+        found = self._find(key, name)
+        if found is None:
+            return None
+        pack, (_, _, offset, size, _) = found
+        metrics.inc("pod_archive_reads_total")
+        return pack.read(offset, size)
+
+    def read_metadata(self, key: str) -> dict | None:
+        data = self.read(key, METADATA_FILE)
+        if data is None:
+            return None
+        try:
+            return json.loads(data)
+        except json.JSONDecodeError:
+            return None
+
+    def list_files(self, key: str) -> list[str]:
+        self._reload()
+        for pack in self._packs:
+            names = pack.names(key)
+            if names:
+                return [] if self._hidden(key, pack, pack.find(key, names[0])[2]) else names
+        return []
+
+    def iter_shipments(self):
+        """Yield (shipment_key, [file names]) for every archived shipment, oldest pack first."""
+        self._reload()
+        for pack in reversed(self._packs):
+            current, names = None, []
+            for key, name, offset, *_ in pack.records():
+                if key != current:
+                    if names:
+                        yield current, names
+                    current, names = key, []
+                    hidden = self._hidden(key, pack, offset)
+                if not hidden:
+                    names.append(name)
+            if names:
+                yield current, names
+
+    def forget(self, key: str):
+        """Hide the key's archived files (a shard node no longer owns it)."""
+        self._reload()
+        if not self.list_files(key):
+            return
+        pack = self._packs[0]
+        bound = (os.path.basename(pack.path), pack.data_end)
+        with self._lock:
+            with open(os.path.join(self.root, TOMBSTONES_FILE), "ab") as f:
+                f.write(f"{key} {bound[0]} {bound[1]}\n".encode())
+                f.flush()
+                os.fsync(f.fileno())
+                self._tombstones[key] = bound
+                self._tombstones_size = f.tell()
+        metrics.inc("pod_archive_forgotten_total")
+
+    # ── compaction ──
+    def _recover(self) -> list[tuple[int, int]]:
+        """Rebuild missing or stale indexes and truncate torn tails. Returns (seq, end)."""
+        packs = []
+        for name in sorted(os.listdir(self.root)):
+            if not (name.startswith("pack-") and name.endswith(".pack")):
+                continue
+            path = os.path.join(self.root, name)
+            seq = int(name[len("pack-"):-len(".pack")])
+            try:
+                with open(path[:-len(".pack")] + ".idx", "rb") as f:
+                    magic, data_end, _ = _INDEX_HEADER.unpack(f.read(_INDEX_HEADER.size))
+            except (OSError, struct.error):
+                logger.warning("%s has no readable index; rebuilding it from the pack", name)
+                data_end = self._rebuild_index(seq)
+            else:
+                if magic != _INDEX_MAGIC:
+                    raise ValueError(f"{name}: bad index magic")
+                if os.path.getsize(path) < data_end:
+                    logger.error("%s is shorter than its index; rebuilding the index from the pack", name)
+                    data_end = self._rebuild_index(seq)
+            if not data_end:
+                for stale in (path, path[:-len(".pack")] + ".idx"):
+                    if os.path.exists(stale):
+                        os.remove(stale)
+                continue
+            if os.path.getsize(path) > data_end:
+                logger.warning("truncating %s to %d bytes", name, data_end)
+                with open(path, "r+b") as f:
+                    f.truncate(data_end)
+            packs.append((seq, data_end))
+        return packs
+
+    def _rebuild_index(self, seq: int) -> int:
+        """Re-index a pack from its entries, up to the first torn or corrupt one. Returns its end."""
+        records: dict[tuple, tuple] = {}
+        data_end = 0
+        with open(os.path.join(self.root, _pack_name(seq) + ".pack"), "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            while data_end + _ENTRY.size <= size:
+                f.seek(data_end)
+                magic, key_len, name_len, crc, length = _ENTRY.unpack(f.read(_ENTRY.size))
+                offset = data_end + _ENTRY.size + key_len + name_len
+                if magic != _ENTRY_MAGIC or key_len > KEY_BYTES or name_len > NAME_BYTES or offset + length > size:
+                    break
+                names = f.read(key_len + name_len)
+                if zlib.crc32(f.read(length)) != crc:
+                    break
+                records[names[:key_len], names[key_len:]] = (names[:key_len], names[key_len:], offset, length, crc)
+                data_end = offset + length
+        if data_end:
+            self._publish(seq, data_end, list(records.values()))
+        metrics.inc("pod_archive_index_rebuilds_total")
+        return data_end
+
+    def _index_records(self, seq: int) -> list[tuple]:
+        with open(os.path.join(self.root, _pack_name(seq) + ".idx"), "rb") as f:
+            data = f.read()
+        _, _, count = _INDEX_HEADER.unpack_from(data)
+        return [_RECORD.unpack_from(data, _INDEX_HEADER.size + i * _RECORD.size) for i in range(count)]
+
+    def _publish(self, seq: int, data_end: int, records: list[tuple]):
+        path = os.path.join(self.root, _pack_name(seq) + ".idx")
+        records.sort(key=lambda r: (r[0], r[1]))
+        with open(path + ".tmp", "wb") as f:
+            f.write(_INDEX_HEADER.pack(_INDEX_MAGIC, data_end, len(records)))
+            f.writelines(_RECORD.pack(*r) for r in records)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        dir_fd = os.open(self.root, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    def _is_archived(self, key: str, files: list[tuple[str, int]]) -> bool:
+        return all((found := self.lookup(key, name)) and found["size"] == size for name, size in files)
+
+    def _candidates(self, cutoff: datetime):
+        """(uploaded_at, key, [(name, size)]) for complete shipment directories older than cutoff."""
+        candidates = []
+        with os.scandir(self.storage_dir) as shipments:
+            for entry in shipments:
+                if not entry.is_dir() or entry.name.startswith("_"):
+                    continue
+                meta_path = os.path.join(entry.path, METADATA_FILE)
+                try:
+                    with open(meta_path, "r", encoding="utf-8") as f:
+                        uploaded_at = datetime.fromisoformat(json.load(f)["uploaded_at"])
+                except (OSError, ValueError, KeyError, TypeError):
+                    continue  # in progress or unreadable; leave it alone
+                if uploaded_at >= cutoff:
+                    continue
+                with os.scandir(entry.path) as it:
+                    children = list(it)
+                if any(not c.is_file(follow_symlinks=False) for c in children):
+                    logger.warning("skipping %s: contains non-regular files", entry.name)
+                    continue
+                files = sorted((c.name, c.stat().st_size) for c in children)
+                if len(entry.name.encode()) > KEY_BYTES or any(len(n.encode()) > NAME_BYTES for n, _ in files):
+                    logger.warning("skipping %s: key or file name too long for the index", entry.name)
+                    continue
+                candidates.append((uploaded_at, entry.name, files))
+        return sorted(candidates)
+
+    def compact(self, older_than_days: float, pack_bytes: int = PACK_BYTES, dry_run: bool = False) -> dict:
+        os.makedirs(self.root, exist_ok=True)
+        lock_fd = os.open(os.path.join(self.root, ".lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    raise RuntimeError("another compaction is running") from None
+            with metrics.timer("pod_archive_compact_seconds"):
+                return self._compact(datetime.now() - timedelta(days=older_than_days), pack_bytes, dry_run)
+        finally:
+            os.close(lock_fd)
+
+    def _compact(self, cutoff: datetime, pack_bytes: int, dry_run: bool) -> dict:
+        packs = self._recover()
+        self._reload()
+        stats = {"shipments": 0, "files": 0, "bytes": 0, "already_archived": 0, "skipped": 0}
+        candidates = self._candidates(cutoff)
+        if dry_run:
+            stats["shipments"] = len(candidates)
+            stats["files"] = sum(len(files) for _, _, files in candidates)
+            stats["bytes"] = sum(size for _, _, files in candidates for _, size in files)
+            return stats
+
+        seq, data_end = packs[-1] if packs else (0, 0)
+        if data_end >= pack_bytes:
+            seq, data_end = seq + 1, 0
+        records = self._index_records(seq) if data_end else []
+        pack = open(os.path.join(self.root, _pack_name(seq) + ".pack"), "ab")
+        pending: list[str] = []  # directories in the unpublished part of the pack
+
+        def publish():
+            pack.flush()
+            os.fsync(pack.fileno())
+            self._publish(seq, data_end, records)
+            for key in pending:
+                shutil.rmtree(os.path.join(self.storage_dir, key))
+            pending.clear()
+
+        try:
+            for _, key, files in candidates:
+                if self._is_archived(key, files):
+                    # A previous run published this shipment but died before deleting it
+                    shutil.rmtree(os.path.join(self.storage_dir, key))
+                    stats["already_archived"] += 1
+                    continue
+                if self.list_files(key):
+                    logger.warning("skipping %s: archived earlier with different files", key)
+                    stats["skipped"] += 1
+                    continue
+                if data_end >= pack_bytes:
+                    publish()
+                    pack.close()
+                    seq, data_end, records = seq + 1, 0, []
+                    pack = open(os.path.join(self.root, _pack_name(seq) + ".pack"), "ab")
+                key_bytes = key.encode()
+                if key in self._tombstones:
+                    # Re-archived after forget(): supersede the hidden entries in this pack's index
+                    records = [r for r in records if r[0].rstrip(b"\0") != key_bytes]
+                for name, _ in files:
+                    with open(os.path.join(self.storage_dir, key, name), "rb") as f:
+                        data = f.read()
+                    name_bytes = name.encode()
+                    crc = zlib.crc32(data)
+                    pack.write(_ENTRY.pack(_ENTRY_MAGIC, len(key_bytes), len(name_bytes), crc, len(data)))
+                    pack.write(key_bytes + name_bytes)
+                    offset = data_end + _ENTRY.size + len(key_bytes) + len(name_bytes)
+                    pack.write(data)
+                    records.append((key_bytes, name_bytes, offset, len(data), crc))
+                    data_end = offset + len(data)
+                    stats["files"] += 1
+                    stats["bytes"] += len(data)
+                pending.append(key)
+                stats["shipments"] += 1
+                if len(pending) >= PUBLISH_EVERY:
+                    publish()
+            if pending:
+                publish()
+        finally:
+            pack.close()
+            if not data_end:
+                os.remove(pack.name)  # nothing written and never indexed
+        metrics.inc("pod_archived_shipments_total", stats["shipments"])
+        return stats
+
+    # ── maintenance ──
+    def verify(self) -> list[str]:
+        """crc32-check every archived file. Returns a list of problems."""
+        self._reload()
+        problems = []
+        for pack in reversed(self._packs):
+            for key, name, offset, size, crc in pack.records():
+                if offset + size > pack.data_end or zlib.crc32(pack.read(offset, size)) != crc:
+                    problems.append(f"{os.path.basename(pack.path)}: {key}/{name} is corrupt")
+        return problems
+
+
+_stores: dict[str, ArchiveStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(storage_dir: str) -> ArchiveStore:
+    """Process-wide archive reader per storage directory."""
+    path = os.path.abspath(storage_dir)
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = ArchiveStore(path)
+        return store
+
+
+def read_file(path: str) -> bytes | None:
+    """Bytes of a stored POD file, from its shipment directory or, once archived, its pack."""
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+    shipment_dir, name = os.path.split(path)
+    storage_dir, key = os.path.split(shipment_dir)
+    return get_store(storage_dir or ".").read(key, name)
+
+
+# ─────────────────────────────────────────────
+# CLI
+# ─────────────────────────────────────────────
+def main():
+    parser = argparse.ArgumentParser(description="POD archive packs")
+    parser.add_argument("--storage", default=os.environ.get("POD_STORAGE_DIR", "pod_uploads"))
+    sub = parser.add_subparsers(dest="command", required=True)
+    compact = sub.add_parser("compact", help="move old shipment directories into packs")
+    compact.add_argument("--older-than", type=float, required=True, metavar="DAYS")
+    compact.add_argument("--pack-mb", type=int, default=PACK_BYTES // (1024 * 1024))
+    compact.add_argument("--dry-run", action="store_true", help="only report what would be archived")
+    ls = sub.add_parser("ls", help="list an archived shipment's files")
+    ls.add_argument("key")
+    cat = sub.add_parser("cat", help="write an archived file to stdout")
+    cat.add_argument("key")
+    cat.add_argument("name")
+    sub.add_parser("verify", help="check every archived file against its crc32")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    store = get_store(args.storage)
+    if args.command == "compact":
+        start = time.perf_counter()
+        stats = store.compact(args.older_than, args.pack_mb * 1024 * 1024, args.dry_run)
+        verb = "Would archive" if args.dry_run else "Archived"
+        print(f"{verb} {stats['shipments']} shipment(s), {stats['files']} file(s), "
+              f"{stats['bytes'] / 1e6:,.1f} MB in {time.perf_counter() - start:.1f}s "
+              f"({stats['already_archived']} already archived, {stats['skipped']} skipped)")
+    elif args.command == "ls":
+        for name in store.list_files(args.key):
+            found = store.lookup(args.key, name)
+            print(f"{found['pack']}  {found['size']:>10}  {name}")
+    elif args.command == "cat":
+        data = store.read(args.key, args.name)
+        if data is None:
+            sys.exit(f"{args.key}/{args.name} is not archived")
+        sys.stdout.buffer.write(data)
+    elif args.command == "verify":
+        problems = store.verify()
+        for problem in problems:
+            print(problem)
+        print(f"{len(problems)} problem(s)")
+        sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+"""
+Benchmark Suite
+===============
+Measures image quality analysis and POD storage performance so threshold or
+algorithm changes to `analyze_image_quality` can be compared across commits.
+
+Cases are synthetic document photos at 2, 12 and 48 MP, encoded as JPEG, PNG
+and (when pillow-heif is installed) HEIC, in sharp, blurry, dark and
+overexposed variants. Recorded photos can be added with --images.
+
+For every case the suite reports total and per-check latency (from the
+`metrics` stage timers), peak traced memory and
+single/concurrent throughput. `save_pod_image` / `save_pod_metadata`
+throughput is measured against a temporary storage directory.
+
+Results are written to bench_results/<commit>.json; pass --compare to diff
+against a previous run.
+
+Usage:
+    python bench.py                              # Full suite
+    python bench.py --sizes 2 12 --formats jpeg  # Subset
+    python bench.py --images ./samples           # Include recorded photos
+    python bench.py --compare bench_results/abc1234.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import statistics
+import subprocess
+import tempfile
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import admission  # noqa: F401 - sets OpenCV's pixel cap, which cv2 reads once at import
+import cv2
+import numpy as np
+
+import metrics
+import app
+
+SIZES_MP = {2: (1728, 1152), 12: (4000, 3000), 48: (8000, 6000)}
+FORMATS = ("jpeg", "png", "heic")
+VARIANTS = ("sharp", "blurry", "dark", "overexposed")
+STAGES = ("decode", "grayscale", "laplacian", "canny", "block_blur")
+RESULTS_DIR = "bench_results"
+
+
+# ─────────────────────────────────────────────
+# SYNTHETIC IMAGES
+# ─────────────────────────────────────────────
+def make_document(width: int, height: int, seed: int = 0) -> np.ndarray:
+    """Render a waybill-like page lying on a textured truck floor."""
+    rng = np.random.default_rng(seed)
+    floor = rng.integers(60, 110, size=(height // 8 + 1, width // 8 + 1, 3), dtype=np.uint8)
+    img = cv2.resize(floor, (width, height), interpolation=cv2.INTER_LINEAR)
+
+    margin_x, margin_y = width // 10, height // 12
+    page = np.array([
+        [margin_x, margin_y],
+        [width - margin_x, margin_y + height // 40],
+        [width - margin_x - width // 50, height - margin_y],
+        [margin_x + width // 60, height - margin_y - height // 50],
+    ], dtype=np.int32)
+    cv2.fillConvexPoly(img, page, (235, 235, 230))
+
+    scale = width / 1000
+    line_h = max(int(28 * scale), 8)
+    y = margin_y + line_h * 2
+    while y < height - margin_y - line_h:
+        x = margin_x + int(40 * scale)
+        words = rng.integers(4, 9)
+        for _ in range(words):
+            word = "".join(chr(c) for c in rng.integers(65, 91, size=rng.integers(3, 9)))
+            cv2.putText(img, word, (x, y), cv2.FONT_HERSHEY_SIMPLEX, 0.6 * scale, (30, 30, 30),
+                        max(int(1.5 * scale), 1), cv2.LINE_AA)
+            x += int((len(word) + 1) * 14 * scale)
+            if x > width - margin_x - int(120 * scale):
+                break
+        y += line_h
+    return img
+
+
+def apply_variant(img: np.ndarray, variant: str) -> np.ndarray:
+    if variant == "blurry":
+        k = max(int(min(img.shape[:2]) / 100) | 1, 9)
+        return cv2.GaussianBlur(img, (k, k), 0)
+    if variant == "dark":
+        return (img.astype(np.float32) * 0.12).astype(np.uint8)
+    if variant == "overexposed":
+        return np.clip(img.astype(np.int16) + 180, 0, 255).astype(np.uint8)
+    return img
+
+
+def encode(img: np.ndarray, fmt: str) -> bytes | None:
+    if fmt == "jpeg":
+        ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        return buf.tobytes() if ok else None
+    if fmt == "png":
+        ok, buf = cv2.imencode(".png", img, [cv2.IMWRITE_PNG_COMPRESSION, 3])
+        return buf.tobytes() if ok else None
+    if fmt == "heic":
+        try:
+            import pillow_heif
+        except ImportError:
+            return None
+        from io import BytesIO
+        from PIL import Image
+        pillow_heif.register_heif_opener()
+        out = BytesIO()
+        Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB)).save(out, format="HEIF", quality=90)
+        return out.getvalue()
+    raise ValueError(fmt)
+
+
+def build_cases(sizes, formats, variants, images_dir=None):
+    """Yield (case_name, image_bytes)."""
+    for mp in sizes:
+        w, h = SIZES_MP[mp]
+        base = make_document(w, h, seed=mp)
+        for variant in variants:
+            img = apply_variant(base, variant)
+            for fmt in formats:
+                data = encode(img, fmt)
+                if data is None:
+                    print(f"  skip {mp}MP/{fmt}: encoder not available", file=sys.stderr)
+                    continue
+                yield f"{mp}mp-{fmt}-{variant}", data
+    if images_dir:
+        for name in sorted(os.listdir(images_dir)):
+            if name.lower().endswith((".jpg", ".jpeg", ".png", ".heic", ".heif")):
+                with open(os.path.join(images_dir, name), "rb") as f:
+                    yield f"recorded-{name}", f.read()
+
+
+# ─────────────────────────────────────────────
+# MEASUREMENTS
+# ─────────────────────────────────────────────
+def _stats(samples: list) -> dict:
+    return {
+        "min_ms": round(min(samples) * 1000, 3),
+        "median_ms": round(statistics.median(samples) * 1000, 3),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 3),
+        "stdev_ms": round(statistics.stdev(samples) * 1000, 3) if len(samples) > 1 else 0.0,
+        "repeat": len(samples),
+    }
+
+
+def bench_latency(data: bytes, repeat: int) -> dict:
+    metrics.reset()
+    app.analyze_image_quality(data)  # warm-up, not recorded
+    metrics.reset()
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = app.analyze_image_quality(data)
+        samples.append(time.perf_counter() - start)
+    stages = {}
+    for stage in STAGES:
+        summary = metrics.histogram_summary("pod_quality_stage_seconds", stage=stage)
+        if summary:
+            stages[stage] = round(summary["mean"] * 1000, 3)
+    return {
+        "latency": _stats(samples),
+        "stages_mean_ms": stages,
+        "passed": result["passed"],
+        "reasons": result["reasons"],
+    }
+
+
+def bench_peak_memory(data: bytes) -> float:
+    """Peak traced allocation (MB) of one analysis.
+
+    OpenCV's Python bindings allocate their output arrays through NumPy, so
+    decoded frames, grayscale and Laplacian buffers all show up in tracemalloc.
+    """
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        app.analyze_image_quality(data)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(peak / 1e6, 1)
+
+
+def bench_throughput(data: bytes, workers: int, total: int) -> float:
+    """Images analysed per second with `workers` concurrent threads."""
+    start = time.perf_counter()
+    if workers == 1:
+        for _ in range(total):
+            app.analyze_image_quality(data)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(app.analyze_image_quality, [data] * total))
+    return round(total / (time.perf_counter() - start), 2)
+
+
+def bench_storage(data: bytes, count: int) -> dict:
+    shipment = {"key": "shpbench", "carrier": "Bench Driver", "pickup_city": "Riyadh",
+                "destination_city": "Jeddah", "commodity": "Cement"}
+    tmp = tempfile.mkdtemp(prefix="pod_bench_")
+    old_dir = app.POD_STORAGE_DIR
+    app.POD_STORAGE_DIR = tmp
+    try:
+        start = time.perf_counter()
+        paths = [app.save_pod_image(f"shpbench{i}", data, index=0) for i in range(count)]
+        image_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for i, path in enumerate(paths):
+            app.save_pod_metadata(f"shpbench{i}", shipment, [path], mode="single")
+        meta_elapsed = time.perf_counter() - start
+    finally:
+        app.POD_STORAGE_DIR = old_dir
+        shutil.rmtree(tmp, ignore_errors=True)
+    return {
+        "image_bytes": len(data),
+        "save_pod_image_per_s": round(count / image_elapsed, 1),
+        "save_pod_image_mb_per_s": round(count * len(data) / image_elapsed / 1e6, 1),
+        "save_pod_metadata_per_s": round(count / meta_elapsed, 1),
+    }
+
+
+# ─────────────────────────────────────────────
+# RESULTS
+# ─────────────────────────────────────────────
+def git_commit() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True)
+        commit = out.stdout.strip()
+        dirty = subprocess.run(["git", "diff", "--quiet"]).returncode != 0
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def environment() -> dict:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "opencv": cv2.__version__,
+        "numpy": np.__version__,
+    }
+
+
+def compare(current: dict, baseline: dict):
+    print(f"\nComparing {current['commit']} against {baseline['commit']} (median latency)")
+    print(f"{'case':<36} {'base ms':>10} {'new ms':>10} {'ratio':>7}")
+    print("-" * 66)
+    for name, case in current["cases"].items():
+        old = baseline["cases"].get(name)
+        if not old:
+            continue
+        a, b = old["latency"]["median_ms"], case["latency"]["median_ms"]
+        ratio = b / a if a else float("inf")
+        flag = "  slower" if ratio > 1.1 else ("  faster" if ratio < 0.9 else "")
+        print(f"{name:<36} {a:>10.2f} {b:>10.2f} {ratio:>6.2f}x{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark POD image analysis and storage")
+    parser.add_argument("--sizes", nargs="+", type=int, choices=sorted(SIZES_MP), default=sorted(SIZES_MP))
+    parser.add_argument("--formats", nargs="+", choices=FORMATS, default=list(FORMATS))
+    parser.add_argument("--variants", nargs="+", choices=VARIANTS, default=list(VARIANTS))
+    parser.add_argument("--images", help="Directory of recorded photos to include")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per case (default: 5)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4,
+                        help="Threads for the concurrent throughput run")
+    parser.add_argument("--no-memory", action="store_true", help="Skip peak-memory runs")
+    parser.add_argument("--storage-count", type=int, default=200)
+    parser.add_argument("--output", help="Results path (default: bench_results/<commit>.json)")
+    parser.add_argument("--compare", help="Previous results JSON to compare against")
+    args = parser.parse_args()
+
+    metrics.enable()
+    commit = git_commit()
+    results = {"commit": commit, "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "environment": environment(), "cases": {}, "storage": {}}
+
+    print(f"Benchmarking commit {commit}\n")
+    for name, data in build_cases(args.sizes, args.formats, args.variants, args.images):
+        case = bench_latency(data, args.repeat)
+        case["bytes"] = len(data)
+        if not args.no_memory:
+            case["peak_memory_mb"] = bench_peak_memory(data)
+        case["throughput_single_per_s"] = bench_throughput(data, 1, args.repeat)
+        case["throughput_concurrent_per_s"] = bench_throughput(data, args.workers, args.repeat * args.workers)
+        results["cases"][name] = case
+        print(f"  {name:<36} median {case['latency']['median_ms']:>9.2f} ms  "
+              f"conc {case['throughput_concurrent_per_s']:>7.2f}/s  "
+              f"mem {case.get('peak_memory_mb', '-')} MB")
+
+    for mp in args.sizes:
+        w, h = SIZES_MP[mp]
+        data = encode(make_document(w, h, seed=mp), "jpeg")
+        count = max(args.storage_count // mp, 10)
+        results["storage"][f"{mp}mp-jpeg"] = storage = bench_storage(data, count)
+        print(f"  storage {mp}mp-jpeg: {storage['save_pod_image_per_s']}/s images, "
+              f"{storage['save_pod_image_mb_per_s']} MB/s, {storage['save_pod_metadata_per_s']}/s metadata")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+"""
+Quality Threshold Calibration
+=============================
+Learns per-camera-class quality thresholds from the scores of past quality
+checks, so drivers whose phones produce systematically softer or darker
+images aren't pushed into the 3-photo fallback by constants tuned for other
+devices.
+
+The fitter folds `quality_check` events from the submission event log
+(`eventlog.py`) into one streaming quantile sketch per (segment, score). A
+segment is the photo's resolution class (e.g. `12mp`). The sketches are
+DDSketches: log-spaced buckets with 1% relative error, mergeable and
+checkpointed as plain JSON. They are halved once a segment passes
+MAX_WEIGHT samples, so they follow the current device mix. A check logged
+twice for the same (shipment, attempt) counts once; API checks carry no
+attempt number, so each of them counts. Each fit writes
+per-segment thresholds to `<storage>/_calibration/thresholds.json`:
+
+- blur, dark and edge thresholds: the REJECT_QUANTILE quantile of the segment;
+- overexposure: the 1 - REJECT_QUANTILE quantile.
+
+Thresholds are only ever loosened relative to the defaults in `app.py`, and
+never past LIMITS. Segments with fewer than MIN_SAMPLES samples keep the
+defaults. With POD_ADAPTIVE_THRESHOLDS=1 the app re-reads the file when it
+changes, so a fit (or a hand edit) takes effect without a restart.
+
+Usage:
+    python calibration.py fit                        # fold new events, write thresholds.json
+    python calibration.py fit --follow --interval 300
+    python calibration.py show                       # print the current thresholds
+"""
+
+import os
+import json
+import math
+import time
+import argparse
+import threading
+from collections import OrderedDict, defaultdict
+
+import metrics
+import eventlog
+
+REJECT_QUANTILE = 0.10  # aim to reject about this share of a segment's photos per check
+MIN_SAMPLES = 200
+MAX_WEIGHT = 20_000
+DEDUP_WINDOW = 100_000  # recent (shipment, attempt) pairs remembered so a re-logged check counts once
+RELATIVE_ACCURACY = 0.01
+RELOAD_SECONDS = 1.0
+MEGAPIXEL_CLASSES = (1, 2, 3, 5, 8, 12, 16, 24, 48)
+
+# threshold -> (score, quantile, loosest allowed value)
+LIMITS = {
+    "BLUR_THRESHOLD": ("sharpness", REJECT_QUANTILE, 30.0),
+    "DARK_THRESHOLD": ("brightness", REJECT_QUANTILE, 25.0),
+    "BRIGHT_THRESHOLD": ("brightness", 1 - REJECT_QUANTILE, 250.0),
+    "MIN_EDGE_RATIO": ("edge_ratio", REJECT_QUANTILE, 0.01),
+}
+SCORES = ("sharpness", "brightness", "edge_ratio")
+
+
+def segment_of(width: int, height: int) -> str:
+    """Resolution class, e.g. 4000x3000 -> '12mp'."""
+    megapixels = width * height / 1e6
+    for mp in MEGAPIXEL_CLASSES:
+        if megapixels <= mp * 1.15:
+            return f"{mp}mp"
+    return f"{MEGAPIXEL_CLASSES[-1]}mp+"
+
+
+def _segment_of_scores(scores: dict) -> str | None:
+    try:
+        width, height = (int(v) for v in scores["resolution"].split("x"))
+    except (KeyError, ValueError, AttributeError):
+        return None
+    return segment_of(width, height)
+
+
+class Sketch:
+    """DDSketch over non-negative values: quantiles within RELATIVE_ACCURACY."""
+
+    _gamma = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+    _log_gamma = math.log(_gamma)
+    _min_value = 1e-9
+
+    def __init__(self):
+        self.bins: dict[int, float] = defaultdict(float)
+        self.zeros = 0.0
+        self.count = 0.0
+
+    def add(self, value: float):
+        if value <= self._min_value:
+            self.zeros += 1
+        else:
+            self.bins[math.ceil(math.log(value) / self._log_gamma)] += 1
+        self.count += 1
+
+    def decay(self, factor: float = 0.5):
+        self.zeros *= factor
+        self.count *= factor
+        for i in self.bins:
+            self.bins[i] *= factor
+
+    def quantile(self, q: float) -> float | None:
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if seen > rank:
+            return 0.0
+        for i in sorted(self.bins):
+            seen += self.bins[i]
+            if seen > rank:
+                return 2 * self._gamma ** i / (self._gamma + 1)
+        return 2 * self._gamma ** max(self.bins) / (self._gamma + 1)
+
+    def to_dict(self) -> dict:
+        return {"zeros": self.zeros, "count": self.count, "bins": {str(i): c for i, c in self.bins.items()}}
+
+    @classmethod
+    def from_dict(cls, state: dict) -> "Sketch":
+        sketch = cls()
+        sketch.zeros, sketch.count = state["zeros"], state["count"]
+        sketch.bins.update((int(i), c) for i, c in state["bins"].items())
+        return sketch
+
+
+# ─────────────────────────────────────────────
+# FITTING
+# ─────────────────────────────────────────────
+class Calibrator:
+    """Score sketches per segment, folded incrementally from the event log."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.checkpoint_path = os.path.join(root, "sketches.json")
+        self.thresholds_path = os.path.join(root, "thresholds.json")
+        self.next_offset = 0
+        self.sketches: dict[str, dict[str, Sketch]] = {}
+        self.seen: OrderedDict[tuple, None] = OrderedDict()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return
+        self.next_offset = state["next_offset"]
+        self.sketches = {
+            segment: {name: Sketch.from_dict(s) for name, s in sketches.items()}
+            for segment, sketches in state["sketches"].items()
+        }
+        self.seen = OrderedDict((tuple(sample), None) for sample in state.get("seen", []))
+
+    def _write(self, path: str, payload: dict):
+        os.makedirs(self.root, exist_ok=True)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(payload, f, indent=1)
+        os.replace(path + ".tmp", path)
+
+    def save(self):
+        self._write(self.checkpoint_path, {
+            "next_offset": self.next_offset,
+            "sketches": {
+                segment: {name: s.to_dict() for name, s in sketches.items()}
+                for segment, sketches in self.sketches.items()
+            },
+            "seen": list(self.seen),
+        })
+
+    def apply(self, record: dict):
+        if record.get("type") != "quality_check":
+            return
+        scores = record.get("scores") or {}
+        segment = _segment_of_scores(scores)
+        if segment is None:
+            return  # rejected at admission, nothing was measured
+        sample = (record.get("shipment_key"), record.get("attempt"))
+        if sample[0] and sample[1] is not None:  # API checks have no attempt: every one is a new photo
+            if sample in self.seen:
+                metrics.inc("pod_calibration_duplicate_samples_total")
+                return
+            self.seen[sample] = None
+            if len(self.seen) > DEDUP_WINDOW:
+                self.seen.popitem(last=False)
+        sketches = self.sketches.get(segment)
+        if sketches is None:
+            sketches = self.sketches[segment] = {name: Sketch() for name in SCORES}
+        for name in SCORES:
+            if name in scores:
+                sketches[name].add(float(scores[name]))
+        if sketches["sharpness"].count > MAX_WEIGHT:
+            for sketch in sketches.values():
+                sketch.decay()
+
+    def refresh(self, log: eventlog.EventLog) -> int:
+        count = 0
+        for record in log.read_from(self.next_offset):
+            self.apply(record)
+            self.next_offset = record["offset"] + 1
+            count += 1
+        return count
+
+    def fit(self, defaults: dict) -> dict:
+        """Per-segment thresholds, loosened from the defaults within LIMITS."""
+        segments = {}
+        for segment, sketches in sorted(self.sketches.items()):
+            samples = int(sketches["sharpness"].count)
+            if samples < MIN_SAMPLES:
+                continue
+            fitted = {"samples": samples}
+            for name, (score, q, loosest) in LIMITS.items():
+                value = sketches[score].quantile(q)
+                if value is None:
+                    continue
+                default = defaults[name]
+                # BRIGHT_THRESHOLD loosens upwards, the others downwards
+                if loosest > default:
+                    fitted[name] = round(min(max(value, default), loosest), 4)
+                else:
+                    fitted[name] = round(max(min(value, default), loosest), 4)
+            segments[segment] = fitted
+        return {"fitted_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "next_offset": self.next_offset,
+                "defaults": defaults, "segments": segments}
+
+    def run(self, log: eventlog.EventLog, defaults: dict) -> tuple[int, dict]:
+        """Fold in new events, checkpoint, and publish thresholds.json."""
+        with metrics.timer("pod_calibration_fit_seconds"):
+            count = self.refresh(log)
+            self.save()
+            thresholds = self.fit(defaults)
+            self._write(self.thresholds_path, thresholds)
+        return count, thresholds
+
+
+# ─────────────────────────────────────────────
+# HOT-RELOADED THRESHOLDS
+# ─────────────────────────────────────────────
+class Thresholds:
+    """thresholds.json, re-read whenever its mtime changes (checked at most once per RELOAD_SECONDS)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.segments: dict[str, dict] = {}
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < RELOAD_SECONDS:
+            return
+        self._checked_at = now
+        try:
+            version = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            self.segments, self._version = {}, None
+            return
+        if version == self._version:
+            return
+        with self._lock:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    segments = json.load(f).get("segments", {})
+            except (OSError, json.JSONDecodeError):
+                return  # keep the last good thresholds
+            self.segments, self._version = segments, version
+        metrics.inc("pod_calibration_reloads_total")
+        for segment, fitted in segments.items():
+            for name in LIMITS:
+                if name in fitted:
+                    metrics.set_gauge("pod_calibrated_threshold", fitted[name], segment=segment, threshold=name)
+
+    def lookup(self, width: int, height: int, defaults: dict) -> dict:
+        """Thresholds for a photo of this size: the segment's fitted values over the defaults."""
+        self._reload()
+        fitted = self.segments.get(segment_of(width, height))
+        if not fitted:
+            return defaults
+        return {**defaults, **{k: v for k, v in fitted.items() if k in LIMITS}}
+
+
+_thresholds: dict[str, Thresholds] = {}
+_thresholds_lock = threading.Lock()
+
+
+def get_thresholds(storage_dir: str) -> Thresholds:
+    """Process-wide hot-reloaded thresholds per storage directory."""
+    path = os.path.abspath(os.path.join(storage_dir, "_calibration", "thresholds.json"))
+    with _thresholds_lock:
+        thresholds = _thresholds.get(path)
+        if thresholds is None:
+            thresholds = _thresholds[path] = Thresholds(path)
+        return thresholds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit per-segment quality thresholds")
+    parser.add_argument("--storage", default=os.environ.get("POD_STORAGE_DIR", "pod_uploads"))
+    sub = parser.add_subparsers(dest="command", required=True)
+    fit = sub.add_parser("fit", help="fold new quality checks and publish thresholds.json")
+    fit.add_argument("--follow", action="store_true", help="keep fitting every --interval seconds")
+    fit.add_argument("--interval", type=float, default=300.0)
+    sub.add_parser("show", help="print the published thresholds")
+    args = parser.parse_args()
+
+    root = os.path.join(args.storage, "_calibration")
+    if args.command == "show":
+        with open(os.path.join(root, "thresholds.json"), "r", encoding="utf-8") as f:
+            print(json.dumps(json.load(f), indent=2))
+        return
+
+    import app
+
+    defaults = app.default_thresholds()
+    calibrator = Calibrator(root)
+    log = eventlog.get_log(args.storage)
+    while True:
+        count, thresholds = calibrator.run(log, defaults)
+        print(f"Folded {count} event(s); {len(thresholds['segments'])} calibrated segment(s)")
+        for segment, fitted in thresholds["segments"].items():
+            print(f"  {segment:>6}: " + ", ".join(f"{k}={v}" for k, v in fitted.items()))
+        if not args.follow:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
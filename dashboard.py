@@ -0,0 +1,287 @@
+"""
+POD Ops Dashboard
+=================
+Coverage and quality view for ops: shipments at drop-off without a POD, the
+fallback-mode rate, and the most common rejection reasons by city and carrier.
+
+Aggregates are built incrementally from the submission event log
+(`eventlog.py`): each refresh folds in only the records after the last
+processed offset, and the aggregates plus that offset are checkpointed to
+`<storage>/_dashboard/aggregates.json`. A restart therefore resumes from
+the checkpoint instead of replaying history, and query cost depends on the
+number of cities and carriers, not on the number of PODs. Coverage joins the
+cached shipment snapshot (`shipment_store.py`) with the set of submitted
+shipment keys, which is folded from `pod_submitted` events. Keys are appended
+to `submitted_keys` next to the checkpoint, which records how many lines it
+covers, so a refresh writes only the new keys and a rerun does no
+per-shipment storage lookups.
+
+Usage:
+    streamlit run dashboard.py
+    python dashboard.py --summary          # print the aggregates as JSON
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from collections import Counter, defaultdict
+
+import redash
+import metrics
+import eventlog
+
+TOP_N = 15
+CHECKPOINT_EVERY = 10_000  # records between checkpoints during a long catch-up
+
+
+class Aggregates:
+    """Counters keyed by city / carrier / day, updated from event log records."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.next_offset = 0
+        self.modes: Counter = Counter()
+        self.daily: dict[str, Counter] = defaultdict(Counter)
+        self.by_city: dict[str, Counter] = defaultdict(Counter)
+        self.by_carrier: dict[str, Counter] = defaultdict(Counter)
+        self.reasons: Counter = Counter()
+        self.submitted: set[str] = set()
+        self._new_submitted: list[str] = []  # not yet in submitted_keys
+        self._submitted_lines = 0
+        self._submitted_path = os.path.join(os.path.dirname(path), "submitted_keys")
+        self._lock = threading.Lock()
+        self.load()
+
+    # ── persistence ──
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            state = {}
+        covered = state.get("submitted_keys", 0)
+        try:
+            with open(self._submitted_path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = b""
+        lines = data.split(b"\n")[:covered]
+        if len(lines) < covered or "submitted_keys" not in state:
+            # No checkpoint, one from before submitted_keys, or a short file: replay the log
+            covered, lines, state = 0, [], {}
+        valid = sum(len(line) + 1 for line in lines)
+        if len(data) > valid:
+            # Keys appended by a save that crashed before its checkpoint; they are re-folded
+            with open(self._submitted_path, "r+b") as f:
+                f.truncate(valid)
+        if not state:
+            return
+        self.next_offset = state["next_offset"]
+        self.submitted = {line.decode() for line in lines}
+        self._submitted_lines = covered
+        self.modes = Counter(state["modes"])
+        self.reasons = Counter(state["reasons"])
+        for name in ("daily", "by_city", "by_carrier"):
+            setattr(self, name, defaultdict(Counter, {k: Counter(v) for k, v in state[name].items()}))
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if self._new_submitted:
+            with open(self._submitted_path, "ab") as f:
+                f.writelines(f"{key}\n".encode() for key in self._new_submitted)
+                f.flush()
+                os.fsync(f.fileno())
+            self._submitted_lines += len(self._new_submitted)
+            self._new_submitted = []
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "next_offset": self.next_offset,
+                "modes": self.modes,
+                "reasons": self.reasons,
+                "daily": self.daily,
+                "by_city": self.by_city,
+                "by_carrier": self.by_carrier,
+                "submitted_keys": self._submitted_lines,
+            }, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    # ── folding ──
+    def apply(self, record: dict):
+        city = record.get("destination_city") or "unknown"
+        carrier = record.get("carrier") or "unknown"
+        if record.get("type") == "pod_submitted":
+            mode = record.get("upload_mode", "")
+            day = (record.get("uploaded_at") or "")[:10] or "unknown"
+            self.modes[mode] += 1
+            self.daily[day][mode] += 1
+            key = record.get("shipment_key")
+            if key and key not in self.submitted:
+                self.submitted.add(key)
+                self._new_submitted.append(key)
+            for group in (self.by_city[city], self.by_carrier[carrier]):
+                group["submissions"] += 1
+                if mode == "fallback_triple":
+                    group["fallback"] += 1
+        elif record.get("type") == "quality_check":
+            for group in (self.by_city[city], self.by_carrier[carrier]):
+                group["checks"] += 1
+                if not record.get("passed"):
+                    group["failed"] += 1
+                for reason in record.get("reasons", []):
+                    group[f"reason:{reason}"] += 1
+            for reason in record.get("reasons", []):
+                self.reasons[reason] += 1
+
+    def refresh(self, log: eventlog.EventLog) -> int:
+        """Fold in records appended since the last refresh. Returns how many."""
+        with self._lock, metrics.timer("pod_dashboard_refresh_seconds"):
+            count = 0
+            for record in log.read_from(self.next_offset):
+                self.apply(record)
+                self.next_offset = record["offset"] + 1
+                count += 1
+                if count % CHECKPOINT_EVERY == 0:
+                    self.save()
+            if count:
+                self.save()
+            return count
+
+    # ── queries ──
+    def summary(self) -> dict:
+        submissions = sum(self.modes.values())
+        checks = sum(g["checks"] for g in self.by_city.values())
+        failed = sum(g["failed"] for g in self.by_city.values())
+        return {
+            "submissions": submissions,
+            "fallback_rate": self.modes["fallback_triple"] / submissions if submissions else 0.0,
+            "quality_checks": checks,
+            "quality_pass_rate": (checks - failed) / checks if checks else 0.0,
+            "top_reasons": self.reasons.most_common(),
+            "next_offset": self.next_offset,
+        }
+
+    def breakdown(self, dimension: str) -> list[dict]:
+        """One row per city or carrier with submission, fallback and rejection stats."""
+        groups = self.by_city if dimension == "city" else self.by_carrier
+        rows = []
+        for name, g in groups.items():
+            row = {
+                dimension: name,
+                "submissions": g["submissions"],
+                "fallback_rate": g["fallback"] / g["submissions"] if g["submissions"] else 0.0,
+                "quality_checks": g["checks"],
+                "rejection_rate": g["failed"] / g["checks"] if g["checks"] else 0.0,
+            }
+            for key, value in g.items():
+                if key.startswith("reason:"):
+                    row[key[len("reason:"):]] = value
+            rows.append(row)
+        return sorted(rows, key=lambda r: r["quality_checks"] + r["submissions"], reverse=True)
+
+
+_aggregates: dict[str, Aggregates] = {}
+_aggregates_lock = threading.Lock()
+
+
+def get_aggregates(storage_dir: str) -> Aggregates:
+    """Process-wide aggregates per storage directory, refreshed on each call."""
+    path = os.path.abspath(os.path.join(storage_dir, "_dashboard", "aggregates.json"))
+    with _aggregates_lock:
+        aggregates = _aggregates.get(path)
+        if aggregates is None:
+            aggregates = _aggregates[path] = Aggregates(path)
+    aggregates.refresh(eventlog.get_log(storage_dir))
+    return aggregates
+
+
+def at_dropoff(records: dict) -> dict:
+    """The snapshot's drop-off shipments; the full CSV export holds every status."""
+    return {key: r for key, r in records.items() if r.get("status") == redash.DROPOFF_STATUS}
+
+
+def missing_pods(records: dict, submitted: set) -> list[dict]:
+    """Shipments at drop-off with no pod_submitted event."""
+    return [r for key, r in at_dropoff(records).items() if key not in submitted]
+
+
+# ─────────────────────────────────────────────
+# PAGE
+# ─────────────────────────────────────────────
+def render():
+    import streamlit as st
+    import app as pod
+
+    pd = metrics.lazy_import("pandas")
+    st.set_page_config(page_title="Trella POD — Ops", page_icon="📊", layout="wide")
+    st.title("POD Coverage & Quality")
+
+    aggregates = get_aggregates(pod.POD_STORAGE_DIR)
+    summary = aggregates.summary()
+    store = pod.get_shipment_store()
+    if store.source == "empty":
+        store.refresh()
+    dropoff = at_dropoff(store.records)
+    missing = missing_pods(dropoff, aggregates.submitted)
+
+    cols = st.columns(5)
+    cols[0].metric("At drop-off", len(dropoff))
+    cols[1].metric("Without POD", len(missing))
+    cols[2].metric("Coverage", f"{1 - len(missing) / len(dropoff):.0%}" if dropoff else "—")
+    cols[3].metric("Fallback rate", f"{summary['fallback_rate']:.1%}")
+    cols[4].metric("Quality pass rate", f"{summary['quality_pass_rate']:.1%}")
+    st.caption(
+        f"{summary['submissions']:,} submissions · {summary['quality_checks']:,} quality checks · "
+        f"event log offset {summary['next_offset']:,} · shipments from {store.source}"
+    )
+    if st.button("Refresh"):
+        st.rerun()
+
+    st.subheader("At drop-off without a POD")
+    if missing:
+        columns = ["key", "carrier", "carrier_mobile", "vehicle_plate", "pickup_city", "destination_city"]
+        st.dataframe(pd.DataFrame(missing).reindex(columns=columns), hide_index=True)
+    else:
+        st.success("Every shipment at drop-off has a POD.")
+
+    st.subheader("Rejection reasons")
+    if summary["top_reasons"]:
+        reasons = pd.DataFrame(summary["top_reasons"], columns=["reason", "count"]).set_index("reason")
+        st.bar_chart(reasons)
+
+    left, right = st.columns(2)
+    for column, dimension in ((left, "city"), (right, "carrier")):
+        with column:
+            st.subheader(f"By {dimension}")
+            rows = aggregates.breakdown(dimension)[:TOP_N]
+            if rows:
+                st.dataframe(pd.DataFrame(rows).fillna(0), hide_index=True)
+
+    st.subheader("Submissions per day")
+    if aggregates.daily:
+        daily = pd.DataFrame.from_dict(aggregates.daily, orient="index").fillna(0).sort_index()
+        st.bar_chart(daily.tail(60))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="POD ops aggregates")
+    parser.add_argument("--storage", default=os.environ.get("POD_STORAGE_DIR", "pod_uploads"))
+    parser.add_argument("--summary", action="store_true", help="print aggregates as JSON and exit")
+    args = parser.parse_args()
+    start = time.perf_counter()
+    aggregates = get_aggregates(args.storage)
+    print(json.dumps({
+        **aggregates.summary(),
+        "by_city": aggregates.breakdown("city")[:TOP_N],
+        "refresh_seconds": round(time.perf_counter() - start, 3),
+    }, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    if "--summary" in sys.argv:
+        main()
+    else:
+        render()
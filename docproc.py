@@ -0,0 +1,95 @@
+"""
+Document Crop & Compact Re-Encode
+=================================
+Optional post-quality-check stage that turns a raw driver photo into a compact
+document scan before storage.
+
+It reuses the decoded image and Canny edge map already computed by
+`analyze_image_quality`. The largest quadrilateral in the edge map is taken as
+the document, perspective-corrected and cropped, then the result is re-encoded
+as WebP at the highest quality that fits the byte target. Re-encoding drops
+EXIF (GPS, device serials) as a side effect. If no document outline is found
+the whole frame is kept and only downscaled / re-encoded.
+"""
+
+import metrics
+
+CONTOUR_MAX_SIDE = 960  # edge map is downscaled to this for contour search
+MIN_DOCUMENT_AREA = 0.2  # quad must cover this share of the frame
+QUALITY_STEPS = (90, 82, 74, 66, 58, 50, 42)
+
+
+def _order_corners(pts):
+    """Order 4 points as top-left, top-right, bottom-right, bottom-left."""
+    np = metrics.lazy_import("numpy")
+    pts = pts.reshape(4, 2).astype("float32")
+    s = pts.sum(axis=1)
+    d = np.diff(pts, axis=1).ravel()
+    return np.array([pts[np.argmin(s)], pts[np.argmin(d)], pts[np.argmax(s)], pts[np.argmax(d)]], dtype="float32")
+
+
+def find_document_quad(edges):
+    """Corners of the document in full-resolution coordinates, or None."""
+    cv2 = metrics.lazy_import("cv2")
+    h, w = edges.shape[:2]
+    scale = min(1.0, CONTOUR_MAX_SIDE / max(h, w))
+    small = cv2.resize(edges, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA) if scale < 1 else edges
+    small = cv2.dilate((small > 0).astype("uint8") * 255, None, iterations=2)
+    contours, _ = cv2.findContours(small, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
+    frame_area = small.shape[0] * small.shape[1]
+    for contour in sorted(contours, key=cv2.contourArea, reverse=True)[:5]:
+        if cv2.contourArea(contour) < MIN_DOCUMENT_AREA * frame_area:
+            break
+        hull = cv2.convexHull(contour)
+        approx = cv2.approxPolyDP(hull, 0.02 * cv2.arcLength(hull, True), True)
+        if len(approx) == 4:
+            return _order_corners(approx) / scale
+    return None
+
+
+def _warp(img, corners):
+    cv2 = metrics.lazy_import("cv2")
+    np = metrics.lazy_import("numpy")
+    tl, tr, br, bl = corners
+    width = int(max(np.linalg.norm(br - bl), np.linalg.norm(tr - tl)))
+    height = int(max(np.linalg.norm(tr - br), np.linalg.norm(tl - bl)))
+    target = np.array([[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]], dtype="float32")
+    matrix = cv2.getPerspectiveTransform(corners, target)
+    # warpPerspective has no INTER_AREA; the max_side downscale after it does the area filtering
+    return cv2.warpPerspective(img, matrix, (width, height), flags=cv2.INTER_LINEAR)
+
+
+def encode_to_target(img, target_bytes: int) -> tuple[bytes, int]:
+    """WebP at the highest quality step under target_bytes (or the lowest step)."""
+    cv2 = metrics.lazy_import("cv2")
+    data, quality = b"", QUALITY_STEPS[-1]
+    for quality in QUALITY_STEPS:
+        ok, buf = cv2.imencode(".webp", img, [cv2.IMWRITE_WEBP_QUALITY, quality])
+        if not ok:
+            raise ValueError("WebP encoding failed")
+        data = buf.tobytes()
+        if len(data) <= target_bytes:
+            break
+    return data, quality
+
+
+@metrics.timed("pod_docproc_seconds")
+def process_document(img, edges, target_bytes: int, max_side: int) -> tuple[bytes, dict]:
+    """Crop, rectify and re-encode a decoded BGR image. Returns (webp_bytes, info)."""
+    cv2 = metrics.lazy_import("cv2")
+    corners = find_document_quad(edges)
+    out = _warp(img, corners) if corners is not None else img
+    h, w = out.shape[:2]
+    if max(h, w) > max_side:
+        scale = max_side / max(h, w)
+        out = cv2.resize(out, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+    data, quality = encode_to_target(out, target_bytes)
+    metrics.inc("pod_docproc_output_bytes_total", len(data))
+    return data, {
+        "cropped": corners is not None,
+        "stored_resolution": f"{out.shape[1]}x{out.shape[0]}",
+        "stored_format": "webp",
+        "webp_quality": quality,
+    }
@@ -0,0 +1,394 @@
+"""
+POD Submission Event Log
+========================
+Append-only, segmented JSONL log of POD submissions for downstream consumers
+(billing, ops) that need to pick up new PODs without walking
+`pod_uploads/*/metadata.json`.
+
+Every record gets a monotonically increasing offset. Records live in
+`<storage>/_events/segment-<base offset>.jsonl`, and a new segment starts once
+the active one passes SEGMENT_BYTES. Each segment has a sparse index
+(`.idx`, one (offset, byte position) pair per ~4 KB) so a consumer seeks
+straight to its offset instead of scanning. Appends are serialised with an
+flock, so several app processes can share one log. fsyncs are batched: a
+background flusher syncs every FSYNC_INTERVAL and all appends waiting in
+that window share one fsync. A torn last line from a crash is truncated on
+the next open and skipped by readers.
+
+Usage:
+    python eventlog.py tail                          # print every record
+    python eventlog.py tail --from 120 --follow      # stream from offset 120
+    python eventlog.py tail --consumer billing --follow --commit
+    python eventlog.py backfill                      # import existing metadata.json files
+
+    log = eventlog.get_log("pod_uploads")
+    for record in log.read_from(log.committed("billing")):
+        ...
+        log.commit("billing", record["offset"] + 1)
+"""
+
+import os
+import sys
+import json
+import time
+import bisect
+import struct
+import logging
+import argparse
+import threading
+
+try:
+    import fcntl
+except ImportError:  # non-POSIX: in-process locking only
+    fcntl = None
+
+import metrics
+import archive
+
+logger = logging.getLogger("pod.eventlog")
+
+SEGMENT_BYTES = 64 * 1024 * 1024
+INDEX_INTERVAL_BYTES = 4096
+FSYNC_INTERVAL = 0.05  # group-commit window in seconds
+_INDEX_ENTRY = struct.Struct("<QQ")  # (record offset, byte position)
+
+
+def _segment_name(base: int) -> str:
+    return f"segment-{base:020d}"
+
+
+class EventLog:
+    def __init__(self, root: str, segment_bytes: int = SEGMENT_BYTES, fsync_interval: float = FSYNC_INTERVAL):
+        self.root = root
+        self.segment_bytes = segment_bytes
+        self.fsync_interval = fsync_interval
+        os.makedirs(os.path.join(root, "consumers"), exist_ok=True)
+        self._lock = threading.Lock()
+        self._lock_fd = os.open(os.path.join(root, ".lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        self._fd = None
+        self._idx_fd = None
+        self._base = None
+        self._position = 0
+        self._next_offset = 0
+        self._indexed_at = None
+        self._written = -1
+        self._synced = -1
+        self._cond = threading.Condition()
+        self._flusher = None
+
+    # ── segments ──
+    def _path(self, base: int, ext: str) -> str:
+        return os.path.join(self.root, _segment_name(base) + ext)
+
+    def _segments(self) -> list[int]:
+        bases = []
+        for name in os.listdir(self.root):
+            if name.startswith("segment-") and name.endswith(".jsonl"):
+                bases.append(int(name[len("segment-"):-len(".jsonl")]))
+        return sorted(bases)
+
+    def _read_index(self, base: int) -> list[tuple[int, int]]:
+        try:
+            with open(self._path(base, ".idx"), "rb") as f:
+                data = f.read()
+        except OSError:
+            return []
+        usable = len(data) - len(data) % _INDEX_ENTRY.size
+        return [_INDEX_ENTRY.unpack_from(data, i) for i in range(0, usable, _INDEX_ENTRY.size)]
+
+    def _seek_position(self, base: int, offset: int, size: int) -> int:
+        """Byte position of the last indexed record at or before offset."""
+        # An entry at or past EOF belongs to an append that never landed
+        entries = [e for e in self._read_index(base) if e[1] < size]
+        i = bisect.bisect_right([e[0] for e in entries], offset) - 1
+        return entries[i][1] if i >= 0 else 0
+
+    # ── writer (lock held) ──
+    def _close_active(self):
+        for fd in (self._fd, self._idx_fd):
+            if fd is not None:
+                os.fsync(fd)
+                os.close(fd)
+        self._fd = self._idx_fd = None
+
+    def _open_segment(self, base: int):
+        """Open a segment for appending, recovering its tail and next offset."""
+        self._close_active()
+        fd = os.open(self._path(base, ".jsonl"), os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        size = os.fstat(fd).st_size
+        start = self._seek_position(base, sys.maxsize, size)
+        os.lseek(fd, start, os.SEEK_SET)
+        tail = os.read(fd, size - start) if size > start else b""
+        end = tail.rfind(b"\n") + 1
+        if start + end < size:
+            os.ftruncate(fd, start + end)  # torn write from a crash
+            logger.warning("truncated %d torn bytes from %s", size - start - end, _segment_name(base))
+        lines = tail[:end].splitlines()
+        self._next_offset = json.loads(lines[-1])["offset"] + 1 if lines else base
+        self._position = start + end
+
+        idx_fd = os.open(self._path(base, ".idx"), os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        idx_size = os.fstat(idx_fd).st_size
+        os.ftruncate(idx_fd, idx_size - idx_size % _INDEX_ENTRY.size)
+        self._indexed_at = start if lines else None
+        self._fd, self._idx_fd, self._base = fd, idx_fd, base
+
+    def _sync_tail(self):
+        """Catch up with appends and segment rolls made by other processes."""
+        segments = self._segments()
+        if not segments:
+            self._open_segment(0)
+        elif self._fd is None or segments[-1] != self._base or os.fstat(self._fd).st_size != self._position:
+            self._open_segment(segments[-1])
+
+    def _process_lock(self):
+        if fcntl is not None:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+
+    def _process_unlock(self):
+        if fcntl is not None:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def append(self, record: dict, wait: bool = True) -> int:
+        """Append one record and return its offset; wait=True blocks until it is fsynced."""
+        with metrics.timer("pod_eventlog_append_seconds"):
+            with self._lock:
+                self._process_lock()
+                try:
+                    self._sync_tail()
+                    if self._position >= self.segment_bytes:
+                        self._open_segment(self._next_offset)
+                    offset = self._next_offset
+                    line = json.dumps({"offset": offset, **record}, ensure_ascii=False, separators=(",", ":"))
+                    if self._indexed_at is None or self._position - self._indexed_at >= INDEX_INTERVAL_BYTES:
+                        os.write(self._idx_fd, _INDEX_ENTRY.pack(offset, self._position))
+                        self._indexed_at = self._position
+                    data = line.encode("utf-8") + b"\n"
+                    os.write(self._fd, data)
+                    self._position += len(data)
+                    self._next_offset = offset + 1
+                finally:
+                    self._process_unlock()
+            with self._cond:
+                self._written = max(self._written, offset)
+                self._cond.notify_all()
+            self._ensure_flusher()
+            if wait:
+                self._wait_synced(offset)
+        metrics.inc("pod_eventlog_records_total")
+        return offset
+
+    # ── batched fsync ──
+    def _ensure_flusher(self):
+        if self._flusher is None:
+            with self._lock:
+                if self._flusher is None:
+                    self._flusher = threading.Thread(target=self._flush_loop, name="pod-eventlog-fsync", daemon=True)
+                    self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                while self._synced >= self._written:
+                    self._cond.wait()
+            time.sleep(self.fsync_interval)  # let concurrent appends join this batch
+            with self._lock:
+                target = self._written
+                fds = [os.dup(fd) for fd in (self._fd, self._idx_fd) if fd is not None]
+            try:
+                for fd in fds:
+                    os.fsync(fd)
+            except OSError as e:
+                logger.warning("event log fsync failed: %s", e)
+                metrics.inc("pod_eventlog_fsync_errors_total")
+            finally:
+                for fd in fds:
+                    os.close(fd)
+            with self._cond:
+                metrics.observe("pod_eventlog_fsync_batch", target - self._synced)
+                self._synced = max(self._synced, target)
+                self._cond.notify_all()
+
+    def _wait_synced(self, offset: int):
+        with self._cond:
+            while self._synced < offset:
+                self._cond.wait()
+
+    def flush(self):
+        """Block until everything appended by this process is fsynced."""
+        self._wait_synced(self._written)
+
+    # ── consumers ──
+    def read_from(self, offset: int = 0, limit: int | None = None):
+        """Yield records with offset >= `offset`, in order."""
+        segments = self._segments()
+        start = max(bisect.bisect_right(segments, offset) - 1, 0)
+        count = 0
+        for base in segments[start:]:
+            path = self._path(base, ".jsonl")
+            try:
+                size = os.path.getsize(path)
+                f = open(path, "rb")
+            except OSError:
+                continue  # removed by retention
+            with f:
+                f.seek(self._seek_position(base, offset, size))
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # append in flight
+                    record = json.loads(line)
+                    if record["offset"] < offset:
+                        continue
+                    yield record
+                    count += 1
+                    if limit is not None and count >= limit:
+                        return
+
+    def tail(self, offset: int = 0, poll_interval: float = 1.0, stop: threading.Event | None = None):
+        """Like read_from, but keeps polling for new records until `stop` is set."""
+        while stop is None or not stop.is_set():
+            caught_up = True
+            for record in self.read_from(offset):
+                caught_up = False
+                offset = record["offset"] + 1
+                yield record
+            if caught_up:
+                time.sleep(poll_interval)
+
+    def next_offset(self) -> int:
+        segments = self._segments()
+        if not segments:
+            return 0
+        last = None
+        for last in self.read_from(segments[-1]):
+            pass
+        return last["offset"] + 1 if last else segments[-1]
+
+    def _consumer_path(self, consumer: str) -> str:
+        return os.path.join(self.root, "consumers", f"{consumer}.offset")
+
+    def committed(self, consumer: str) -> int:
+        """Next offset the named consumer should read (0 if it never committed)."""
+        try:
+            with open(self._consumer_path(consumer), "r", encoding="utf-8") as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def commit(self, consumer: str, next_offset: int):
+        path = self._consumer_path(consumer)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(str(next_offset))
+        os.replace(tmp_path, path)
+
+
+_logs: dict[str, EventLog] = {}
+_logs_lock = threading.Lock()
+
+
+def get_log(storage_dir: str) -> EventLog:
+    """Process-wide log per storage directory (app.py re-executes on every rerun)."""
+    root = os.path.abspath(os.path.join(storage_dir, "_events"))
+    with _logs_lock:
+        log = _logs.get(root)
+        if log is None:
+            log = _logs[root] = EventLog(root)
+        return log
+
+
+def submission_record(metadata: dict, metadata_path: str) -> dict:
+    """Compact pod_submitted event for a metadata.json payload."""
+    return {
+        "type": "pod_submitted",
+        "shipment_key": metadata.get("shipment_key", ""),
+        "job_key": metadata.get("job_key", ""),
+        "carrier": metadata.get("carrier", ""),
+        "destination_city": metadata.get("destination_city", ""),
+        "upload_mode": metadata.get("upload_mode", ""),
+        "file_paths": metadata.get("file_paths", []),
+        "duplicates": len(metadata.get("duplicate_matches", [])),
+        "language": metadata.get("language", ""),
+        "uploaded_at": metadata.get("uploaded_at", ""),
+        "metadata_path": metadata_path,
+    }
+
+
+def quality_record(shipment: dict, result: dict, source: str, attempt: int | None = None) -> dict:
+    """Compact quality_check event: the verdict for one distinct upload."""
+    return {
+        "type": "quality_check",
+        "shipment_key": shipment.get("key", ""),
+        "carrier": shipment.get("carrier", ""),
+        "destination_city": shipment.get("destination_city", ""),
+        "passed": result["passed"],
+        "reasons": result["reasons"],
+        "scores": {k: (v if isinstance(v, str) else float(v)) for k, v in result["scores"].items()},
+        "attempt": attempt,
+        "source": source,
+        "checked_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+# ─────────────────────────────────────────────
+# CLI
+# ─────────────────────────────────────────────
+def backfill(storage_dir: str) -> int:
+    """Append one event per stored or archived metadata.json, oldest first. For seeding an empty log."""
+    entries = []
+    for name in os.listdir(storage_dir):
+        meta_path = os.path.join(storage_dir, name, "metadata.json")
+        if name.startswith("_") or not os.path.isfile(meta_path):
+            continue
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                metadata = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            continue
+        entries.append((metadata.get("uploaded_at", ""), submission_record(metadata, meta_path)))
+    store = archive.get_store(storage_dir)
+    for key, _ in store.iter_shipments():
+        metadata = store.read_metadata(key)
+        if metadata is not None:
+            meta_path = os.path.join(storage_dir, key, "metadata.json")
+            entries.append((metadata.get("uploaded_at", ""), submission_record(metadata, meta_path)))
+    log = get_log(storage_dir)
+    for _, record in sorted(entries, key=lambda e: e[0]):
+        log.append({**record, "backfilled": True}, wait=False)
+    log.flush()
+    return len(entries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="POD submission event log")
+    parser.add_argument("--storage", default=os.environ.get("POD_STORAGE_DIR", "pod_uploads"))
+    sub = parser.add_subparsers(dest="command", required=True)
+    tail = sub.add_parser("tail", help="print records as JSON lines")
+    tail.add_argument("--from", dest="offset", type=int, default=None)
+    tail.add_argument("--consumer", help="start from (and with --commit, advance) this consumer's offset")
+    tail.add_argument("--commit", action="store_true")
+    tail.add_argument("--follow", action="store_true")
+    backfill_parser = sub.add_parser("backfill", help="import existing metadata.json files")
+    backfill_parser.add_argument("--force", action="store_true", help="backfill even if the log is not empty")
+    args = parser.parse_args()
+
+    log = get_log(args.storage)
+    if args.command == "backfill":
+        if log.next_offset() > 0 and not args.force:
+            parser.error("event log is not empty; use --force to append anyway")
+        print(f"Backfilled {backfill(args.storage)} submissions")
+        return
+
+    offset = args.offset if args.offset is not None else (log.committed(args.consumer) if args.consumer else 0)
+    records = log.tail(offset) if args.follow else log.read_from(offset)
+    try:
+        for record in records:
+            print(json.dumps(record, ensure_ascii=False), flush=True)
+            if args.consumer and args.commit:
+                log.commit(args.consumer, record["offset"] + 1)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Fake Redash Server
+==================
+Serves a synthetic version of query 4922 so the app, the load-test harness and
+`send_links.py` can run without network access to redash.trella.co.
+
+Besides the full CSV it serves the parameterized execution API used by
+`redash.py` (status / updated_since / after_key / limit, keyset-ordered by
+updated_at and key). Every execution returns a finished job, so clients go
+through the same job -> query_result path as against real Redash.
+`touch()` moves a shipment to a new status with a fresh updated_at.
+
+Usage:
+    python fake_redash.py --port 5001 --shipments 500
+    POD_REDASH_URL=http://127.0.0.1:5001/api/queries/4922/results.csv streamlit run app.py
+    POD_REDASH_DELTA_URL=http://127.0.0.1:5001/api/queries/4922/results streamlit run app.py
+"""
+
+import csv
+import io
+import json
+import random
+import argparse
+import itertools
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+QUERY_ID = 4922
+COLUMNS = [
+    "key", "job_key", "status", "carrier", "carrier_mobile", "vehicle_plate",
+    "shipper", "entity", "pickup_city", "pickup_name", "destination_city",
+    "destination_name", "commodity", "weight", "distance", "updated_at",
+]
+CITIES = ["Riyadh", "Jeddah", "Dammam", "Mecca", "Medina", "Tabuk", "Abha", "Jubail"]
+COMMODITIES = ["Cement", "Steel", "Dry food", "Beverages", "Plastics", "Paper rolls"]
+STATUSES = ["AT_DROP_OFF_LOCATION", "IN_TRANSIT", "DELIVERED"]
+
+
+def make_shipments(count: int, dropoff_ratio: float = 0.3, seed: int = 4922) -> list[dict]:
+    """Generate `count` shipment rows shaped like the real query output."""
+    rng = random.Random(seed)
+    start = datetime(2026, 1, 1)
+    rows = []
+    for i in range(count):
+        pickup, dest = rng.sample(CITIES, 2)
+        rows.append({
+            "key": f"shp{i:08d}{rng.getrandbits(32):08x}",
+            "job_key": f"job{i:08d}",
+            "status": "AT_DROP_OFF_LOCATION" if rng.random() < dropoff_ratio else rng.choice(STATUSES[1:]),
+            "carrier": f"Driver {i}",
+            "carrier_mobile": f"05{rng.randrange(10**7, 10**8)}",
+            "vehicle_plate": f"{rng.randrange(1000, 9999)} ABC",
+            "shipper": f"Shipper {i % 40}",
+            "entity": f"Entity {i % 40}",
+            "pickup_city": pickup,
+            "pickup_name": f"{pickup} Warehouse {i % 7}",
+            "destination_city": dest,
+            "destination_name": f"{dest} DC {i % 5}",
+            "commodity": rng.choice(COMMODITIES),
+            "weight": rng.choice([10, 15, 20, 25, 30]),
+            "distance": round(rng.uniform(80, 1400), 1),
+            "updated_at": (start + timedelta(seconds=rng.randrange(90 * 86400))).isoformat(),
+        })
+    return rows
+
+
+def to_csv(rows: list[dict]) -> bytes:
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=COLUMNS)
+    writer.writeheader()
+    writer.writerows(rows)
+    return out.getvalue().encode("utf-8")
+
+
+class FakeRedash:
+    """In-process fake of the Redash results endpoint."""
+
+    def __init__(self, rows: list[dict], host: str = "127.0.0.1", port: int = 0):
+        self.rows = rows
+        self.requests = 0
+        self.bytes_sent = 0
+        self._csv = to_csv(rows)
+        self._results: dict[int, list[dict]] = {}
+        self._job_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _send(self, body: bytes, content_type: str):
+                fake.bytes_sent += len(body)
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_json(self, payload: dict):
+                self._send(json.dumps(payload).encode("utf-8"), "application/json")
+
+            def do_GET(self):
+                fake.requests += 1
+                path = self.path.split("?")[0]
+                if path == f"/api/queries/{QUERY_ID}/results.csv":
+                    self._send(fake._csv, "text/csv; charset=utf-8")
+                elif path.startswith("/api/jobs/"):
+                    job_id = int(path.rsplit("/", 1)[1])
+                    self._send_json({"job": {"id": job_id, "status": 3, "query_result_id": job_id}})
+                elif path.startswith("/api/query_results/"):
+                    with fake._lock:
+                        rows = fake._results.pop(int(path.rsplit("/", 1)[1]), None)
+                    if rows is None:
+                        self.send_error(404)
+                        return
+                    self._send_json({"query_result": {"data": {"columns": COLUMNS, "rows": rows}}})
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                fake.requests += 1
+                if self.path.split("?")[0] != f"/api/queries/{QUERY_ID}/results":
+                    self.send_error(404)
+                    return
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                rows = fake.query(**body.get("parameters", {}))
+                with fake._lock:
+                    job_id = next(fake._job_ids)
+                    fake._results[job_id] = rows
+                self._send_json({"job": {"id": job_id, "status": 3, "query_result_id": job_id}})
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/api/queries/{QUERY_ID}/results.csv?api_key=fake"
+
+    @property
+    def delta_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/api/queries/{QUERY_ID}/results?api_key=fake"
+
+    def query(self, status: str = "ANY", updated_since: str = "", after_key: str = "", limit: int = 1000) -> list[dict]:
+        """The parameterized query: rows after the (updated_at, key) cursor, in cursor order."""
+        cursor = (updated_since, after_key)
+        with self._lock:
+            matches = [
+                r for r in self.rows
+                if (status == "ANY" or r["status"] == status) and (r["updated_at"], r["key"]) > cursor
+            ]
+        matches.sort(key=lambda r: (r["updated_at"], r["key"]))
+        return matches[:int(limit)]
+
+    def touch(self, key: str, status: str):
+        """Change a shipment's status, as dispatch would."""
+        with self._lock:
+            for row in self.rows:
+                if row["key"] == key:
+                    row["status"] = status
+                    row["updated_at"] = datetime.now().isoformat()
+            self._csv = to_csv(self.rows)
+
+    def dropoff_keys(self) -> list[str]:
+        return [r["key"] for r in self.rows if r["status"] == "AT_DROP_OFF_LOCATION"]
+
+    def start(self) -> "FakeRedash":
+        threading.Thread(target=self.server.serve_forever, name="fake-redash", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a fake Redash query 4922")
+    parser.add_argument("--port", type=int, default=5001)
+    parser.add_argument("--shipments", type=int, default=500)
+    args = parser.parse_args()
+
+    fake = FakeRedash(make_shipments(args.shipments), port=args.port)
+    print(f"Serving {args.shipments} shipments at {fake.url} (parameterized: {fake.delta_url})")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
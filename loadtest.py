@@ -0,0 +1,367 @@
+"""
+Load-Test Harness
+=================
+Simulates N drivers going through the full POD flow against one in-process
+app instance, using Streamlit's AppTest as a headless client and a local fake
+Redash (see fake_redash.py).
+
+Each simulated driver opens their link, picks a language, confirms their
+details and uploads photos with realistic think times. A configurable share of
+drivers fail the quality check (blurry photos) and retry, and some exhaust all
+attempts and finish through the 3-photo fallback.
+
+The harness reports per-step latency percentiles, CPU and memory per session,
+and ramps concurrency to find the saturation point: the first level where
+throughput stops scaling or p95 latency breaches the SLO.
+
+Requires a Streamlit version whose AppTest supports `file_uploader.set_value`.
+
+Usage:
+    python loadtest.py                           # Ramp 1,2,4,8,16 drivers
+    python loadtest.py --levels 10 --think 0     # Single level, no think time
+    python loadtest.py --retry-ratio 0.5 --fallback-ratio 0.1 --slo-ms 1500
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import threading
+from collections import defaultdict
+
+import admission  # noqa: F401 - sets OpenCV's pixel cap, which cv2 reads once at import
+import cv2
+
+import bench
+from app import TRANSLATIONS, MAX_QUALITY_ATTEMPTS
+from fake_redash import FakeRedash, make_shipments
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+LANGUAGES = ("ar", "ur", "en")
+
+
+def _encode_jpeg(img) -> bytes:
+    ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 88])
+    return buf.tobytes()
+
+
+def make_photos(megapixels: int) -> tuple[bytes, bytes]:
+    """Return (good_photo, blurry_photo) JPEG bytes."""
+    w, h = bench.SIZES_MP[megapixels]
+    doc = bench.make_document(w, h, seed=7)
+    return _encode_jpeg(doc), _encode_jpeg(bench.apply_variant(doc, "blurry"))
+
+
+def rss_mb() -> float:
+    """Current resident set size in MB (Linux), falling back to peak RSS."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except OSError:
+        scale = 1e6 if sys.platform == "darwin" else 1e3
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def install_shared_runtime():
+    """Give every AppTest session one process-wide runtime and script cache.
+
+    AppTest installs a fresh mock Runtime and ScriptCache per run and clears
+    the runtime afterwards, which breaks concurrent sessions (and concurrent
+    compiles trip a CPython 3.11 parser bug). A real server shares both across
+    sessions (media files, st.cache_data storage, bytecode), so pin single ones.
+    It also hard-codes one session id for every AppTest; give each its own so
+    per-session state in the app (rate limits, upload buffers) isn't shared.
+    """
+    from unittest.mock import MagicMock
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+
+    shared = MagicMock(spec=Runtime)
+    shared.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    shared.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime.instance = classmethod(lambda cls: shared)
+    Runtime.exists = classmethod(lambda cls: True)
+
+    from streamlit.testing.v1.local_script_runner import LocalScriptRunner
+
+    runner_init = LocalScriptRunner.__init__
+
+    def init_with_session_id(self, script_path, session_state, *args, **kwargs):
+        runner_init(self, script_path, session_state, *args, **kwargs)
+        self._session_id = f"loadtest-{id(session_state):x}"
+
+    LocalScriptRunner.__init__ = init_with_session_id
+
+    scripts = ScriptCache()
+    get_bytecode = ScriptCache.get_bytecode
+    ScriptCache.get_bytecode = lambda self, path: get_bytecode(scripts, path)
+    scripts.get_bytecode(APP_PATH)
+    return shared
+
+
+# ─────────────────────────────────────────────
+# SIMULATED DRIVER
+# ─────────────────────────────────────────────
+class Driver:
+    def __init__(self, shipment_key: str, lang: str, failures: int, photos: tuple, think: float,
+                 rng: random.Random, timings: dict, lock: threading.Lock):
+        self.shipment_key = shipment_key
+        self.lang = lang
+        self.failures = failures
+        self.good, self.bad = photos
+        self.think_mean = think
+        self.rng = rng
+        self.timings = timings
+        self.lock = lock
+        self.at = None
+
+    def think(self):
+        if self.think_mean > 0:
+            time.sleep(self.rng.expovariate(1 / self.think_mean))
+
+    def step(self, name: str, action):
+        start = time.perf_counter()
+        action()
+        elapsed = time.perf_counter() - start
+        if self.at.exception:
+            raise RuntimeError(f"{name}: {self.at.exception[0].message}")
+        with self.lock:
+            self.timings[name].append(elapsed)
+
+    def button(self, label_key: str):
+        label = TRANSLATIONS[self.lang][label_key]
+        return next(b for b in self.at.button if b.label == label)
+
+    def upload(self, data: bytes, index: int = 0):
+        self.at.file_uploader[index].set_value(("pod.jpg", data, "image/jpeg")).run()
+
+    def run(self):
+        from streamlit.testing.v1 import AppTest
+
+        self.at = AppTest.from_file(APP_PATH, default_timeout=120)
+        self.at.query_params["shipment"] = self.shipment_key
+        self.step("open_link", self.at.run)
+        self.think()
+        self.step("select_language", lambda: self.at.button(key=f"btn_{self.lang}").click().run())
+        self.think()
+        self.step("confirm_details", lambda: self.at.checkbox(key="details_confirmed").check().run())
+        self.step("proceed", lambda: self.button("proceed").click().run())
+
+        for attempt in range(min(self.failures, MAX_QUALITY_ATTEMPTS)):
+            self.think()
+            self.step("quality_check_fail", lambda: self.upload(self.bad))
+            if attempt + 1 < MAX_QUALITY_ATTEMPTS:
+                # Driver clears the rejected photo, which shows a fresh uploader
+                self.step("retake", lambda: self.at.file_uploader[0].set_value(None).run())
+
+        if self.failures >= MAX_QUALITY_ATTEMPTS:
+            for i in range(3):
+                self.think()
+                self.step("fallback_upload", lambda i=i: self.upload(self.good, i))
+            self.think()
+            self.step("submit", lambda: self.button("submit_fallback").click().run())
+        else:
+            self.think()
+            self.step("quality_check_pass", lambda: self.upload(self.good))
+            self.think()
+            self.step("submit", lambda: self.button("submit_pod").click().run())
+
+        if self.at.session_state["step"] != "success":
+            raise RuntimeError(f"flow ended at step {self.at.session_state['step']!r}")
+
+
+# ─────────────────────────────────────────────
+# RUNNER
+# ─────────────────────────────────────────────
+def percentile(samples: list, p: float) -> float:
+    ordered = sorted(samples)
+    idx = min(int(round(p / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[idx]
+
+
+def run_level(concurrency: int, keys: list, photos: tuple, args, seed: int) -> dict:
+    timings = defaultdict(list)
+    lock = threading.Lock()
+    errors = []
+    rng = random.Random(seed)
+    drivers = []
+    for i in range(concurrency):
+        roll = rng.random()
+        if roll < args.fallback_ratio:
+            failures = MAX_QUALITY_ATTEMPTS
+        elif roll < args.fallback_ratio + args.retry_ratio:
+            failures = rng.randint(1, MAX_QUALITY_ATTEMPTS - 1)
+        else:
+            failures = 0
+        drivers.append(Driver(keys.pop(), rng.choice(LANGUAGES), failures, photos, args.think,
+                              random.Random(seed * 1000 + i), timings, lock))
+
+    def worker(driver: Driver):
+        try:
+            driver.run()
+        except Exception as e:  # noqa: BLE001 - reported, not raised
+            with lock:
+                errors.append(f"{driver.shipment_key}: {e}")
+
+    rss_before = rss_mb()
+    peak_rss = [rss_before]
+    stop = threading.Event()
+
+    def sample_rss():
+        while not stop.wait(0.2):
+            peak_rss[0] = max(peak_rss[0], rss_mb())
+
+    sampler = threading.Thread(target=sample_rss, daemon=True)
+    sampler.start()
+    cpu_before = time.process_time()
+    wall_start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(d,)) for d in drivers]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_before
+    stop.set()
+    sampler.join()
+
+    completed = concurrency - len(errors)
+    steps = {}
+    all_samples = []
+    for name, samples in timings.items():
+        all_samples.extend(samples)
+        steps[name] = {
+            "count": len(samples),
+            "p50_ms": round(percentile(samples, 50) * 1000, 1),
+            "p95_ms": round(percentile(samples, 95) * 1000, 1),
+            "p99_ms": round(percentile(samples, 99) * 1000, 1),
+            "max_ms": round(max(samples) * 1000, 1),
+        }
+    return {
+        "concurrency": concurrency,
+        "completed": completed,
+        "errors": errors,
+        "wall_s": round(wall, 2),
+        "sessions_per_min": round(completed / wall * 60, 2) if wall else 0.0,
+        "steps_per_s": round(len(all_samples) / wall, 2) if wall else 0.0,
+        "p95_ms": round(percentile(all_samples, 95) * 1000, 1) if all_samples else 0.0,
+        "cpu_s_per_session": round(cpu / max(completed, 1), 3),
+        "cpu_utilisation": round(cpu / wall, 2) if wall else 0.0,
+        "rss_mb_per_session": round((peak_rss[0] - rss_before) / concurrency, 1),
+        "peak_rss_mb": round(peak_rss[0], 1),
+        "steps": steps,
+    }
+
+
+def find_saturation(levels: list, slo_ms: float) -> int | None:
+    """First concurrency level where throughput stops scaling or p95 breaches the SLO."""
+    previous = None
+    for level in levels:
+        if level["p95_ms"] > slo_ms or level["errors"]:
+            return level["concurrency"]
+        if previous and level["steps_per_s"] < previous["steps_per_s"] * 1.1:
+            return level["concurrency"]
+        previous = level
+    return None
+
+
+def print_level(level: dict):
+    print(f"\n== {level['concurrency']} concurrent driver(s): {level['completed']} completed "
+          f"in {level['wall_s']}s, {level['steps_per_s']} steps/s, p95 {level['p95_ms']} ms")
+    print(f"   CPU {level['cpu_s_per_session']} s/session ({level['cpu_utilisation']} cores), "
+          f"RSS +{level['rss_mb_per_session']} MB/session (peak {level['peak_rss_mb']} MB)")
+    print(f"   {'step':<22} {'n':>5} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+    for name, s in level["steps"].items():
+        print(f"   {name:<22} {s['count']:>5} {s['p50_ms']:>9} {s['p95_ms']:>9} "
+              f"{s['p99_ms']:>9} {s['max_ms']:>9}")
+    for err in level["errors"][:5]:
+        print(f"   ERROR {err}")
+
+
+def start_shards(count: int, storage: str) -> list:
+    """Run `count` storage nodes as local processes and point the app at them."""
+    import socket
+    import subprocess
+    import urllib.request
+
+    procs, urls = [], []
+    for i in range(count):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        procs.append(subprocess.Popen([
+            sys.executable, os.path.join(os.path.dirname(APP_PATH), "shards.py"), "serve",
+            "--addr", "127.0.0.1", "--port", str(port), "--storage", os.path.join(storage, "_shards", f"node{i}"),
+        ]))
+        urls.append(f"http://127.0.0.1:{port}")
+    for url in urls:
+        for _ in range(100):
+            try:
+                urllib.request.urlopen(url + "/healthz", timeout=1).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+    os.environ["POD_SHARD_NODES"] = ",".join(urls)
+    print(f"Storage nodes: {os.environ['POD_SHARD_NODES']}")
+    return procs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the POD app with simulated drivers")
+    parser.add_argument("--levels", nargs="+", type=int, default=[1, 2, 4, 8, 16],
+                        help="Concurrency levels to ramp through")
+    parser.add_argument("--think", type=float, default=1.0, help="Mean think time in seconds (0 = none)")
+    parser.add_argument("--retry-ratio", type=float, default=0.3,
+                        help="Share of drivers that fail the quality check 1-2 times")
+    parser.add_argument("--fallback-ratio", type=float, default=0.05,
+                        help="Share of drivers that exhaust attempts and use the 3-photo fallback")
+    parser.add_argument("--megapixels", type=int, choices=sorted(bench.SIZES_MP), default=12)
+    parser.add_argument("--slo-ms", type=float, default=2000.0, help="p95 step latency SLO")
+    parser.add_argument("--output", help="Write the full report as JSON")
+    parser.add_argument("--delta-fetch", action="store_true",
+                        help="Fetch shipments through the parameterized, paged Redash query")
+    parser.add_argument("--shards", type=int, default=0,
+                        help="Store PODs on this many local storage-node processes (shards.py)")
+    args = parser.parse_args()
+
+    total = sum(args.levels)
+    fake = FakeRedash(make_shipments(total * 4, dropoff_ratio=0.5)).start()
+    storage = tempfile.mkdtemp(prefix="pod_loadtest_")
+    os.environ["POD_REDASH_URL"] = fake.url
+    if args.delta_fetch:
+        os.environ["POD_REDASH_DELTA_URL"] = fake.delta_url
+    os.environ["POD_STORAGE_DIR"] = storage
+    nodes = start_shards(args.shards, storage) if args.shards else []
+    keys = fake.dropoff_keys()
+    photos = make_photos(args.megapixels)
+    install_shared_runtime()
+
+    print(f"Fake Redash at {fake.url}, storage in {storage}")
+    print(f"Photos: {args.megapixels} MP ({len(photos[0]) // 1024} KB good, {len(photos[1]) // 1024} KB blurry)")
+
+    results = []
+    for i, concurrency in enumerate(args.levels):
+        level = run_level(concurrency, keys, photos, args, seed=i + 1)
+        results.append(level)
+        print_level(level)
+
+    saturation = find_saturation(results, args.slo_ms)
+    print("\nSaturation point:", f"{saturation} concurrent drivers" if saturation else "not reached")
+    fake.stop()
+    for node in nodes:
+        node.terminate()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"levels": results, "saturation": saturation, "args": vars(args)}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
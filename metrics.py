@@ -0,0 +1,434 @@
+"""
+Hot-Path Instrumentation
+========================
+Lightweight timers, counters and histograms for the POD capture app.
+
+Metrics are exported in Prometheus text format and every Streamlit rerun can
+emit one structured JSON timing log line. Everything is off by default; when
+disabled each call site costs a single flag check.
+
+Configuration (environment variables):
+    POD_METRICS=1                 Collect metrics and per-request timing logs
+    POD_METRICS_PORT=9108         Serve /metrics (and /profile) on this port
+    POD_PROFILE_INTERVAL=0.005    Run the sampling profiler at this interval
+
+Usage:
+    import metrics
+
+    with metrics.timer("pod_quality_stage_seconds", stage="decode"):
+        ...
+
+    @metrics.timed("pod_save_image_seconds")
+    def save_pod_image(...):
+        ...
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import logging
+import threading
+import functools
+import importlib
+import contextvars
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ENABLED = os.environ.get("POD_METRICS", "").lower() in ("1", "true", "yes")
+METRICS_PORT = int(os.environ.get("POD_METRICS_PORT", "0") or 0)
+PROFILE_INTERVAL = float(os.environ.get("POD_PROFILE_INTERVAL", "0") or 0)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+logger = logging.getLogger("pod.metrics")
+
+_lock = threading.Lock()
+_counters: dict = {}
+_gauges: dict = {}
+_histograms: dict = {}
+_request_timings = contextvars.ContextVar("pod_request_timings", default=None)
+_imported_at = time.time()
+import_times: dict = {}
+
+
+def enable(on: bool = True):
+    """Turn collection on or off at runtime (benchmarks, tests, REPL)."""
+    global ENABLED
+    ENABLED = on
+
+
+def reset():
+    """Drop all collected series."""
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return name, tuple(sorted(labels.items())) if labels else ()
+
+
+# ─────────────────────────────────────────────
+# PRIMITIVES
+# ─────────────────────────────────────────────
+def inc(name: str, value: float = 1.0, **labels):
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0.0) + value
+
+
+def set_gauge(name: str, value: float, **labels):
+    if not ENABLED:
+        return
+    with _lock:
+        _gauges[_key(name, labels)] = float(value)
+
+
+def observe(name: str, value: float, **labels):
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = [[0] * len(DEFAULT_BUCKETS), 0.0, 0]
+        buckets = hist[0]
+        for i, bound in enumerate(DEFAULT_BUCKETS):
+            if value <= bound:
+                buckets[i] += 1
+                break
+        hist[1] += value
+        hist[2] += 1
+
+
+def histogram_summary(name: str, **labels) -> dict | None:
+    """Return {"count", "sum", "mean"} for one histogram series, if recorded."""
+    with _lock:
+        hist = _histograms.get(_key(name, labels))
+        if hist is None:
+            return None
+        count, total = hist[2], hist[1]
+    return {"count": count, "sum": total, "mean": total / count if count else 0.0}
+
+
+class _Timer:
+    __slots__ = ("name", "labels", "start")
+
+    def __init__(self, name: str, labels: dict):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        observe(self.name, elapsed, **self.labels)
+        state = _request_timings.get()
+        if state is not None:
+            timings = state[0]
+            label = self.name
+            if self.labels:
+                label += ":" + ",".join(str(v) for v in self.labels.values())
+            timings[label] = timings.get(label, 0.0) + elapsed
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timer(name: str, **labels):
+    """Context manager recording elapsed seconds into histogram `name`."""
+    if not ENABLED:
+        return _NULL_TIMER
+    return _Timer(name, labels)
+
+
+def timed(name: str, **labels):
+    """Decorator form of `timer`."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return fn(*args, **kwargs)
+            with _Timer(name, labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# ─────────────────────────────────────────────
+# PER-REQUEST TIMING LOGS
+# ─────────────────────────────────────────────
+class request_scope:
+    """Collect every timer that fires inside one request and log it as JSON."""
+
+    def __init__(self, name: str, **fields):
+        self.name = name
+        self.fields = fields
+        self.token = None
+        self.start = 0.0
+
+    def __enter__(self):
+        if ENABLED:
+            self.start = time.perf_counter()
+            self.token = _request_timings.set(({}, dict(self.fields)))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.token is None:
+            return False
+        elapsed = time.perf_counter() - self.start
+        timings, fields = _request_timings.get()
+        _request_timings.reset(self.token)
+        observe("pod_request_seconds", elapsed, request=self.name)
+        inc("pod_requests_total", request=self.name)
+        record = {
+            "event": "request_timing",
+            "request": self.name,
+            "total_ms": round(elapsed * 1000, 2),
+            "timings_ms": {k: round(v * 1000, 2) for k, v in timings.items()},
+            **fields,
+        }
+        # st.stop()/st.rerun() unwind through here as control-flow exceptions
+        if exc_type is not None:
+            record["exit"] = exc_type.__name__
+        logger.info(json.dumps(record, ensure_ascii=False, default=str))
+        return False
+
+
+def annotate(**fields):
+    """Attach extra fields to the current request's timing log, if any."""
+    state = _request_timings.get()
+    if state is not None:
+        state[1].update(fields)
+
+
+# ─────────────────────────────────────────────
+# STARTUP
+# ─────────────────────────────────────────────
+def lazy_import(name: str):
+    """Import a heavy module on first use and record how long that took."""
+    module = sys.modules.get(name)
+    # Another session may still be importing it; importlib then waits on the module lock
+    if module is not None and not getattr(getattr(module, "__spec__", None), "_initializing", False):
+        return module
+    with timer("pod_lazy_import_seconds", module=name):
+        start = time.perf_counter()
+        module = importlib.import_module(name)
+        elapsed = time.perf_counter() - start
+    if name not in import_times:
+        import_times[name] = elapsed
+        set_gauge("pod_import_seconds", elapsed, module=name)
+    return module
+
+
+def process_start_time() -> float:
+    """Wall-clock start of this process (Linux /proc), else when metrics was imported."""
+    try:
+        with open("/proc/self/stat", "r") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime", "r") as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - uptime + start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return _imported_at
+
+
+_first_render_done = False
+
+
+def mark_first_render(**fields):
+    """Record time-to-first-render once per process, with the imports seen so far."""
+    global _first_render_done
+    if _first_render_done:
+        return
+    _first_render_done = True
+    elapsed = time.time() - process_start_time()
+    set_gauge("pod_time_to_first_render_seconds", elapsed)
+    if ENABLED:
+        logger.info(json.dumps({
+            "event": "startup",
+            "time_to_first_render_ms": round(elapsed * 1000, 1),
+            "lazy_imports_ms": {k: round(v * 1000, 1) for k, v in import_times.items()},
+            "deferred": [m for m in ("cv2", "numpy", "pandas") if m not in sys.modules],
+            **fields,
+        }))
+
+
+# ─────────────────────────────────────────────
+# PROMETHEUS EXPORT
+# ─────────────────────────────────────────────
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    items = labels + extra
+    if not items:
+        return ""
+    parts = []
+    for k, v in items:
+        v = str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{k}="{v}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def render_prometheus() -> str:
+    """Render all series in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        counters = sorted(_counters.items())
+        gauges = sorted(_gauges.items())
+        histograms = sorted((k, (list(v[0]), v[1], v[2])) for k, v in _histograms.items())
+
+    declared = set()
+    for (name, labels), value in counters:
+        if name not in declared:
+            lines.append(f"# TYPE {name} counter")
+            declared.add(name)
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+    for (name, labels), value in gauges:
+        if name not in declared:
+            lines.append(f"# TYPE {name} gauge")
+            declared.add(name)
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+    for (name, labels), (buckets, total, count) in histograms:
+        if name not in declared:
+            lines.append(f"# TYPE {name} histogram")
+            declared.add(name)
+        cumulative = 0
+        for bound, n in zip(DEFAULT_BUCKETS, buckets):
+            cumulative += n
+            lines.append(f"{name}_bucket{_format_labels(labels, (('le', bound),))} {cumulative}")
+        lines.append(f"{name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {count}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+        lines.append(f"{name}_count{_format_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+# ─────────────────────────────────────────────
+# SAMPLING PROFILER
+# ─────────────────────────────────────────────
+class SamplingProfiler:
+    """Periodically samples every thread's stack into collapsed-stack counts.
+
+    Output is compatible with flamegraph.pl / speedscope ("a;b;c <count>").
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="pod-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self.samples[";".join(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        return "\n".join(f"{stack} {n}" for stack, n in self.samples.most_common()) + "\n"
+
+    def dump(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.collapsed())
+
+
+profiler: SamplingProfiler | None = None
+
+
+def start_profiler(interval: float = 0.005) -> SamplingProfiler:
+    global profiler
+    if profiler is None:
+        profiler = SamplingProfiler(interval)
+        profiler.start()
+    return profiler
+
+
+# ─────────────────────────────────────────────
+# HTTP EXPORTER
+# ─────────────────────────────────────────────
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.startswith("/metrics"):
+            body = render_prometheus().encode()
+            content_type = "text/plain; version=0.0.4"
+        elif self.path.startswith("/profile") and profiler is not None:
+            body = profiler.collapsed().encode()
+            content_type = "text/plain"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+
+
+def start_http_server(port: int, addr: str = "0.0.0.0"):
+    """Serve /metrics (and /profile) from a daemon thread. Idempotent."""
+    global _server
+    if _server is None:
+        _server = ThreadingHTTPServer((addr, port), _MetricsHandler)
+        threading.Thread(target=_server.serve_forever, name="pod-metrics", daemon=True).start()
+    return _server
+
+
+# Module import happens once per process, even though Streamlit re-executes
+# app.py on every rerun, so process-wide side effects live here.
+if ENABLED and not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+if ENABLED and METRICS_PORT:
+    try:
+        start_http_server(METRICS_PORT)
+    except OSError as e:
+        logger.warning("metrics exporter not started on port %s: %s", METRICS_PORT, e)
+if PROFILE_INTERVAL > 0:
+    start_profiler(PROFILE_INTERVAL)
+    _profile_out = os.environ.get("POD_PROFILE_OUTPUT")
+    if _profile_out:
+        atexit.register(lambda: profiler.dump(_profile_out))
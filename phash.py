@@ -0,0 +1,339 @@
+"""
+Perceptual-Hash Duplicate Detection
+===================================
+Flags POD photos that were already submitted for another shipment, such as the
+same waybill photo reused across shipments or an old gallery picture.
+
+Every stored image gets a 64-bit DCT perceptual hash (pHash). Hashes live in a
+multi-index hash table: the hash is split into four 16-bit chunks, each with its
+own bucket table. Two hashes within Hamming distance r must agree on at least
+one chunk to within r // 4 bits, so a lookup only probes a handful of buckets
+instead of scanning the archive.
+
+The index is persisted as an append-only log under <storage>/_phash/ and every
+process tails it before a lookup, so entries written by other app processes are
+visible without a restart.
+
+Usage:
+    python phash.py rebuild                 # Backfill the index from pod_uploads/
+    python phash.py query photo.jpg         # List near-duplicates of a photo
+"""
+
+import os
+import sys
+import argparse
+import threading
+import time
+
+import metrics
+
+HASH_BITS = 64
+CHUNKS = 4
+CHUNK_BITS = HASH_BITS // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+DEFAULT_MAX_DISTANCE = 6
+INDEX_DIRNAME = "_phash"
+INDEX_FILENAME = "index.log"
+MERGE_MIN = 4096
+MERGE_RATIO = 0.125  # rebuild the chunk tables once the unmerged tail is this share of the index
+PENDING_TTL_SECONDS = 3600
+
+
+# ─────────────────────────────────────────────
+# HASHING
+# ─────────────────────────────────────────────
+def compute_phash(image_bytes: bytes) -> int | None:
+    """64-bit DCT perceptual hash, or None if the image can't be decoded."""
+    cv2 = metrics.lazy_import("cv2")
+    np = metrics.lazy_import("numpy")
+    nparr = np.frombuffer(image_bytes, np.uint8)
+    # JPEGs decode at 1/8 scale straight from the DCT coefficients
+    gray = cv2.imdecode(nparr, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if gray is None:
+        gray = cv2.imdecode(nparr, cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        return None
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    median = np.median(low[1:])
+    value = 0
+    for bit in low > median:
+        value = (value << 1) | int(bit)
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def _chunks(value: int) -> list[int]:
+    return [(value >> (i * CHUNK_BITS)) & CHUNK_MASK for i in range(CHUNKS)]
+
+
+def _neighbours(chunk: int, radius: int):
+    """Yield every chunk value within `radius` bits of `chunk`."""
+    yield chunk
+    if radius >= 1:
+        for i in range(CHUNK_BITS):
+            flipped = chunk ^ (1 << i)
+            yield flipped
+            if radius >= 2:
+                for j in range(i + 1, CHUNK_BITS):
+                    yield flipped ^ (1 << j)
+
+
+# ─────────────────────────────────────────────
+# INDEX
+# ─────────────────────────────────────────────
+_POPCOUNT8 = None
+
+
+def _popcount(values):
+    """Per-element bit count of a uint64 array."""
+    np = metrics.lazy_import("numpy")
+    if hasattr(np, "bitwise_count"):  # numpy >= 2.0
+        return np.bitwise_count(values)
+    global _POPCOUNT8
+    if _POPCOUNT8 is None:
+        _POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+    return _POPCOUNT8[values.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+class PHashIndex:
+    """Multi-index hash table over an append-only on-disk log.
+
+    Hashes and log offsets are numpy arrays. Each chunk table is a CSR layout:
+    entry ids sorted by chunk value, plus the start of every chunk value's run.
+    Entries appended since the last merge form a tail that lookups scan
+    directly; the tables are rebuilt once the tail passes MERGE_RATIO of the
+    index. Shipment keys and paths stay in the log and are read back for
+    matches only.
+    """
+
+    def __init__(self, storage_dir: str):
+        np = metrics.lazy_import("numpy")
+        self.dir = os.path.join(storage_dir, INDEX_DIRNAME)
+        self.path = os.path.join(self.dir, INDEX_FILENAME)
+        self.hashes = np.empty(0, dtype=np.uint64)
+        self.line_offsets = np.empty(0, dtype=np.int64)
+        self.size = 0
+        self.tables: list[tuple] = []  # per chunk: (starts, entry ids) over the first `merged` entries
+        self.merged = 0
+        self.pending_matches: dict[str, tuple[float, list]] = {}
+        self._offset = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.size
+
+    def _append(self, values: list[int], offsets: list[int]):
+        np = metrics.lazy_import("numpy")
+        need = self.size + len(values)
+        if need > len(self.hashes):
+            capacity = max(need, 2 * len(self.hashes), 1024)
+            self.hashes = np.resize(self.hashes, capacity)
+            self.line_offsets = np.resize(self.line_offsets, capacity)
+        self.hashes[self.size:need] = np.array(values, dtype=np.uint64)
+        self.line_offsets[self.size:need] = offsets
+        self.size = need
+        if self.size - self.merged > max(MERGE_MIN, int(self.merged * MERGE_RATIO)):
+            self._merge()
+
+    def _merge(self):
+        """Rebuild the chunk tables over every entry (counting sort on each 16-bit chunk)."""
+        np = metrics.lazy_import("numpy")
+        hashes = self.hashes[:self.size]
+        tables = []
+        for i in range(CHUNKS):
+            chunk = ((hashes >> np.uint64(i * CHUNK_BITS)) & np.uint64(CHUNK_MASK)).astype(np.uint16)
+            starts = np.zeros(CHUNK_MASK + 2, dtype=np.int64)
+            np.cumsum(np.bincount(chunk, minlength=CHUNK_MASK + 1), out=starts[1:])
+            tables.append((starts, np.argsort(chunk, kind="stable").astype(np.uint32)))
+        self.tables, self.merged = tables, self.size
+
+    def _catch_up(self):
+        """Load log lines appended since the last read (by any process)."""
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return
+        if size <= self._offset:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read(size - self._offset)
+        # Only consume complete lines; a concurrent writer may be mid-line
+        end = data.rfind(b"\n") + 1
+        values, offsets = [], []
+        position = self._offset
+        for line in data[:end].split(b"\n")[:-1]:
+            parts = line.split(b"\t")
+            if len(parts) == 3:
+                values.append(int(parts[0], 16))
+                offsets.append(position)
+            position += len(line) + 1
+        if values:
+            self._append(values, offsets)
+        self._offset += end
+
+    def _entry(self, entry: int) -> tuple[str, str]:
+        """(shipment_key, path) of an entry, read back from its log line."""
+        with open(self.path, "rb") as f:
+            f.seek(int(self.line_offsets[entry]))
+            _, shipment_key, path = f.readline().decode("utf-8").rstrip("\n").split("\t")
+        return shipment_key, path
+
+    def _candidates(self, value: int, max_distance: int):
+        np = metrics.lazy_import("numpy")
+        radius = max_distance // CHUNKS
+        if radius > 2 or not self.tables:
+            # Probing stops paying off past two bits per chunk; scan instead
+            return np.arange(self.size)
+        runs = [np.arange(self.merged, self.size)]
+        for (starts, ids), chunk in zip(self.tables, _chunks(value)):
+            probes = np.fromiter(_neighbours(chunk, radius), dtype=np.int64)
+            for lo, hi in zip(starts[probes], starts[probes + 1]):
+                if hi > lo:
+                    runs.append(ids[lo:hi])
+        return np.unique(np.concatenate(runs))
+
+    def _search(self, value: int, max_distance: int, exclude_shipment: str | None) -> list[dict]:
+        np = metrics.lazy_import("numpy")
+        candidates = self._candidates(value, max_distance)
+        distances = _popcount(self.hashes[candidates] ^ np.uint64(value))
+        matches = []
+        for entry, distance in zip(candidates[distances <= max_distance], distances[distances <= max_distance]):
+            shipment_key, path = self._entry(entry)
+            if exclude_shipment is not None and shipment_key == exclude_shipment:
+                continue
+            matches.append({"shipment_key": shipment_key, "file": path, "distance": int(distance)})
+        matches.sort(key=lambda m: m["distance"])
+        return matches
+
+    def files(self) -> set[str]:
+        """Every indexed path."""
+        with self._lock:
+            self._catch_up()
+            try:
+                with open(self.path, "rb") as f:
+                    data = f.read(self._offset)
+            except OSError:
+                return set()
+        return {parts[2] for parts in (line.split("\t") for line in data.decode("utf-8").splitlines())
+                if len(parts) == 3}
+
+    def lookup(self, value: int, max_distance: int = DEFAULT_MAX_DISTANCE,
+               exclude_shipment: str | None = None) -> list[dict]:
+        with self._lock:
+            self._catch_up()
+            return self._search(value, max_distance, exclude_shipment)
+
+    def add(self, shipment_key: str, file_path: str, value: int,
+            max_distance: int = DEFAULT_MAX_DISTANCE) -> list[dict]:
+        """Look up near-duplicates from other shipments, then index this image."""
+        with self._lock:
+            self._catch_up()
+            matches = self._search(value, max_distance, exclude_shipment=shipment_key)
+            os.makedirs(self.dir, exist_ok=True)
+            line = f"{value:016x}\t{shipment_key}\t{file_path}\n".encode("utf-8")
+            # O_APPEND keeps concurrent single-line writes from interleaving
+            fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+            self._catch_up()
+            now = time.monotonic()
+            # Flows abandoned before their metadata is saved never pop their matches
+            for path in [p for p, (expires, _) in self.pending_matches.items() if expires <= now]:
+                del self.pending_matches[path]
+            if matches:
+                self.pending_matches[file_path] = (now + PENDING_TTL_SECONDS, matches)
+            return matches
+
+    def pop_matches(self, file_path: str) -> list[dict]:
+        """Matches found when `file_path` was indexed by this process."""
+        with self._lock:
+            expires, matches = self.pending_matches.pop(file_path, (0.0, []))
+            return matches if expires > time.monotonic() else []
+
+
+_indexes: dict[str, PHashIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(storage_dir: str) -> PHashIndex:
+    """Process-wide index for a storage directory (app.py re-executes on every rerun)."""
+    key = os.path.abspath(storage_dir)
+    with _indexes_lock:
+        if key not in _indexes:
+            _indexes[key] = PHashIndex(storage_dir)
+        return _indexes[key]
+
+
+def index_image(storage_dir: str, shipment_key: str, file_path: str, image_bytes: bytes,
+                max_distance: int = DEFAULT_MAX_DISTANCE) -> list[dict]:
+    """Hash and index a stored POD image, returning near-duplicates from other shipments."""
+    with metrics.timer("pod_phash_seconds"):
+        try:
+            value = compute_phash(image_bytes)
+        except Exception:  # noqa: BLE001 - cv2.error on corrupt input; cv2 may not be imported yet
+            value = None
+        if value is None:
+            return []
+        matches = get_index(storage_dir).add(shipment_key, file_path, value, max_distance)
+    if matches:
+        metrics.inc("pod_duplicate_flags_total")
+    return matches
+
+
+# ─────────────────────────────────────────────
+# CLI
+# ─────────────────────────────────────────────
+def rebuild(storage_dir: str, max_distance: int):
+    import archive
+    from rescore import iter_pod_images
+
+    index = get_index(storage_dir)
+    known = index.files()
+    added = flagged = 0
+    for shipment_key, path, _ in iter_pod_images(storage_dir):
+        if path in known:
+            continue
+        data = archive.read_file(path)
+        if data is None:
+            continue
+        matches = index_image(storage_dir, shipment_key, path, data, max_distance)
+        added += 1
+        if matches:
+            flagged += 1
+            print(f"  {path} ~ {matches[0]['file']} (distance {matches[0]['distance']})")
+    print(f"Indexed {added} new image(s), {flagged} with near-duplicates; {len(index)} total")
+
+
+def main():
+    import app
+
+    parser = argparse.ArgumentParser(description="POD perceptual-hash index")
+    parser.add_argument("command", choices=["rebuild", "query"])
+    parser.add_argument("image", nargs="?", help="Photo to look up (query)")
+    parser.add_argument("--storage", default=app.POD_STORAGE_DIR)
+    parser.add_argument("--max-distance", type=int, default=app.DUPLICATE_MAX_DISTANCE)
+    args = parser.parse_args()
+
+    if args.command == "rebuild":
+        rebuild(args.storage, args.max_distance)
+        return
+
+    if not args.image:
+        parser.error("query needs an image path")
+    with open(args.image, "rb") as f:
+        value = compute_phash(f.read())
+    if value is None:
+        sys.exit("Could not decode image")
+    for match in get_index(args.storage).lookup(value, args.max_distance):
+        print(f"  {match['distance']:>2}  {match['shipment_key']}  {match['file']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""
+Offline POD Quality Re-Scoring
+===============================
+Re-runs `analyze_image_quality` over every stored POD image, e.g. after the
+quality thresholds change or to audit fallback-mode submissions.
+
+Images are streamed from the storage directory and its archive packs, scored
+in parallel across all cores and written as Parquet part files, one row per
+image, joined with the shipment's metadata.json fields. Progress is checkpointed after every part, so
+an interrupted run resumes where it stopped.
+
+Usage:
+    python rescore.py --output rescored/                     # Score everything
+    python rescore.py --output rescored/ --mode fallback_triple
+    python rescore.py --output rescored/ --blur-threshold 60 --workers 8
+    python rescore.py --output rescored/ --fresh             # Ignore the checkpoint
+    python rescore.py --output rescored/ --adaptive          # Calibrated thresholds
+"""
+
+import os
+import json
+import time
+import argparse
+import multiprocessing
+
+import archive
+import metrics
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".heic", ".heif")
+METADATA_FIELDS = (
+    "job_key", "carrier", "vehicle_plate", "shipper", "entity", "pickup_city",
+    "destination_city", "commodity", "upload_mode", "uploaded_at", "language",
+)
+CHECKPOINT_FILE = "_checkpoint.txt"
+
+
+
+def _pyarrow():
+    """(pyarrow, pyarrow.parquet); imported on use so phash.py can share iter_pod_images without it."""
+    try:
+        return metrics.lazy_import("pyarrow"), metrics.lazy_import("pyarrow.parquet")
+    except ImportError:
+        raise SystemExit("rescore.py writes Parquet and needs pyarrow: pip install -r requirements.txt") from None
+
+
+def schema():
+    pa, _ = _pyarrow()
+    return pa.schema(
+        [
+            ("shipment_key", pa.string()),
+            ("image_path", pa.string()),
+            ("file_bytes", pa.int64()),
+            ("passed", pa.bool_()),
+            ("reasons", pa.list_(pa.string())),
+            ("width", pa.int32()),
+            ("height", pa.int32()),
+            ("sharpness", pa.float64()),
+            ("brightness", pa.float64()),
+            ("edge_ratio", pa.float64()),
+            ("error", pa.string()),
+        ]
+        + [(name, pa.string()) for name in METADATA_FIELDS]
+        + [("scored_at", pa.string())]
+    )
+
+
+# ─────────────────────────────────────────────
+# SOURCE
+# ─────────────────────────────────────────────
+def iter_pod_images(root: str, mode: str | None = None):
+    """Yield (shipment_key, image_path, metadata) without listing everything up front."""
+    with os.scandir(root) as shipments:
+        for entry in shipments:
+            if not entry.is_dir() or entry.name.startswith("_"):
+                continue
+            metadata = {}
+            meta_path = os.path.join(entry.path, "metadata.json")
+            try:
+                with open(meta_path, "r", encoding="utf-8") as f:
+                    metadata = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                pass
+            if mode and metadata.get("upload_mode") != mode:
+                continue
+            with os.scandir(entry.path) as files:
+                for f in files:
+                    if f.is_file() and f.name.lower().endswith(IMAGE_EXTENSIONS):
+                        yield entry.name, f.path, metadata
+    store = archive.get_store(root)
+    for key, names in store.iter_shipments():
+        if os.path.isdir(os.path.join(root, key)):
+            continue  # archived but not yet removed; already yielded above
+        metadata = store.read_metadata(key) or {}
+        if mode and metadata.get("upload_mode") != mode:
+            continue
+        for name in names:
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield key, os.path.join(root, key, name), metadata
+
+
+# ─────────────────────────────────────────────
+# WORKERS
+# ─────────────────────────────────────────────
+def _init_worker(overrides: dict):
+    import app  # before cv2, so admission's OpenCV pixel cap is in the environment
+    import cv2
+
+    # One OpenCV thread per process; parallelism comes from the pool
+    cv2.setNumThreads(1)
+    for name, value in overrides.items():
+        setattr(app, name, value)
+
+
+def score_one(item: tuple) -> dict:
+    import app
+
+    shipment_key, path, metadata = item
+    row = {"shipment_key": shipment_key, "image_path": path, "error": None}
+    try:
+        data = archive.read_file(path)
+        if data is None:
+            raise FileNotFoundError(path)
+        row["file_bytes"] = len(data)
+        result = app.analyze_image_quality(data)
+        scores = result["scores"]
+        row["passed"] = result["passed"]
+        row["reasons"] = result["reasons"]
+        if "resolution" in scores:
+            w, h = scores["resolution"].split("x")
+            row["width"], row["height"] = int(w), int(h)
+        row["sharpness"] = float(scores["sharpness"]) if "sharpness" in scores else None
+        row["brightness"] = float(scores["brightness"]) if "brightness" in scores else None
+        row["edge_ratio"] = float(scores["edge_ratio"]) if "edge_ratio" in scores else None
+    except Exception as e:  # noqa: BLE001 - recorded per row
+        row["error"] = f"{type(e).__name__}: {e}"
+    for name in METADATA_FIELDS:
+        value = metadata.get(name)
+        row[name] = None if value is None else str(value)
+    row["scored_at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    return row
+
+
+# ─────────────────────────────────────────────
+# SINK
+# ─────────────────────────────────────────────
+class PartWriter:
+    """Buffers rows and commits them as numbered Parquet parts plus checkpoint lines."""
+
+    def __init__(self, output_dir: str, batch_size: int):
+        self.pa, self.pq = _pyarrow()  # fail before scoring anything
+        self.schema = schema()
+        self.output_dir = output_dir
+        self.batch_size = batch_size
+        self.rows = []
+        existing = [n for n in os.listdir(output_dir) if n.startswith("part-") and n.endswith(".parquet")]
+        self.part = len(existing)
+        self.written = 0
+
+    def add(self, row: dict):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        table = self.pa.Table.from_pylist(self.rows, schema=self.schema)
+        path = os.path.join(self.output_dir, f"part-{self.part:05d}.parquet")
+        self.pq.write_table(table, path + ".tmp", compression="zstd")
+        os.replace(path + ".tmp", path)
+        with open(os.path.join(self.output_dir, CHECKPOINT_FILE), "a", encoding="utf-8") as f:
+            f.writelines(row["image_path"] + "\n" for row in self.rows)
+            f.flush()
+            os.fsync(f.fileno())
+        self.part += 1
+        self.written += len(self.rows)
+        self.rows = []
+
+
+def load_checkpoint(output_dir: str) -> set:
+    path = os.path.join(output_dir, CHECKPOINT_FILE)
+    if not os.path.exists(path):
+        return set()
+    with open(path, "r", encoding="utf-8") as f:
+        return {line.rstrip("\n") for line in f if line.strip()}
+
+
+def main():
+    import app
+
+    parser = argparse.ArgumentParser(description="Re-score stored POD images")
+    parser.add_argument("--source", default=app.POD_STORAGE_DIR, help="POD storage directory")
+    parser.add_argument("--output", required=True, help="Directory for Parquet parts + checkpoint")
+    parser.add_argument("--mode", help="Only shipments with this upload_mode (e.g. fallback_triple)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--batch-size", type=int, default=2000, help="Rows per Parquet part")
+    parser.add_argument("--fresh", action="store_true", help="Discard previous parts and checkpoint")
+    parser.add_argument("--blur-threshold", type=float)
+    parser.add_argument("--dark-threshold", type=float)
+    parser.add_argument("--bright-threshold", type=float)
+    parser.add_argument("--min-edge-ratio", type=float)
+    parser.add_argument("--adaptive", action="store_true",
+                        help="Use the calibrated per-segment thresholds (calibration.py)")
+    args = parser.parse_args()
+
+    overrides = {
+        name: value
+        for name, value in (
+            ("BLUR_THRESHOLD", args.blur_threshold),
+            ("DARK_THRESHOLD", args.dark_threshold),
+            ("BRIGHT_THRESHOLD", args.bright_threshold),
+            ("MIN_EDGE_RATIO", args.min_edge_ratio),
+        )
+        if value is not None
+    }
+    if args.adaptive:
+        overrides.update(ADAPTIVE_THRESHOLDS=True, POD_STORAGE_DIR=args.source)
+
+    os.makedirs(args.output, exist_ok=True)
+    if args.fresh:
+        for name in os.listdir(args.output):
+            if name.startswith("part-") or name == CHECKPOINT_FILE:
+                os.remove(os.path.join(args.output, name))
+    done = load_checkpoint(args.output)
+    if done:
+        print(f"Resuming: {len(done)} image(s) already scored")
+
+    pending = (item for item in iter_pod_images(args.source, args.mode) if item[1] not in done)
+    writer = PartWriter(args.output, args.batch_size)
+    start = time.perf_counter()
+    failed = 0
+
+    with multiprocessing.Pool(args.workers, initializer=_init_worker, initargs=(overrides,)) as pool:
+        try:
+            for row in pool.imap_unordered(score_one, pending, chunksize=8):
+                failed += row.get("passed") is False
+                writer.add(row)
+                scored = writer.written + len(writer.rows)
+                if scored % 500 == 0:
+                    rate = scored / (time.perf_counter() - start) * 60
+                    print(f"  {scored} scored ({rate:,.0f}/min)")
+        finally:
+            writer.flush()
+
+    elapsed = time.perf_counter() - start
+    rate = writer.written / elapsed * 60 if elapsed else 0.0
+    print(f"Scored {writer.written} image(s) in {elapsed:.1f}s ({rate:,.0f}/min), {failed} failing")
+    print(f"Parquet parts in {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,469 @@
+"""
+Resumable Chunked Uploads
+=========================
+tus-style upload endpoint served alongside the app so a driver on a weak
+cellular link resumes an interrupted photo upload instead of starting over.
+
+The Streamlit session reserves an upload id and embeds a small JS client
+(`client_html`) bound to it. The client sends the photo in chunks; each PATCH
+carries its byte offset and a SHA-256 checksum. A chunk is written only once
+it arrived whole and its checksum matched, so after a disconnect the client
+asks for the current offset (HEAD) and continues from there. Partial uploads
+live on disk under `<storage>/_resumable/`, so they also survive an app
+restart. Once complete, the session reads the assembled file and hands it to
+the same quality check and storage path as a regular upload.
+
+Protocol (subset of tus 1.0 core + checksum + termination):
+    POST   /uploads/<id>   Upload-Length: n     declare size (resumes if unchanged)
+    HEAD   /uploads/<id>                        -> Upload-Offset, Upload-Length
+    PATCH  /uploads/<id>   Upload-Offset: o     body = chunk
+                           Upload-Checksum: sha256 <base64>   (required)
+                           -> 204 + new Upload-Offset | 400 no checksum | 409 offset mismatch
+                              | 460 checksum mismatch
+    DELETE /uploads/<id>                        restart (driver picked another photo)
+
+Usage:
+    # started by app.py when POD_RESUMABLE_PORT is set
+    store = resumable.get_store("pod_uploads")
+    upload_id = store.reserve(shipment_key)
+    components.html(resumable.client_html(public_url, upload_id, labels, port), height=150)
+    path = store.complete_path(upload_id)
+"""
+
+import os
+import re
+import json
+import time
+import base64
+import hashlib
+import logging
+import secrets
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import metrics
+import admission
+
+logger = logging.getLogger("pod.resumable")
+
+MAX_UPLOAD_BYTES = admission.MAX_UPLOAD_BYTES
+MAX_CHUNK_BYTES = 4 * 1024 * 1024
+CHUNK_BYTES = 256 * 1024  # client chunk size; small enough to finish between signal drops
+UPLOAD_TTL_SECONDS = 24 * 3600
+TUS_VERSION = "1.0.0"
+
+_ID_PATTERN = re.compile(r"^/uploads/([A-Za-z0-9_-]{16,64})$")
+
+
+class UploadError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class UploadStore:
+    """Reserved, partial and completed uploads on disk (`<id>.json` + `<id>.part`)."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self._locks: dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+        self._last_sweep = 0.0
+
+    def _paths(self, upload_id: str) -> tuple[str, str]:
+        base = os.path.join(self.root, upload_id)
+        return base + ".json", base + ".part"
+
+    def _lock(self, upload_id: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(upload_id, threading.Lock())
+
+    def _load(self, upload_id: str) -> dict:
+        info_path, _ = self._paths(upload_id)
+        try:
+            with open(info_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            raise UploadError(404, "unknown upload") from None
+
+    def _save(self, upload_id: str, info: dict):
+        info_path, _ = self._paths(upload_id)
+        tmp_path = info_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(info, f)
+        os.replace(tmp_path, info_path)
+
+    def _offset(self, upload_id: str) -> int:
+        try:
+            return os.path.getsize(self._paths(upload_id)[1])
+        except OSError:
+            return 0
+
+    # ── session side ──
+    def reserve(self, shipment_key: str) -> str:
+        os.makedirs(self.root, exist_ok=True)
+        if time.time() - self._last_sweep > 3600:
+            self.sweep()
+        upload_id = secrets.token_urlsafe(18)
+        self._save(upload_id, {"shipment_key": shipment_key, "length": None, "created": time.time()})
+        return upload_id
+
+    def status(self, upload_id: str) -> dict | None:
+        try:
+            info = self._load(upload_id)
+        except UploadError:
+            return None
+        offset = self._offset(upload_id)
+        return {**info, "offset": offset, "complete": info["length"] is not None and offset == info["length"]}
+
+    def complete_path(self, upload_id: str) -> str | None:
+        status = self.status(upload_id)
+        return self._paths(upload_id)[1] if status and status["complete"] else None
+
+    def discard(self, upload_id: str):
+        for path in self._paths(upload_id):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        with self._locks_guard:
+            self._locks.pop(upload_id, None)
+
+    def sweep(self, max_age: float = UPLOAD_TTL_SECONDS):
+        """Delete uploads abandoned for longer than max_age."""
+        self._last_sweep = time.time()
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return
+        for name in names:
+            if name.endswith(".json"):
+                path = os.path.join(self.root, name)
+                try:
+                    expired = time.time() - os.path.getmtime(path) > max_age
+                except OSError:
+                    continue
+                if expired:
+                    self.discard(name[: -len(".json")])
+
+    # ── protocol side ──
+    def create(self, upload_id: str, length: int) -> int:
+        if not 0 < length <= MAX_UPLOAD_BYTES:
+            raise UploadError(413, "upload too large")
+        with self._lock(upload_id):
+            info = self._load(upload_id)
+            if info["length"] != length:
+                # New or different photo: start from zero
+                info["length"] = length
+                self._save(upload_id, info)
+                open(self._paths(upload_id)[1], "wb").close()
+            return self._offset(upload_id)
+
+    def append(self, upload_id: str, offset: int, chunk: bytes, checksum: str | None) -> int:
+        if not checksum:
+            raise UploadError(400, "missing Upload-Checksum")
+        algorithm, _, expected = checksum.partition(" ")
+        if algorithm.lower() != "sha256":
+            raise UploadError(400, "unsupported checksum algorithm")
+        if base64.b64encode(hashlib.sha256(chunk).digest()).decode("ascii") != expected.strip():
+            metrics.inc("pod_resumable_checksum_failures_total")
+            raise UploadError(460, "checksum mismatch")
+        with self._lock(upload_id):
+            info = self._load(upload_id)
+            if info["length"] is None:
+                raise UploadError(409, "upload length not declared")
+            current = self._offset(upload_id)
+            if offset != current:
+                raise UploadError(409, f"offset mismatch, expected {current}")
+            if current + len(chunk) > info["length"]:
+                raise UploadError(413, "chunk exceeds declared length")
+            with open(self._paths(upload_id)[1], "r+b") as f:
+                f.seek(current)
+                f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            new_offset = current + len(chunk)
+        metrics.inc("pod_resumable_bytes_total", len(chunk))
+        if new_offset == info["length"]:
+            metrics.inc("pod_resumable_completed_total")
+        return new_offset
+
+    def reset(self, upload_id: str):
+        with self._lock(upload_id):
+            info = self._load(upload_id)
+            info["length"] = None
+            self._save(upload_id, info)
+            try:
+                os.remove(self._paths(upload_id)[1])
+            except OSError:
+                pass
+
+
+_stores: dict[str, UploadStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(storage_dir: str) -> UploadStore:
+    """Process-wide store per storage directory (app.py re-executes on every rerun)."""
+    root = os.path.abspath(os.path.join(storage_dir, "_resumable"))
+    with _stores_lock:
+        store = _stores.get(root)
+        if store is None:
+            store = _stores[root] = UploadStore(root)
+        return store
+
+
+# ─────────────────────────────────────────────
+# HTTP ENDPOINT
+# ─────────────────────────────────────────────
+class _UploadHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    timeout = 30  # release the thread when a weak link stalls mid-chunk
+    store: UploadStore = None
+
+    def _reply(self, status: int, headers: dict | None = None, body: bytes = b""):
+        self.send_response(status)
+        self.send_header("Tus-Resumable", TUS_VERSION)
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Access-Control-Expose-Headers", "Upload-Offset, Upload-Length, Tus-Resumable")
+        self.send_header("Cache-Control", "no-store")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body and self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _upload_id(self) -> str:
+        match = _ID_PATTERN.match(self.path.split("?", 1)[0])
+        if not match:
+            raise UploadError(404, "not found")
+        return match.group(1)
+
+    def _int_header(self, name: str) -> int:
+        value = self.headers.get(name, "")
+        # Digits only: a negative Content-Length would make rfile.read() unbounded
+        if not (value.isascii() and value.isdigit()):
+            raise UploadError(400, f"missing or invalid {name}")
+        return int(value)
+
+    def _handle(self, action):
+        try:
+            action()
+        except UploadError as e:
+            self.close_connection = True
+            self._reply(e.status, body=str(e).encode())
+        except (ConnectionError, TimeoutError):
+            # Client dropped mid-chunk; nothing was written, it resumes from HEAD
+            self.close_connection = True
+            metrics.inc("pod_resumable_dropped_chunks_total")
+        except OSError as e:
+            logger.warning("resumable upload I/O error: %s", e)
+            self.close_connection = True
+            self._reply(500, body=b"storage error")
+
+    def do_OPTIONS(self):
+        self._reply(204, {
+            "Access-Control-Allow-Methods": "POST, HEAD, PATCH, DELETE, OPTIONS",
+            "Access-Control-Allow-Headers": "Upload-Length, Upload-Offset, Upload-Checksum, Tus-Resumable, Content-Type",
+            "Access-Control-Max-Age": "86400",
+            "Tus-Version": TUS_VERSION,
+            "Tus-Extension": "checksum,termination",
+            "Tus-Checksum-Algorithm": "sha256",
+            "Tus-Max-Size": str(MAX_UPLOAD_BYTES),
+        })
+
+    def do_POST(self):
+        def action():
+            offset = self.store.create(self._upload_id(), self._int_header("Upload-Length"))
+            self._reply(201, {"Upload-Offset": str(offset)})
+        self._handle(action)
+
+    def do_HEAD(self):
+        def action():
+            status = self.store.status(self._upload_id())
+            if status is None:
+                raise UploadError(404, "unknown upload")
+            headers = {"Upload-Offset": str(status["offset"])}
+            if status["length"] is not None:
+                headers["Upload-Length"] = str(status["length"])
+            self._reply(200, headers)
+        self._handle(action)
+
+    def do_PATCH(self):
+        def action():
+            upload_id = self._upload_id()
+            offset = self._int_header("Upload-Offset")
+            size = self._int_header("Content-Length")
+            if size > MAX_CHUNK_BYTES:
+                raise UploadError(413, "chunk too large")
+            chunk = self.rfile.read(size)
+            if len(chunk) != size:
+                raise ConnectionResetError("incomplete chunk")
+            with metrics.timer("pod_resumable_chunk_seconds"):
+                new_offset = self.store.append(upload_id, offset, chunk, self.headers.get("Upload-Checksum"))
+            self._reply(204, {"Upload-Offset": str(new_offset)})
+        self._handle(action)
+
+    def do_DELETE(self):
+        def action():
+            self.store.reset(self._upload_id())
+            self._reply(204)
+        self._handle(action)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_servers: dict[int, ThreadingHTTPServer] = {}
+_servers_lock = threading.Lock()
+
+
+def start_server(port: int, storage_dir: str, addr: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Serve the upload endpoint from a daemon thread. Idempotent per port."""
+    with _servers_lock:
+        server = _servers.get(port)
+        if server is None:
+            handler = type("UploadHandler", (_UploadHandler,), {"store": get_store(storage_dir)})
+            server = _servers[port] = ThreadingHTTPServer((addr, port), handler)
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, name="pod-resumable", daemon=True).start()
+        return server
+
+
+# ─────────────────────────────────────────────
+# BROWSER CLIENT
+# ─────────────────────────────────────────────
+_CLIENT_TEMPLATE = """
+<style>
+  body { margin:0; font-family: sans-serif; }
+  label.pick { display:block; text-align:center; padding:0.8rem; border-radius:12px;
+               background:#0057FF; color:#fff; font-weight:600; cursor:pointer; }
+  #bar { height:8px; background:#E5E7EB; border-radius:4px; margin-top:0.6rem; overflow:hidden; }
+  #fill { height:100%; width:0; background:#10B981; transition:width 0.2s; }
+  #status { text-align:center; font-size:0.85rem; color:#6B7280; margin-top:0.4rem; }
+</style>
+<label class="pick">📷 __PICK__
+  <input id="file" type="file" accept="image/*" capture="environment" hidden>
+</label>
+<div id="bar"><div id="fill"></div></div>
+<div id="status"></div>
+<script>
+const CHUNK = __CHUNK__, L = __LABELS__;
+// Without a configured endpoint, use the page's own scheme and host on the upload port
+function pageOrigin() {
+  try { return window.parent.location.origin; } catch (e) {}
+  return document.referrer ? new URL(document.referrer).origin : window.location.origin;
+}
+const BASE = __ENDPOINT__ || (() => {
+  const page = new URL(pageOrigin());
+  return page.protocol + "//" + page.hostname + ":" + __PORT__;
+})();
+const URL_ = BASE.replace(/\/+$/, "") + "/uploads/" + __ID__;
+const statusEl = document.getElementById("status"), fill = document.getElementById("fill");
+const sleep = (ms) => new Promise((r) => setTimeout(r, ms));
+let run = 0;
+
+// Pure-JS SHA-256 for insecure (plain http) origins, where crypto.subtle is unavailable
+function sha256Fallback(buf) {
+  const K = [], H = [];
+  for (let n = 2, found = 0; found < 64; n++) {
+    let prime = true;
+    for (let d = 2; d * d <= n; d++) if (n % d === 0) { prime = false; break; }
+    if (!prime) continue;
+    if (found < 8) H[found] = (Math.pow(n, 1 / 2) % 1) * 4294967296 | 0;
+    K[found++] = (Math.pow(n, 1 / 3) % 1) * 4294967296 | 0;
+  }
+  const bytes = new Uint8Array(buf), bitLen = bytes.length * 8;
+  const padded = new Uint8Array(((bytes.length + 72) >> 6) << 6);
+  padded.set(bytes);
+  padded[bytes.length] = 0x80;
+  const view = new DataView(padded.buffer);
+  view.setUint32(padded.length - 8, Math.floor(bitLen / 4294967296));
+  view.setUint32(padded.length - 4, bitLen >>> 0);
+  const w = new Int32Array(64), rotr = (x, n) => (x >>> n) | (x << (32 - n));
+  for (let off = 0; off < padded.length; off += 64) {
+    for (let i = 0; i < 16; i++) w[i] = view.getInt32(off + 4 * i);
+    for (let i = 16; i < 64; i++) {
+      const s0 = rotr(w[i - 15], 7) ^ rotr(w[i - 15], 18) ^ (w[i - 15] >>> 3);
+      const s1 = rotr(w[i - 2], 17) ^ rotr(w[i - 2], 19) ^ (w[i - 2] >>> 10);
+      w[i] = (w[i - 16] + s0 + w[i - 7] + s1) | 0;
+    }
+    let [a, b, c, d, e, f, g, h] = H;
+    for (let i = 0; i < 64; i++) {
+      const t1 = (h + (rotr(e, 6) ^ rotr(e, 11) ^ rotr(e, 25)) + ((e & f) ^ (~e & g)) + K[i] + w[i]) | 0;
+      const t2 = ((rotr(a, 2) ^ rotr(a, 13) ^ rotr(a, 22)) + ((a & b) ^ (a & c) ^ (b & c))) | 0;
+      h = g; g = f; f = e; e = (d + t1) | 0; d = c; c = b; b = a; a = (t1 + t2) | 0;
+    }
+    [a, b, c, d, e, f, g, h].forEach((v, i) => { H[i] = (H[i] + v) | 0; });
+  }
+  const out = new DataView(new ArrayBuffer(32));
+  H.forEach((v, i) => out.setInt32(4 * i, v));
+  return new Uint8Array(out.buffer);
+}
+async function sha256(buf) {
+  const digest = (window.crypto && crypto.subtle)
+    ? new Uint8Array(await crypto.subtle.digest("SHA-256", buf)) : sha256Fallback(buf);
+  return btoa(String.fromCharCode(...digest));
+}
+async function call(method, headers, body) {
+  const res = await fetch(URL_, { method, body, headers: { "Tus-Resumable": "1.0.0", ...headers } });
+  return res;
+}
+async function offsetWithRetry(method, headers) {
+  for (let delay = 1000; ; delay = Math.min(delay * 2, 15000)) {
+    try {
+      const res = await call(method, headers);
+      if (res.ok) return +res.headers.get("Upload-Offset");
+      if (res.status === 404 || res.status === 413) throw new Error("fatal");
+    } catch (e) { if (e.message === "fatal") throw e; }
+    statusEl.textContent = L.waiting;
+    await sleep(delay);
+  }
+}
+async function upload(file, myRun) {
+  let offset = await offsetWithRetry("POST", { "Upload-Length": String(file.size) });
+  let delay = 1000;
+  while (offset < file.size && myRun === run) {
+    fill.style.width = (100 * offset / file.size).toFixed(1) + "%";
+    statusEl.textContent = L.uploading + " " + Math.round(100 * offset / file.size) + "%";
+    const chunk = await file.slice(offset, offset + CHUNK).arrayBuffer();
+    const headers = { "Upload-Offset": String(offset), "Content-Type": "application/offset+octet-stream" };
+    headers["Upload-Checksum"] = "sha256 " + await sha256(chunk);
+    let res = null;
+    try { res = await call("PATCH", headers, chunk); } catch (e) {}
+    if (res && res.ok) { offset = +res.headers.get("Upload-Offset"); delay = 1000; continue; }
+    // Dropped connection, offset conflict or corrupted chunk: resync from the server
+    statusEl.textContent = L.waiting;
+    await sleep(delay);
+    delay = Math.min(delay * 2, 15000);
+    offset = await offsetWithRetry("HEAD", {});
+  }
+  if (myRun !== run) return;
+  fill.style.width = "100%";
+  statusEl.textContent = L.done;
+}
+document.getElementById("file").addEventListener("change", async (ev) => {
+  const file = ev.target.files[0];
+  if (!file) return;
+  const myRun = ++run;
+  try { await call("DELETE", {}); } catch (e) {}
+  try { await upload(file, myRun); } catch (e) { statusEl.textContent = L.failed; }
+});
+</script>
+"""
+
+
+def client_html(endpoint: str | None, upload_id: str, labels: dict, port: int = 0) -> str:
+    """Self-contained upload widget for `components.html`, bound to one reserved upload.
+
+    With no endpoint the widget targets `port` on the host the page was served from.
+    """
+    return (
+        _CLIENT_TEMPLATE.replace("__ENDPOINT__", json.dumps(endpoint or ""))
+        .replace("__PORT__", str(int(port)))
+        .replace("__ID__", json.dumps(upload_id))
+        .replace("__CHUNK__", str(CHUNK_BYTES))
+        .replace("__LABELS__", json.dumps(labels, ensure_ascii=False))
+        .replace("__PICK__", labels.get("pick", ""))
+    )
@@ -17,12 +17,17 @@ import pandas as pd
 from io import BytesIO
 from urllib.parse import quote
 import argparse
+import os
 import sys
 
+import redash
+
 REDASH_API_URL = (
     "https://redash.trella.co/api/queries/4922/results.csv"
     "?api_key=TX9ND3NoDL0xHNFcbFKvWwPMQAnouCXcywp1tAdz"
 )
+# Parameterized, paged copy of the query (see redash.py); filters by status server-side
+REDASH_DELTA_URL = os.environ.get("POD_REDASH_DELTA_URL")
 
 # ── Update this to your deployed Streamlit app URL ──
 APP_BASE_URL = "https://trella-driver.streamlit.app"
@@ -56,6 +61,9 @@ MESSAGES = {
 
 def fetch_dropoff_shipments() -> pd.DataFrame:
     """Fetch all shipments currently at drop-off status."""
+    if REDASH_DELTA_URL:
+        rows, _ = redash.fetch(REDASH_DELTA_URL, redash.DROPOFF_STATUS)
+        return pd.DataFrame(rows)
     resp = requests.get(REDASH_API_URL, timeout=30)
     resp.raise_for_status()
     df = pd.read_csv(BytesIO(resp.content))
@@ -0,0 +1,583 @@
+"""
+Sharded POD Storage
+===================
+Spreads shipment data over several storage nodes, so that every app node sees
+the same submissions and capacity grows by adding nodes.
+
+Each shipment key is placed on a consistent-hash ring (VNODES virtual points
+per node). Its files go to the first REPLICAS healthy nodes clockwise from
+the key's hash: its preference list. A write succeeds once a majority of
+REPLICAS nodes have it. If an owner is down, the write goes to the next
+healthy node on the ring (hinted handoff). That stand-in records a hint and
+hands the files back once the owner answers again (every HANDOFF_SECONDS).
+Reads ask the owners, plus any stand-in this client wrote to. They go further
+down the ring only while an owner is not answering, so a driver's retry on
+another app node still finds its metadata.json. A miss with healthy owners
+costs REPLICAS requests however many nodes there are. Unreachable nodes are
+skipped for DOWN_SECONDS instead of timing out on every request.
+
+A storage node is a small HTTP server over an ordinary `<storage>/<key>/<name>`
+tree, so `archive.py` and `rescore.py` run on each node as before, and reads
+fall back to the node's archive packs.
+
+Only shipment files are sharded. The event log, the duplicate-photo index
+(`phash.py`) and calibration state are still written to each app node's own
+POD_STORAGE_DIR. Duplicate detection, dashboard coverage and adaptive
+thresholds therefore see only the submissions that went through that app
+node.
+
+Adding or removing a node moves only about 1/N of the keys. `rebalance`
+copies every key to its current owners, and deletes it from nodes that no
+longer own it once all owners have it (archived copies are tombstoned, see
+`ArchiveStore.forget`). It also repairs replicas that missed a write.
+
+Usage:
+    python shards.py serve --port 8701 --storage /data/pods        # one storage node
+    python shards.py cluster --nodes 3 --storage /tmp/pod_shards   # N local nodes for testing
+    POD_SHARD_NODES=http://127.0.0.1:8701,http://127.0.0.1:8702,http://127.0.0.1:8703 streamlit run app.py
+    python shards.py locate <shipment_key>
+    python shards.py rebalance                            # after changing POD_SHARD_NODES
+    python shards.py rebalance --drain http://old:8701    # move a retired node's keys off it
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import bisect
+import shutil
+import hashlib
+import logging
+import argparse
+import threading
+import subprocess
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import metrics
+import archive
+import admission
+
+logger = logging.getLogger("pod.shards")
+
+VNODES = 64
+REPLICAS = 2
+TIMEOUT = (2.0, 15.0)  # connect, read
+DOWN_SECONDS = 10.0
+# How often a node retries handing files it holds for a down owner back to it
+HANDOFF_SECONDS = float(os.environ.get("POD_SHARD_HANDOFF_SECONDS", 5.0))
+MAX_HINTED_KEYS = 10_000  # per client: keys whose last write landed off its owners
+MAX_OBJECT_BYTES = admission.MAX_UPLOAD_BYTES
+TOKEN = os.environ.get("POD_SHARD_TOKEN", "")
+
+_KEY = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_\-]{0,127}$")
+_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.\-]{0,127}$")
+
+
+class ShardError(OSError):
+    """Not enough storage nodes answered."""
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    def __init__(self, nodes: list[str], vnodes: int = VNODES):
+        self.nodes = list(dict.fromkeys(nodes))
+        points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(vnodes))
+        self._hashes = [h for h, _ in points]
+        self._owners = [node for _, node in points]
+
+    def preference(self, key: str) -> list[str]:
+        """Every node, in the order a key's replicas are placed."""
+        start = bisect.bisect(self._hashes, _hash(key))
+        order = []
+        for i in range(len(self._owners)):
+            node = self._owners[(start + i) % len(self._owners)]
+            if node not in order:
+                order.append(node)
+                if len(order) == len(self.nodes):
+                    break
+        return order
+
+
+# ─────────────────────────────────────────────
+# STORAGE NODE
+# ─────────────────────────────────────────────
+class NodeStore:
+    """One node's local shipment tree (plus its archive packs)."""
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        # key -> owners this node holds files for; persisted, only non-empty during outages
+        self._hints_path = os.path.join(root, "_hints.json")
+        self._hints_lock = threading.Lock()
+        self._hint_versions: dict[str, int] = {}
+        try:
+            with open(self._hints_path, "r", encoding="utf-8") as f:
+                self.hints: dict[str, list[str]] = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            self.hints = {}
+
+    def _save_hints(self):
+        with open(self._hints_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.hints, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self._hints_path + ".tmp", self._hints_path)
+
+    def add_hint(self, key: str, owners: list[str]):
+        """Record that files of key were written here in place of its owners."""
+        with self._hints_lock:
+            self._hint_versions[key] = self._hint_versions.get(key, 0) + 1
+            if set(owners) <= set(self.hints.get(key, ())):
+                return
+            self.hints[key] = sorted(set(self.hints.get(key, ())) | set(owners))
+            self._save_hints()
+
+    def put(self, key: str, name: str, data: bytes):
+        shipment_dir = os.path.join(self.root, key)
+        os.makedirs(shipment_dir, exist_ok=True)
+        path = os.path.join(shipment_dir, name)
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+
+    def get(self, key: str, name: str) -> bytes | None:
+        return archive.read_file(os.path.join(self.root, key, name))
+
+    def names(self, key: str) -> list[str]:
+        try:
+            names = {n for n in os.listdir(os.path.join(self.root, key)) if not n.endswith(".tmp")}
+        except FileNotFoundError:
+            names = set()
+        return sorted(names | set(archive.get_store(self.root).list_files(key)))
+
+    def deliver_hints(self, session) -> int:
+        """Copy handed-off keys to owners that answer again, then drop them here. Returns keys done."""
+        with self._hints_lock:
+            pending = [(key, list(owners), self._hint_versions.get(key, 0)) for key, owners in self.hints.items()]
+        done = 0
+        for key, owners, version in pending:
+            names = self.names(key)
+            delivered = set()
+            for owner in owners:
+                try:
+                    resp = session.get(f"{owner}/objects/{key}/", timeout=TIMEOUT)
+                    if resp.status_code not in (200, 404):
+                        continue
+                    have = set(resp.json()) if resp.status_code == 200 else set()
+                    ok = True
+                    for name in sorted(set(names) - have):
+                        data = self.get(key, name)
+                        if data is None:
+                            ok = False
+                            continue
+                        put = session.put(f"{owner}/objects/{key}/{name}", data=data, timeout=TIMEOUT)
+                        ok = ok and put.status_code == 204
+                except (OSError, ValueError) as e:  # requests' errors are OSErrors; ValueError from .json()
+                    logger.info("handoff of %s to %s pending: %s", key, owner, e)
+                    continue
+                if ok:
+                    delivered.add(owner)
+            with self._hints_lock:
+                if self._hint_versions.get(key, 0) != version:
+                    continue  # written again meanwhile; the next round delivers the new files too
+                remaining = [o for o in self.hints.get(key, ()) if o not in delivered]
+                if remaining:
+                    self.hints[key] = remaining
+                else:
+                    self.hints.pop(key, None)
+                    self._hint_versions.pop(key, None)
+                    self.delete(key)
+                    metrics.inc("pod_shard_handoffs_delivered_total")
+                    done += 1
+                self._save_hints()
+        return done
+
+    def delete(self, key: str):
+        shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+        # Archived copies stay in their append-only packs; hide them from keys, names and get
+        archive.get_store(self.root).forget(key)
+
+    def keys(self) -> list[str]:
+        with os.scandir(self.root) as entries:
+            keys = {e.name for e in entries if e.is_dir() and not e.name.startswith("_")}
+        keys.update(key for key, _ in archive.get_store(self.root).iter_shipments())
+        return sorted(keys)
+
+
+class _NodeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    timeout = 30
+    store: NodeStore = None
+
+    def _reply(self, status: int, body: bytes = b"", content_type: str = "application/octet-stream"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def _route(self) -> tuple[str, str] | None:
+        """(key, name) for /objects/<key>/<name>; name is '' for /objects/<key>/."""
+        parts = self.path.split("?", 1)[0].split("/")
+        if len(parts) != 4 or parts[1] != "objects" or not _KEY.match(parts[2]):
+            return None
+        if parts[3] and not _NAME.match(parts[3]):
+            return None
+        return parts[2], parts[3]
+
+    def _handle(self, action):
+        if TOKEN and self.headers.get("Authorization") != f"Bearer {TOKEN}":
+            self.close_connection = True
+            self._reply(401)
+            return
+        try:
+            action()
+        except (ConnectionError, TimeoutError):
+            self.close_connection = True
+        except OSError as e:
+            logger.warning("storage node I/O error: %s", e)
+            self.close_connection = True
+            self._reply(500)
+
+    def do_GET(self):
+        def action():
+            if self.path == "/healthz":
+                self._reply(200, b'{"ok": true}', "application/json")
+                return
+            if self.path == "/keys":
+                self._reply(200, "\n".join(self.store.keys()).encode(), "text/plain")
+                return
+            route = self._route()
+            if route is None:
+                self._reply(404)
+            elif not route[1]:
+                names = self.store.names(route[0])
+                self._reply(200 if names else 404, json.dumps(names).encode(), "application/json")
+            else:
+                data = self.store.get(*route)
+                if data is None:
+                    self._reply(404)
+                else:
+                    self._reply(200, data)
+        self._handle(action)
+
+    def do_PUT(self):
+        def action():
+            route = self._route()
+            size = int(self.headers.get("Content-Length", -1))
+            if route is None or not route[1]:
+                self._reply(404)
+            elif not 0 <= size <= MAX_OBJECT_BYTES:
+                self.close_connection = True
+                self._reply(413)
+            else:
+                data = self.rfile.read(size)
+                if len(data) != size:
+                    raise ConnectionResetError("incomplete body")
+                with metrics.timer("pod_shard_node_put_seconds"):
+                    self.store.put(route[0], route[1], data)
+                    owners = [o for o in self.headers.get("X-Handoff-For", "").split(",")
+                              if o.startswith(("http://", "https://"))]
+                    if owners:
+                        self.store.add_hint(route[0], owners)
+                self._reply(204)
+        self._handle(action)
+
+    def do_DELETE(self):
+        def action():
+            route = self._route()
+            if route is None or route[1]:
+                self._reply(404)
+            else:
+                self.store.delete(route[0])
+                self._reply(204)
+        self._handle(action)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _deliver_handoffs(store: NodeStore):
+    requests = metrics.lazy_import("requests")
+    session = requests.Session()
+    if TOKEN:
+        session.headers["Authorization"] = f"Bearer {TOKEN}"
+    while True:
+        time.sleep(HANDOFF_SECONDS)
+        if store.hints:
+            try:
+                store.deliver_hints(session)
+            except OSError as e:
+                logger.warning("handoff delivery failed: %s", e)
+
+
+def serve(port: int, storage_dir: str, addr: str = "0.0.0.0") -> ThreadingHTTPServer:
+    store = NodeStore(storage_dir)
+    handler = type("NodeHandler", (_NodeHandler,), {"store": store})
+    server = ThreadingHTTPServer((addr, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=_deliver_handoffs, args=(store,), name="pod-shard-handoff", daemon=True).start()
+    return server
+
+
+# ─────────────────────────────────────────────
+# CLIENT
+# ─────────────────────────────────────────────
+class ShardClient:
+    """Routes each shipment key's reads and writes to its nodes on the ring."""
+
+    def __init__(self, nodes: list[str], replicas: int = REPLICAS, vnodes: int = VNODES):
+        self.ring = HashRing([n.rstrip("/") for n in nodes], vnodes)
+        self.replicas = min(replicas, len(self.ring.nodes))
+        self.write_quorum = self.replicas // 2 + 1
+        self._down_until: dict[str, float] = {}
+        self._hints: OrderedDict[str, set[str]] = OrderedDict()  # key -> non-owners written
+        self._hints_lock = threading.Lock()
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=max(4, self.replicas * 4), thread_name_prefix="pod-shards")
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            requests = metrics.lazy_import("requests")
+            session = self._local.session = requests.Session()
+            if TOKEN:
+                session.headers["Authorization"] = f"Bearer {TOKEN}"
+        return session
+
+    def _call(self, node: str, method: str, path: str, **kwargs):
+        """The response, or None if the node is unreachable (it is then skipped for DOWN_SECONDS)."""
+        requests = metrics.lazy_import("requests")
+        try:
+            with metrics.timer("pod_shard_request_seconds", method=method):
+                resp = self._session().request(method, node + path, timeout=TIMEOUT, **kwargs)
+        except requests.RequestException as e:
+            logger.warning("storage node %s unreachable: %s", node, e)
+            metrics.inc("pod_shard_node_errors_total", node=node)
+            self._down_until[node] = time.monotonic() + DOWN_SECONDS
+            return None
+        if resp.status_code >= 500:
+            metrics.inc("pod_shard_node_errors_total", node=node)
+            return None
+        return resp
+
+    def targets(self, key: str) -> list[str]:
+        """The key's preference list with nodes that recently failed moved to the back."""
+        now = time.monotonic()
+        preference = self.ring.preference(key)
+        healthy = [n for n in preference if self._down_until.get(n, 0) <= now]
+        return healthy + [n for n in preference if n not in healthy]
+
+    def owners(self, key: str) -> list[str]:
+        return self.ring.preference(key)[:self.replicas]
+
+    def _put_one(self, node: str, key: str, name: str, data: bytes) -> bool:
+        owners = self.owners(key)
+        # A stand-in node keeps a hint and hands the files back to the owners later
+        headers = {"X-Handoff-For": ",".join(owners)} if node not in owners else None
+        resp = self._call(node, "PUT", f"/objects/{key}/{name}", data=data, headers=headers)
+        return resp is not None and resp.status_code == 204
+
+    def _hint(self, key: str, nodes: list[str]):
+        with self._hints_lock:
+            self._hints.setdefault(key, set()).update(nodes)
+            self._hints.move_to_end(key)
+            while len(self._hints) > MAX_HINTED_KEYS:
+                self._hints.popitem(last=False)
+
+    def put(self, key: str, name: str, data: bytes) -> list[str]:
+        """Write to REPLICAS nodes (handing off past failed owners). Returns the nodes written."""
+        candidates = self.targets(key)
+        first, spare = candidates[:self.replicas], candidates[self.replicas:]
+        results = list(self._executor.map(lambda n: self._put_one(n, key, name, data), first))
+        written = [n for n, ok in zip(first, results) if ok]
+        while len(written) < self.replicas and spare:
+            node = spare.pop(0)
+            if self._put_one(node, key, name, data):
+                written.append(node)
+                metrics.inc("pod_shard_handoffs_total")
+        if len(written) < self.write_quorum:
+            raise ShardError(f"{key}/{name}: written to {len(written)} of {self.write_quorum} required nodes")
+        stand_ins = [n for n in written if n not in self.owners(key)]
+        if stand_ins:
+            self._hint(key, stand_ins)
+        return written
+
+    def _read(self, key: str, path: str):
+        """Ask the owners and hinted stand-ins; go further down the ring only while an owner is out.
+
+        Stand-ins hand their files back to the owners once those answer again, so
+        when every owner answers, a miss costs REPLICAS requests, not one per node.
+        """
+        owners = self.owners(key)
+        with self._hints_lock:
+            hinted = [n for n in self._hints.get(key, ()) if n not in owners]
+        first = owners + hinted
+        answered = set()
+        for batch in (first, [n for n in self.ring.preference(key) if n not in first]):
+            if batch is not first and all(o in answered for o in owners):
+                break
+            now = time.monotonic()
+            for node in sorted(batch, key=lambda n: self._down_until.get(n, 0) > now):  # healthy first
+                resp = self._call(node, "GET", path)
+                if resp is None:
+                    continue
+                answered.add(node)
+                if resp.status_code == 200:
+                    return resp
+        if not answered:
+            raise ShardError(f"no storage node answered for {key}")
+        return None
+
+    def get(self, key: str, name: str) -> bytes | None:
+        resp = self._read(key, f"/objects/{key}/{name}")
+        return resp.content if resp is not None else None
+
+    def names(self, key: str) -> list[str]:
+        resp = self._read(key, f"/objects/{key}/")
+        return resp.json() if resp is not None else []
+
+    # ── rebalance ──
+    def _node_names(self, node: str, key: str) -> list[str] | None:
+        resp = self._call(node, "GET", f"/objects/{key}/")
+        if resp is None:
+            return None
+        return resp.json() if resp.status_code == 200 else []
+
+    def _move(self, source: str, key: str) -> tuple[int, bool]:
+        """Copy one key from source to its owners; drop it from source if not an owner."""
+        names = self._node_names(source, key) or []
+        owners = self.owners(key)
+        copied, complete = 0, True
+        for owner in owners:
+            if owner == source:
+                continue
+            have = self._node_names(owner, key)
+            if have is None:
+                complete = False
+                continue
+            for name in sorted(set(names) - set(have)):
+                resp = self._call(source, "GET", f"/objects/{key}/{name}")
+                if resp is None or resp.status_code != 200 or not self._put_one(owner, key, name, resp.content):
+                    complete = False
+                    continue
+                copied += 1
+        removed = source not in owners and complete
+        if removed:
+            self._call(source, "DELETE", f"/objects/{key}/")
+        return copied, removed
+
+    def rebalance(self, drain: list[str] = (), workers: int = 8) -> dict:
+        """Put every key on its current owners and remove it elsewhere."""
+        stats = {"keys": 0, "copied": 0, "removed": 0, "unreachable": []}
+        for source in list(self.ring.nodes) + [n.rstrip("/") for n in drain]:
+            resp = self._call(source, "GET", "/keys")
+            if resp is None:
+                stats["unreachable"].append(source)
+                continue
+            keys = [k for k in resp.text.split("\n") if k]
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for copied, removed in pool.map(lambda k: self._move(source, k), keys):
+                    stats["copied"] += copied
+                    stats["removed"] += removed
+            stats["keys"] += len(keys)
+        return stats
+
+
+_clients: dict[tuple, ShardClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(nodes: list[str], replicas: int = REPLICAS) -> ShardClient:
+    """Process-wide client per node list (app.py re-executes on every rerun)."""
+    key = (tuple(nodes), replicas)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = ShardClient(nodes, replicas)
+        return client
+
+
+# ─────────────────────────────────────────────
+# CLI
+# ─────────────────────────────────────────────
+def _env_nodes() -> list[str]:
+    return [n.strip() for n in os.environ.get("POD_SHARD_NODES", "").split(",") if n.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sharded POD storage nodes")
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve_parser = sub.add_parser("serve", help="run one storage node")
+    serve_parser.add_argument("--port", type=int, default=8701)
+    serve_parser.add_argument("--addr", default="0.0.0.0")
+    serve_parser.add_argument("--storage", default=os.environ.get("POD_STORAGE_DIR", "pod_uploads"))
+    cluster = sub.add_parser("cluster", help="run N local storage nodes as separate processes")
+    cluster.add_argument("--nodes", type=int, default=3)
+    cluster.add_argument("--base-port", type=int, default=8701)
+    cluster.add_argument("--storage", default="pod_shards")
+    for name in ("locate", "rebalance"):
+        p = sub.add_parser(name)
+        p.add_argument("--nodes", default=",".join(_env_nodes()), help="comma-separated node URLs")
+        p.add_argument("--replicas", type=int, default=int(os.environ.get("POD_SHARD_REPLICAS", REPLICAS)))
+        if name == "locate":
+            p.add_argument("key")
+        else:
+            p.add_argument("--drain", action="append", default=[], help="retired node to move keys off")
+            p.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+
+    if args.command == "serve":
+        server = serve(args.port, args.storage, args.addr)
+        print(f"Storage node on :{args.port} serving {args.storage}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    elif args.command == "cluster":
+        procs, urls = [], []
+        for i in range(args.nodes):
+            port = args.base_port + i
+            storage = os.path.join(args.storage, f"node{i}")
+            procs.append(subprocess.Popen([sys.executable, __file__, "serve", "--port", str(port),
+                                           "--addr", "127.0.0.1", "--storage", storage]))
+            urls.append(f"http://127.0.0.1:{port}")
+        print(f"POD_SHARD_NODES={','.join(urls)}")
+        try:
+            for proc in procs:
+                proc.wait()
+        except KeyboardInterrupt:
+            for proc in procs:
+                proc.terminate()
+    else:
+        nodes = [n for n in args.nodes.split(",") if n]
+        if not nodes:
+            parser.error("no nodes: pass --nodes or set POD_SHARD_NODES")
+        client = ShardClient(nodes, args.replicas)
+        if args.command == "locate":
+            owners = client.owners(args.key)
+            for node in client.ring.preference(args.key):
+                print(f"{'owner ' if node in owners else 'spare '} {node}")
+        else:
+            start = time.perf_counter()
+            stats = client.rebalance(args.drain, args.workers)
+            print(f"Checked {stats['keys']} key placement(s): copied {stats['copied']} file(s), "
+                  f"removed {stats['removed']} misplaced key(s) in {time.perf_counter() - start:.1f}s")
+            if stats["unreachable"]:
+                print("Unreachable: " + ", ".join(stats["unreachable"]))
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Shipment Snapshot Store
+=======================
+In-memory shipment index that boots from the last snapshot persisted to disk
+and refreshes from Redash in the background.
+
+After a cold start or redeploy the first driver is served from the snapshot
+immediately instead of waiting for a full Redash fetch. Stale entries are
+refreshed in a background thread; a lookup miss still triggers a synchronous
+refresh so newly arrived shipments are found, but at most once every
+MISS_REFRESH_SECONDS, so bad links cannot force a Redash fetch per request.
+Concurrent refreshes are coalesced into one fetch.
+
+With `fetch_changes`, a refresh fetches only the rows changed since the
+last watermark and merges them into the index: changed rows are upserted and
+rows that left drop-off are removed. A full fetch still runs on the first
+refresh and every `full_sync_seconds`, to catch anything a delta missed. The
+watermark is persisted with the snapshot, so a restart goes straight back
+to deltas.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+
+import metrics
+
+logger = logging.getLogger("pod.shipments")
+
+MISS_REFRESH_SECONDS = 30.0  # minimum gap between refreshes triggered by unknown keys
+
+
+class ShipmentStore:
+    def __init__(self, fetch_records, snapshot_path: str, ttl: float = 300.0,
+                 fetch_changes=None, full_sync_seconds: float = 3600.0):
+        self.fetch_records = fetch_records
+        self.fetch_changes = fetch_changes
+        self.snapshot_path = snapshot_path
+        self.ttl = ttl
+        self.full_sync_seconds = full_sync_seconds
+        self.records: dict[str, dict] = {}
+        self.watermark: str | None = None
+        self.full_synced_at = 0.0  # wall clock, persisted with the snapshot
+        self.refreshed_at = 0.0
+        self.source = "empty"
+        self.miss_refresh_seconds = MISS_REFRESH_SECONDS
+        self._miss_refresh_at = float("-inf")  # monotonic; set even when the refresh fails
+        self._refresh_lock = threading.Lock()
+        self._refreshing = False
+
+    # ── snapshot ──
+    def load_snapshot(self) -> bool:
+        try:
+            with metrics.timer("pod_snapshot_load_seconds"):
+                with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                    snapshot = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return False
+        self.records = {r["key"]: r for r in snapshot.get("records", []) if r.get("key")}
+        self.watermark = snapshot.get("watermark")
+        self.full_synced_at = snapshot.get("full_synced_at", 0.0)
+        # Treat the snapshot as already stale so the first lookup kicks off a refresh
+        self.refreshed_at = 0.0
+        self.source = "snapshot"
+        metrics.set_gauge("pod_snapshot_age_seconds", time.time() - snapshot.get("saved_at", 0))
+        return True
+
+    def save_snapshot(self):
+        directory = os.path.dirname(self.snapshot_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "saved_at": time.time(),
+                "watermark": self.watermark,
+                "full_synced_at": self.full_synced_at,
+                "records": list(self.records.values()),
+            }, f, ensure_ascii=False)
+        os.replace(tmp_path, self.snapshot_path)
+
+    # ── refresh ──
+    def _fetch(self) -> dict[str, dict]:
+        if self.fetch_changes is None:
+            return {r["key"]: r for r in self.fetch_records() if r.get("key")}
+        full = self.watermark is None or time.time() - self.full_synced_at > self.full_sync_seconds
+        upserts, removed, watermark = self.fetch_changes(None if full else self.watermark)
+        # Merge into a copy: lookups keep reading the old dict until the swap
+        records = {} if full else dict(self.records)
+        for key in removed:
+            records.pop(key, None)
+        records.update((r["key"], r) for r in upserts if r.get("key"))
+        metrics.inc("pod_shipment_refreshes_total", kind="full" if full else "delta")
+        self.watermark = watermark
+        if full:
+            self.full_synced_at = time.time()
+        return records
+
+    def refresh(self) -> bool:
+        """Fetch from Redash and swap in the new index. Single-flight."""
+        with self._refresh_lock:
+            try:
+                records = self._fetch()
+            except Exception as e:  # noqa: BLE001 - keep serving the last good index
+                logger.warning("shipment refresh failed: %s", e)
+                metrics.inc("pod_shipment_refresh_errors_total")
+                return False
+            self.records = records
+            self.refreshed_at = time.monotonic()
+            self.source = "redash"
+            metrics.set_gauge("pod_shipments_indexed", len(self.records))
+            try:
+                self.save_snapshot()
+            except OSError as e:
+                logger.warning("could not persist shipment snapshot: %s", e)
+            return True
+
+    def refresh_in_background(self):
+        if self._refreshing:
+            return
+
+        def run():
+            try:
+                self.refresh()
+            finally:
+                self._refreshing = False
+
+        self._refreshing = True
+        threading.Thread(target=run, name="pod-shipment-refresh", daemon=True).start()
+
+    @property
+    def stale(self) -> bool:
+        return time.monotonic() - self.refreshed_at > self.ttl
+
+    # ── lookup ──
+    def get(self, shipment_key: str, refresh_on_miss: bool = True) -> dict | None:
+        if self.source == "empty":
+            self.refresh()
+        elif self.stale:
+            self.refresh_in_background()
+        record = self.records.get(shipment_key)
+        if record is None and refresh_on_miss:
+            refreshed_at = self.refreshed_at
+            with self._refresh_lock:
+                # Another session may have refreshed while we waited
+                already_fresh = self.refreshed_at != refreshed_at
+                now = time.monotonic()
+                recent = now - max(self.refreshed_at, self._miss_refresh_at) < self.miss_refresh_seconds
+                if not already_fresh and not recent:
+                    self._miss_refresh_at = now
+            if not already_fresh and not recent:
+                self.refresh()
+            elif recent:
+                metrics.inc("pod_shipment_miss_refreshes_skipped_total")
+            record = self.records.get(shipment_key)
+        return record
+
+
+_stores: dict[str, ShipmentStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(fetch_records, snapshot_path: str, ttl: float = 300.0, boot_from_snapshot: bool = True,
+              fetch_changes=None, full_sync_seconds: float = 3600.0) -> ShipmentStore:
+    """Process-wide store per snapshot path (app.py re-executes on every rerun)."""
+    key = os.path.abspath(snapshot_path)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = ShipmentStore(fetch_records, snapshot_path, ttl, fetch_changes, full_sync_seconds)
+            if boot_from_snapshot and store.load_snapshot():
+                store.refresh_in_background()
+        return store
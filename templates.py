@@ -0,0 +1,263 @@
+"""
+Pre-Rendered HTML/CSS Templates
+===============================
+Static markup for the driver screens, compiled once per language and cached
+for the life of the process.
+
+Streamlit re-executes app.py on every widget interaction, and the app used to
+rebuild every card with f-strings and `t()` lookups each time. Here each
+fragment is compiled once per language (which also fixes its RTL variant):
+translations, the RTL class and the inlined logo are baked in and whitespace
+between tags is stripped. Only shipment-specific fields are interpolated per
+rerun. CSS is minified once, and the logo is inlined as a cached data URI so
+the header costs neither a file stat nor a separate media request.
+
+Template syntax:
+    [[t:key]]   translation, resolved at compile time
+    [[rtl]]     "rtl" for Arabic/Urdu, "" otherwise, resolved at compile time
+    [[logo]]    logo <img> (or text fallback), resolved at compile time
+    {field}     runtime value passed to render()
+"""
+
+import os
+import re
+import base64
+import functools
+
+RTL_LANGUAGES = ("ar", "ur")
+LOGO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "trella.png")
+
+FRAGMENTS = {
+    "header": """
+    <div class="app-header" style="padding:0;">[[logo]]</div>
+    <div class="app-header" style="padding-top: 0;">
+        <div class="app-subtitle">Proof of Delivery</div>
+    </div>
+    """,
+    "driver_card": """
+    <div class="pod-card pod-card-blue [[rtl]]">
+        <div style="display:flex; flex-direction:column; align-items:center; gap:0.5rem; margin-bottom:0.75rem; text-align:center;">
+            <div style="width:56px;height:56px;border-radius:50%;background:var(--trella-light);
+                display:flex;align-items:center;justify-content:center;font-size:1.6rem;flex-shrink:0;">🚛</div>
+            <div>
+                <div style="font-size:1.15rem;font-weight:700;color:#1F2937; margin-bottom: 2px;">{carrier}</div>
+                <div style="font-size:0.9rem;color:var(--trella-gray);">{mobile} &nbsp;·&nbsp; {plate}</div>
+            </div>
+        </div>
+        <div style="text-align: center;">
+            <span class="status-badge status-dropoff">● [[t:at_dropoff]]</span>
+        </div>
+    </div>
+    """,
+    "route_card": """
+    <div class="route-card [[rtl]]">
+        <div class="route-point">
+            <div class="route-dot origin"></div>
+            <div>
+                <div class="route-city">{pickup_city}</div>
+                <div class="route-name">{pickup_name}</div>
+            </div>
+        </div>
+        <div class="route-line"></div>
+        <div class="route-point">
+            <div class="route-dot dest"></div>
+            <div>
+                <div class="route-city">{dest_city}</div>
+                <div class="route-name">{dest_name}</div>
+            </div>
+        </div>
+    </div>
+    """,
+    "details_card": """
+    <div class="pod-card [[rtl]]">
+        <div class="detail-row">
+            <span class="detail-label">[[t:shipper]]</span>
+            <span class="detail-value">{entity}</span>
+        </div>
+        <div class="detail-row">
+            <span class="detail-label">[[t:commodity]]</span>
+            <span class="detail-value">{commodity}</span>
+        </div>
+        <div class="detail-row">
+            <span class="detail-label">[[t:weight]]</span>
+            <span class="detail-value">{weight} t</span>
+        </div>
+        <div class="detail-row">
+            <span class="detail-label">[[t:distance]]</span>
+            <span class="detail-value">{distance}</span>
+        </div>
+        <div class="detail-row">
+            <span class="detail-label">[[t:shipment_ref]]</span>
+            <span class="detail-value" style="font-size:0.8rem;font-family:monospace;">{key}</span>
+        </div>
+    </div>
+    """,
+    "upload_intro": """
+    <h3 style="margin:0 0 0.25rem; text-align: center;">[[t:upload_title]]</h3>
+    <div class="tips-grid">
+        <span class="tip-pill">☀️ [[t:tip_surface]]</span>
+        <span class="tip-pill">📐 [[t:tip_steady]]</span>
+        <span class="tip-pill">📄 [[t:tip_edges]]</span>
+        <span class="tip-pill">🚫 [[t:tip_glare]]</span>
+        <span class="tip-pill">🔍 [[t:tip_lens]]</span>
+        <span class="tip-pill">🌤️ [[t:tip_light]]</span>
+    </div>
+    """,
+    "upload_hint": """
+    <p style="text-align:center; font-size:0.82rem; color:var(--trella-gray); margin-top:0.25rem;">
+        📷 [[t:upload_hint]]
+    </p>
+    """,
+    "quality_pass": """
+    <div class="quality-pass">
+        <span style="font-size:1.2rem;">✅</span> [[t:quality_passed]]
+    </div>
+    """,
+    "quality_fail": """
+    <div class="quality-fail [[rtl]]">
+        <div style="font-weight:700; margin-bottom:0.5rem;">❌ [[t:quality_failed]]</div>
+        {reasons_html}
+    </div>
+    """,
+    "fallback_banner": """
+    <div class="quality-fail [[rtl]]" style="border-color: var(--trella-orange); background: #FFFBEB;">
+        <div style="font-weight:700; font-size:1.05rem; margin-bottom:0.35rem; color: #92400E;">
+            📸 [[t:fallback_title]]
+        </div>
+        <div style="color: #78350F;">[[t:fallback_message]]</div>
+    </div>
+    """,
+    "already_submitted": """
+    <div class="success-container">
+        <div class="success-check">
+            <svg viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="3"
+                 stroke-linecap="round" stroke-linejoin="round">
+                <polyline points="20 6 9 17 4 12"></polyline>
+            </svg>
+        </div>
+        <div class="success-title">[[t:already_submitted_title]]</div>
+        <div class="success-msg">{submitted_msg}</div>
+        <div style="margin-top:0.5rem;">
+            <span class="status-badge status-dropoff">{file_count} photo{plural}</span>
+        </div>
+    </div>
+    """,
+    "already_submitted_details": """
+    <div class="pod-card pod-card-accent [[rtl]]" style="margin-top:1rem;">
+        <div class="detail-row">
+            <span class="detail-label">[[t:driver_name]]</span>
+            <span class="detail-value">{carrier}</span>
+        </div>
+        <div class="detail-row">
+            <span class="detail-label">[[t:destination]]</span>
+            <span class="detail-value">{destination_city}</span>
+        </div>
+    </div>
+    <p style="text-align:center; font-size:0.85rem; color:var(--trella-gray); margin-top:1rem;">
+        [[t:already_submitted_note]]
+    </p>
+    """,
+    "success": """
+    <div class="success-container">
+        <div class="success-check">
+            <svg viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="3"
+                 stroke-linecap="round" stroke-linejoin="round">
+                <polyline points="20 6 9 17 4 12"></polyline>
+            </svg>
+        </div>
+        <div class="success-title">[[t:success_title]]</div>
+        <div class="success-msg">[[t:success_message]]</div>
+    </div>
+    """,
+}
+
+_translations: dict = {}
+_PLACEHOLDER = re.compile(r"\[\[(\w+)(?::(\w+))?\]\]")
+
+
+def set_translations(translations: dict):
+    """Register the translation table; recompiles only if its content changed."""
+    global _translations
+    if translations != _translations:
+        _translations = translations
+        compile_fragment.cache_clear()
+
+
+# ─────────────────────────────────────────────
+# MINIFICATION
+# ─────────────────────────────────────────────
+@functools.lru_cache(maxsize=8)
+def minify_css(css: str) -> str:
+    """Strip comments and redundant whitespace from a <style> block."""
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{};>])\s*", r"\1", css)
+    css = re.sub(r"([:,])\s+", r"\1", css)
+    return css.replace(";}", "}").strip()
+
+
+def minify_html(html: str) -> str:
+    html = re.sub(r">\s+<", "><", html.strip())
+    return re.sub(r"\s{2,}", " ", html)
+
+
+# ─────────────────────────────────────────────
+# LOGO
+# ─────────────────────────────────────────────
+@functools.lru_cache(maxsize=1)
+def logo_html() -> str:
+    try:
+        with open(LOGO_PATH, "rb") as f:
+            encoded = base64.b64encode(f.read()).decode("ascii")
+    except OSError:
+        return '<div class="app-logo" style="text-align:center;">trella<span>.</span></div>'
+    return (
+        '<div style="text-align:center;">'
+        f'<img src="data:image/png;base64,{encoded}" width="120" alt="trella" style="height:auto;">'
+        "</div>"
+    )
+
+
+# ─────────────────────────────────────────────
+# FRAGMENTS
+# ─────────────────────────────────────────────
+def _escape_braces(text: str) -> str:
+    return text.replace("{", "{{").replace("}", "}}")
+
+
+@functools.lru_cache(maxsize=None)
+def compile_fragment(name: str, lang: str) -> str:
+    """Bake translations, RTL class and logo into a fragment for one language."""
+    table = _translations.get(lang) or _translations.get("en", {})
+    rtl = "rtl" if lang in RTL_LANGUAGES else ""
+
+    def resolve(match):
+        kind, arg = match.group(1), match.group(2)
+        if kind == "t":
+            return _escape_braces(table.get(arg, arg))
+        if kind == "rtl":
+            return rtl
+        if kind == "logo":
+            return _escape_braces(logo_html())
+        raise KeyError(match.group(0))
+
+    return minify_html(_PLACEHOLDER.sub(resolve, FRAGMENTS[name]))
+
+
+def render(name: str, lang: str, **fields) -> str:
+    """Compiled fragment with this rerun's shipment fields interpolated."""
+    template = compile_fragment(name, lang)
+    return template.format(**fields) if fields else template.format()
+
+
+@functools.lru_cache(maxsize=3)
+def steps_html(current: int) -> str:
+    dots = []
+    for i in range(1, 4):
+        if i < current:
+            dots.append('<div class="step-dot done"></div>')
+        elif i == current:
+            dots.append('<div class="step-dot active"></div>')
+        else:
+            dots.append('<div class="step-dot"></div>')
+    return f'<div class="steps">{"".join(dots)}</div>'
@@ -0,0 +1,85 @@
+"""Shared fixtures: fake Redash, a temporary POD_STORAGE_DIR, synthetic photos, local servers."""
+
+import os
+import sys
+import time
+import socket
+import threading
+import contextlib
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import admission  # noqa: E402,F401 - before cv2, see admission.py
+import cv2  # noqa: E402
+
+import bench  # noqa: E402
+import app as pod  # noqa: E402
+from fake_redash import FakeRedash, make_shipments  # noqa: E402
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def configure_app(mp: pytest.MonkeyPatch, storage: str, fake: FakeRedash, delta: bool = False):
+    """Point app.py's module config at a temporary storage dir and the fake Redash."""
+    mp.setattr(pod, "POD_STORAGE_DIR", storage)
+    mp.setattr(pod, "SHIPMENT_SNAPSHOT_PATH", os.path.join(storage, "_shipments_snapshot.json"))
+    mp.setattr(pod, "REDASH_API_URL", fake.url)
+    mp.setattr(pod, "REDASH_DELTA_URL", fake.delta_url if delta else None)
+    mp.setattr(pod, "SHARD_NODES", [])
+    mp.setattr(pod, "ADAPTIVE_THRESHOLDS", False)
+
+
+@contextlib.contextmanager
+def serve_asgi(asgi_app):
+    """Run an ASGI app under uvicorn in a background thread; yields its base URL."""
+    import uvicorn
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(asgi_app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while not server.started:
+        if not thread.is_alive() or time.monotonic() > deadline:
+            raise RuntimeError("server did not start")
+        time.sleep(0.02)
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        thread.join(10)
+
+
+@pytest.fixture(scope="session")
+def fake():
+    fake = FakeRedash(make_shipments(60, dropoff_ratio=0.5, seed=7)).start()
+    yield fake
+    fake.stop()
+
+
+@pytest.fixture
+def pod_env(tmp_path, fake):
+    """app.py configured against the fake Redash with an empty storage dir; yields the dir."""
+    with pytest.MonkeyPatch.context() as mp:
+        configure_app(mp, str(tmp_path), fake)
+        yield str(tmp_path)
+
+
+def _jpeg(img) -> bytes:
+    ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 88])
+    assert ok
+    return buf.tobytes()
+
+
+@pytest.fixture(scope="session")
+def photos() -> dict:
+    """JPEG bytes for a passing document photo and a blurry one."""
+    doc = bench.make_document(*bench.SIZES_MP[2], seed=3)
+    return {"good": _jpeg(doc), "blurry": _jpeg(bench.apply_variant(doc, "blurry"))}
@@ -0,0 +1,178 @@
+import asyncio
+import itertools
+
+import pytest
+import requests
+from starlette.requests import Request
+
+import api
+import admission
+from conftest import configure_app, free_port, serve_asgi
+
+_keys = itertools.count()
+
+
+@pytest.fixture(scope="module")
+def server(tmp_path_factory, fake):
+    with pytest.MonkeyPatch.context() as mp:
+        configure_app(mp, str(tmp_path_factory.mktemp("api_storage")), fake)
+        mp.setattr(api, "API_KEYS", set())
+        mp.setattr(api, "ALLOW_OPEN", True)
+        with serve_asgi(api.app) as url:
+            yield url
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """A fresh API key (so a fresh rate-limit bucket); returns request headers."""
+    key = f"test-key-{next(_keys)}"
+    monkeypatch.setattr(api, "API_KEYS", api.API_KEYS | {key})
+    return {"Authorization": f"Bearer {key}", "Content-Type": "image/jpeg"}
+
+
+@pytest.fixture(scope="module")
+def shipment_keys(fake):
+    return iter(fake.dropoff_keys())
+
+
+def _url(server, key, path=""):
+    return f"{server}/v1/shipments/{key}{path}"
+
+
+def test_quality_check_verdicts(server, client, shipment_keys, photos):
+    key = next(shipment_keys)
+    good = requests.post(_url(server, key, "/quality-check"), data=photos["good"], headers=client)
+    assert good.status_code == 200 and good.json()["passed"] is True
+    blurry = requests.post(_url(server, key, "/quality-check?lang=ar"), data=photos["blurry"], headers=client)
+    assert blurry.status_code == 200
+    body = blurry.json()
+    assert body["passed"] is False and "reason_blurry" in body["reasons"]
+    assert body["messages"][0] != "reason_blurry"  # translated
+
+
+def test_pod_stored_rejected_and_conflict(server, client, shipment_keys, photos):
+    key = next(shipment_keys)
+    rejected = requests.post(_url(server, key, "/pod"), data=photos["blurry"], headers=client)
+    assert rejected.status_code == 422 and rejected.json()["passed"] is False
+
+    stored = requests.post(_url(server, key, "/pod"), data=photos["good"], headers=client)
+    assert stored.status_code == 201
+    assert stored.json()["file_paths"] and stored.json()["metadata_path"]
+    assert requests.get(_url(server, key), headers=client).json()["submitted"] is True
+
+    again = requests.post(_url(server, key, "/pod"), data=photos["good"], headers=client)
+    assert again.status_code == 409 and again.json()["error"] == "already_submitted"
+
+
+def test_unknown_shipment_and_auth(server, client, photos, monkeypatch):
+    assert requests.get(_url(server, "nope"), headers=client).status_code == 404
+    monkeypatch.setattr(api, "ALLOW_OPEN", False)
+    assert requests.get(_url(server, "nope")).status_code == 401
+
+
+def _fallback(server, key, headers, parts):
+    files = [("photos", (f"p{i}.jpg", data, "image/jpeg")) for i, data in enumerate(parts)]
+    headers = {k: v for k, v in headers.items() if k != "Content-Type"}
+    return requests.post(_url(server, key, "/pod/fallback"), files=files, headers=headers)
+
+
+def test_fallback(server, client, shipment_keys, photos):
+    key = next(shipment_keys)
+    assert _fallback(server, key, client, [photos["blurry"]] * 2).status_code == 400
+    stored = _fallback(server, key, client, [photos["blurry"]] * 3)
+    assert stored.status_code == 201 and len(stored.json()["file_paths"]) == 3
+    assert _fallback(server, key, client, [photos["blurry"]] * 3).status_code == 409
+
+
+def test_rejected_fallback_costs_no_tokens(server, client, shipment_keys, photos, monkeypatch):
+    monkeypatch.setattr(api, "CLIENT_BURST", 3)
+    monkeypatch.setattr(api, "CLIENT_RATE", 0.001)
+    key = next(shipment_keys)
+    junk = _fallback(server, key, client, [photos["good"], b"not an image", photos["good"]])
+    assert junk.status_code == 422 and junk.json()["error"] == "reason_unreadable"
+    assert _fallback(server, key, client, [photos["good"]] * 3).status_code == 201
+
+
+def test_fallback_rejects_text_parts_and_oversized_bodies(server, client, shipment_keys, photos, monkeypatch):
+    key = next(shipment_keys)
+    headers = {k: v for k, v in client.items() if k != "Content-Type"}
+    text = requests.post(_url(server, key, "/pod/fallback"), files=[("photos", (None, "x"))] * 3, headers=headers)
+    assert text.status_code == 400
+
+    monkeypatch.setattr(admission, "MAX_UPLOAD_BYTES", 1000)
+    one_big = _fallback(server, key, client, [b"x" * 1500, b"x", b"x"])  # under the total, over one part
+    assert one_big.status_code == 413 and one_big.json()["error"] == "reason_too_large"
+
+
+
+def test_chunked_fallback_is_cut_off_while_streaming(monkeypatch):
+    monkeypatch.setattr(admission, "MAX_UPLOAD_BYTES", 1000)
+    head = b'--b\r\nContent-Disposition: form-data; name="photos"; filename="p.jpg"\r\n\r\n'
+    received = []
+
+    async def receive():  # a chunked body with no Content-Length that never ends
+        received.append(1)
+        return {"type": "http.request", "body": head if len(received) == 1 else b"x" * 100, "more_body": True}
+
+    headers = [(b"content-type", b"multipart/form-data; boundary=b")]
+    request = Request({"type": "http", "method": "POST", "headers": headers}, receive)
+    with pytest.raises(api.ApiError) as err:
+        asyncio.run(api._read_fallback_photos(request))
+    assert err.value.status == 413 and len(received) < 20
+
+
+def test_too_large(server, client, shipment_keys, monkeypatch):
+    monkeypatch.setattr(admission, "MAX_UPLOAD_BYTES", 1000)
+    key = next(shipment_keys)
+    resp = requests.post(_url(server, key, "/quality-check"), data=b"x" * 2000, headers=client)
+    assert resp.status_code == 413 and resp.json()["error"] == "reason_too_large"
+    # Chunked upload without a Content-Length is cut off while streaming
+    resp = requests.post(_url(server, key, "/quality-check"), data=iter([b"x" * 800, b"x" * 800]), headers=client)
+    assert resp.status_code == 413
+
+
+def test_rate_limited(server, client, shipment_keys, photos, monkeypatch):
+    monkeypatch.setattr(api, "CLIENT_BURST", 1)
+    monkeypatch.setattr(api, "CLIENT_RATE", 0.001)
+    key = next(shipment_keys)
+    assert requests.post(_url(server, key, "/quality-check"), data=photos["good"], headers=client).status_code == 200
+    limited = requests.post(_url(server, key, "/quality-check"), data=photos["good"], headers=client)
+    assert limited.status_code == 429 and limited.json()["error"] == "reason_rate_limited"
+    assert int(limited.headers["Retry-After"]) > 0
+
+
+def test_shed_when_queue_full(server, client, shipment_keys, photos, monkeypatch):
+    monkeypatch.setattr(api, "MAX_QUEUED", 0)
+    resp = requests.post(_url(server, next(shipment_keys), "/quality-check"), data=photos["good"], headers=client)
+    assert resp.status_code == 503 and resp.headers["Retry-After"] == "1"
+
+
+def test_storage_unreachable_is_503(server, client, shipment_keys, monkeypatch):
+    monkeypatch.setattr(api.pod, "SHARD_NODES", [f"http://127.0.0.1:{free_port()}"])
+    resp = requests.get(_url(server, next(shipment_keys)), headers=client)
+    assert resp.status_code == 503 and resp.json()["error"] == "reason_storage_unavailable"
+    assert int(resp.headers["Retry-After"]) > 0
+
+
+def test_invalid_content_length_is_400():
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    request = Request({"type": "http", "method": "POST", "headers": [(b"content-length", b"12abc")]}, receive)
+    with pytest.raises(api.ApiError) as err:
+        asyncio.run(api._read_photo(request))
+    assert err.value.status == 400
+
+
+def test_refuses_to_start_without_keys(monkeypatch):
+    monkeypatch.setattr(api, "API_KEYS", set())
+    monkeypatch.setattr(api, "ALLOW_OPEN", False)
+
+    async def start():
+        async with api.lifespan(api.app):
+            pass
+
+    with pytest.raises(RuntimeError, match="POD_API_KEYS"):
+        asyncio.run(start())
+    monkeypatch.setattr(api, "ALLOW_OPEN", True)
+    asyncio.run(start())
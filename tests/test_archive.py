@@ -0,0 +1,148 @@
+import os
+import json
+import shutil
+from datetime import datetime, timedelta
+
+import archive
+
+
+def _make_shipment(storage: str, key: str, days_old: float, size: int = 1000) -> dict:
+    """A complete shipment directory; returns {name: bytes}."""
+    files = {
+        "pod_single.jpg": os.urandom(size),
+        archive.METADATA_FILE: json.dumps({
+            "shipment_key": key,
+            "uploaded_at": (datetime.now() - timedelta(days=days_old)).isoformat(),
+        }).encode(),
+    }
+    os.makedirs(os.path.join(storage, key))
+    for name, data in files.items():
+        with open(os.path.join(storage, key, name), "wb") as f:
+            f.write(data)
+    return files
+
+
+def _assert_readable(storage: str, shipments: dict):
+    reader = archive.ArchiveStore(storage)  # fresh reader, nothing cached
+    for key, files in shipments.items():
+        assert not os.path.exists(os.path.join(storage, key))
+        assert reader.list_files(key) == sorted(files)
+        for name, data in files.items():
+            assert reader.read(key, name) == data
+            assert archive.read_file(os.path.join(storage, key, name)) == data
+        assert reader.read_metadata(key)["shipment_key"] == key
+    assert reader.verify() == []
+
+
+def _packs(storage: str) -> list[str]:
+    return sorted(n for n in os.listdir(os.path.join(storage, "_packs")) if n.endswith(".pack"))
+
+
+def test_compact_then_read(tmp_path):
+    storage = str(tmp_path)
+    old = {f"old{i}": _make_shipment(storage, f"old{i}", 100) for i in range(5)}
+    _make_shipment(storage, "recent", 1)
+
+    stats = archive.ArchiveStore(storage).compact(older_than_days=90)
+    assert (stats["shipments"], stats["files"]) == (5, 10)
+    _assert_readable(storage, old)
+    assert os.path.isdir(os.path.join(storage, "recent"))
+    assert archive.ArchiveStore(storage).read("recent", "pod_single.jpg") is None
+    assert sorted(k for k, _ in archive.ArchiveStore(storage).iter_shipments()) == sorted(old)
+
+
+def test_pack_rollover(tmp_path):
+    storage = str(tmp_path)
+    shipments = {f"s{i}": _make_shipment(storage, f"s{i}", 100, size=1500) for i in range(6)}
+    archive.ArchiveStore(storage).compact(older_than_days=90, pack_bytes=3000)
+    assert len(_packs(storage)) == 3
+
+    # A later run continues after the last pack
+    shipments.update({f"t{i}": _make_shipment(storage, f"t{i}", 100, size=1500) for i in range(2)})
+    archive.ArchiveStore(storage).compact(older_than_days=90, pack_bytes=3000)
+    assert len(_packs(storage)) == 4
+    _assert_readable(storage, shipments)
+
+
+def test_torn_tail_is_truncated(tmp_path):
+    storage = str(tmp_path)
+    shipments = {f"s{i}": _make_shipment(storage, f"s{i}", 100) for i in range(3)}
+    archive.ArchiveStore(storage).compact(older_than_days=90)
+    pack = os.path.join(storage, "_packs", _packs(storage)[-1])
+    size = os.path.getsize(pack)
+    with open(pack, "ab") as f:
+        f.write(b"PODP" + os.urandom(500))  # an interrupted run's unpublished entry
+
+    shipments["late"] = _make_shipment(storage, "late", 100)
+    assert archive.ArchiveStore(storage).compact(older_than_days=90)["shipments"] == 1
+    assert os.path.getsize(pack) > size
+    _assert_readable(storage, shipments)
+
+
+def test_pack_shorter_than_index_is_reindexed(tmp_path):
+    storage = str(tmp_path)
+    shipments = {f"s{i}": _make_shipment(storage, f"s{i}", 100) for i in range(3)}
+    archive.ArchiveStore(storage).compact(older_than_days=90)
+    pack = os.path.join(storage, "_packs", _packs(storage)[-1])
+    lost = archive.ArchiveStore(storage).lookup("s2", "pod_single.jpg")
+    with open(pack, "r+b") as f:
+        f.truncate(lost["offset"] + 10)  # cut mid-way through s2's photo
+
+    # The index overstates the pack, so readers skip it until it is recovered
+    assert archive.ArchiveStore(storage).read("s0", "pod_single.jpg") is None
+    shipments["late"] = _make_shipment(storage, "late", 100)
+    archive.ArchiveStore(storage).compact(older_than_days=90)
+
+    reader = archive.ArchiveStore(storage)
+    assert reader.read("s2", "pod_single.jpg") is None
+    del shipments["s2"]
+    _assert_readable(storage, shipments)
+
+
+def test_missing_index_is_rebuilt(tmp_path):
+    storage = str(tmp_path)
+    shipments = {f"s{i}": _make_shipment(storage, f"s{i}", 100) for i in range(3)}
+    archive.ArchiveStore(storage).compact(older_than_days=90)
+    os.remove(os.path.join(storage, "_packs", "pack-000000.idx"))
+    assert archive.ArchiveStore(storage).read("s0", "pod_single.jpg") is None
+
+    archive.ArchiveStore(storage).compact(older_than_days=90)
+    _assert_readable(storage, shipments)
+
+
+def test_crash_before_first_index(tmp_path):
+    """Entries written, index and deletions never happened: the rerun finishes the job."""
+    storage = str(tmp_path)
+    shipments = {f"s{i}": _make_shipment(storage, f"s{i}", 100) for i in range(3)}
+    backup = str(tmp_path / "_backup")
+    for key in shipments:
+        shutil.copytree(os.path.join(storage, key), os.path.join(backup, key))
+    archive.ArchiveStore(storage).compact(older_than_days=90)
+    os.remove(os.path.join(storage, "_packs", "pack-000000.idx"))
+    for key in shipments:
+        shutil.copytree(os.path.join(backup, key), os.path.join(storage, key))
+    shutil.rmtree(backup)
+
+    stats = archive.ArchiveStore(storage).compact(older_than_days=90)
+    assert stats["already_archived"] == 3 and stats["shipments"] == 0
+    assert _packs(storage) == ["pack-000000.pack"]
+    _assert_readable(storage, shipments)
+
+
+def test_forget_hides_until_archived_again(tmp_path):
+    storage = str(tmp_path)
+    shipments = {f"s{i}": _make_shipment(storage, f"s{i}", 100) for i in range(3)}
+    archive.ArchiveStore(storage).compact(older_than_days=90)
+    archive.get_store(storage).forget("s1")
+
+    reader = archive.ArchiveStore(storage)  # another process sees the tombstone too
+    assert reader.list_files("s1") == [] and reader.read("s1", "pod_single.jpg") is None
+    assert sorted(k for k, _ in reader.iter_shipments()) == ["s0", "s2"]
+
+    # Same names and sizes: must not be mistaken for the hidden copy
+    shipments["s1"] = _make_shipment(storage, "s1", 100)
+    stats = archive.ArchiveStore(storage).compact(older_than_days=90)
+    assert (stats["shipments"], stats["already_archived"]) == (1, 0)
+    assert _packs(storage) == ["pack-000000.pack"]
+    _assert_readable(storage, shipments)
+    assert sorted(k for k, _ in archive.ArchiveStore(storage).iter_shipments()) == ["s0", "s1", "s2"]
@@ -0,0 +1,121 @@
+import os
+import json
+
+import pytest
+
+import calibration
+import eventlog
+
+DEFAULTS = {"BLUR_THRESHOLD": 80.0, "DARK_THRESHOLD": 40.0, "BRIGHT_THRESHOLD": 240.0, "MIN_EDGE_RATIO": 0.02}
+
+
+def _check(key: str, attempt: int | None, sharpness: float, brightness: float = 120.0,
+           edge_ratio: float = 0.05, resolution: str = "4000x3000") -> dict:
+    scores = {"resolution": resolution, "sharpness": sharpness, "brightness": brightness, "edge_ratio": edge_ratio}
+    return eventlog.quality_record({"key": key}, {"passed": True, "reasons": [], "scores": scores}, "ui", attempt)
+
+
+def _log(tmp_path, records) -> eventlog.EventLog:
+    log = eventlog.EventLog(str(tmp_path / "_events"))
+    for record in records:
+        log.append(record, wait=False)
+    log.flush()
+    return log
+
+
+def test_sketch_quantiles_within_relative_accuracy():
+    sketch = calibration.Sketch()
+    assert sketch.quantile(0.5) is None
+    for value in range(1, 1001):
+        sketch.add(float(value))
+    for q, exact in ((0.1, 100.9), (0.5, 500.5), (0.9, 900.1)):
+        assert sketch.quantile(q) == pytest.approx(exact, rel=2 * calibration.RELATIVE_ACCURACY)
+    assert calibration.Sketch.from_dict(json.loads(json.dumps(sketch.to_dict()))).quantile(0.5) == sketch.quantile(0.5)
+
+    zeros = calibration.Sketch()
+    for value in (0.0, 0.0, 0.0, 5.0):
+        zeros.add(value)
+    assert zeros.quantile(0.5) == 0.0
+
+
+def test_fit_clamps_and_requires_min_samples(tmp_path):
+    records = [_check(f"soft{i}", 1, sharpness=5.0, brightness=10.0, edge_ratio=0.001)
+               for i in range(calibration.MIN_SAMPLES)]
+    records += [_check(f"crisp{i}", 1, sharpness=500.0, brightness=128.0, edge_ratio=0.2, resolution="1600x1200")
+                for i in range(calibration.MIN_SAMPLES)]
+    records += [_check(f"rare{i}", 1, sharpness=5.0, resolution="8000x6000") for i in range(10)]
+    calibrator = calibration.Calibrator(str(tmp_path / "_calibration"))
+    count, thresholds = calibrator.run(_log(tmp_path, records), DEFAULTS)
+    assert count == len(records)
+
+    segments = thresholds["segments"]
+    assert "48mp" not in segments  # below MIN_SAMPLES keeps the defaults
+    # Never looser than LIMITS...
+    assert segments["12mp"]["BLUR_THRESHOLD"] == 30.0
+    assert segments["12mp"]["DARK_THRESHOLD"] == 25.0
+    assert segments["12mp"]["MIN_EDGE_RATIO"] == 0.01
+    # ...and never tighter than the defaults
+    assert segments["2mp"]["BLUR_THRESHOLD"] == 80.0
+    assert segments["2mp"]["BRIGHT_THRESHOLD"] == 240.0
+    assert segments["2mp"]["samples"] == calibration.MIN_SAMPLES
+
+
+def test_apply_counts_each_attempt_once(tmp_path):
+    calibrator = calibration.Calibrator(str(tmp_path))
+    for record in (_check("a", 1, 50.0), _check("a", 1, 50.0), _check("a", 2, 60.0), _check("b", 1, 70.0)):
+        calibrator.apply(record)
+    assert calibrator.sketches["12mp"]["sharpness"].count == 3
+
+
+def test_api_checks_without_attempt_all_count(tmp_path):
+    calibrator = calibration.Calibrator(str(tmp_path))
+    for sharpness in (50.0, 20.0, 25.0):  # a driver's API retakes
+        calibrator.apply(_check("a", None, sharpness))
+    assert calibrator.sketches["12mp"]["sharpness"].count == 3
+    assert not calibrator.seen
+
+
+def test_seen_samples_survive_a_restart(tmp_path):
+    root = str(tmp_path / "_calibration")
+    log = _log(tmp_path, [_check("a", 1, 50.0)])
+    calibration.Calibrator(root).run(log, DEFAULTS)
+    log.append(_check("a", 1, 50.0))
+    log.append(_check("a", 2, 50.0))
+    resumed = calibration.Calibrator(root)
+    resumed.refresh(log)
+    assert resumed.sketches["12mp"]["sharpness"].count == 2
+
+
+def test_apply_decays_past_max_weight(tmp_path, monkeypatch):
+    monkeypatch.setattr(calibration, "MAX_WEIGHT", 100)
+    calibrator = calibration.Calibrator(str(tmp_path))
+    for i in range(101):
+        calibrator.apply(_check(f"s{i}", 1, 40.0 + i % 10))
+    sketches = calibrator.sketches["12mp"]
+    assert sketches["sharpness"].count == pytest.approx(50.5)
+    assert sketches["brightness"].count == pytest.approx(50.5)
+    assert sketches["sharpness"].quantile(0.5) == pytest.approx(44.5, rel=0.05)
+
+
+def test_thresholds_hot_reload(tmp_path, monkeypatch):
+    monkeypatch.setattr(calibration, "RELOAD_SECONDS", 0.0)
+    root = str(tmp_path / "_calibration")
+    records = [_check(f"s{i}", 1, sharpness=5.0) for i in range(calibration.MIN_SAMPLES)]
+    calibration.Calibrator(root).run(_log(tmp_path, records), DEFAULTS)
+
+    thresholds = calibration.Thresholds(os.path.join(root, "thresholds.json"))
+    assert thresholds.lookup(4000, 3000, DEFAULTS)["BLUR_THRESHOLD"] == 30.0
+    assert thresholds.lookup(640, 480, DEFAULTS) == DEFAULTS  # uncalibrated segment
+
+    path = os.path.join(root, "thresholds.json")
+    with open(path, "r", encoding="utf-8") as f:
+        published = json.load(f)
+    published["segments"]["12mp"]["BLUR_THRESHOLD"] = 55.0
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(published, f)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert thresholds.lookup(4000, 3000, DEFAULTS)["BLUR_THRESHOLD"] == 55.0
+
+    os.remove(path)
+    assert thresholds.lookup(4000, 3000, DEFAULTS) == DEFAULTS
@@ -0,0 +1,79 @@
+import os
+import json
+
+import dashboard
+import eventlog
+
+
+def _submission(key: str, mode: str = "single") -> dict:
+    return {"type": "pod_submitted", "shipment_key": key, "upload_mode": mode,
+            "destination_city": "Riyadh", "carrier": "c1", "uploaded_at": "2026-10-01T10:00:00"}
+
+
+def test_submitted_keys_checkpointed_and_joined(tmp_path):
+    log = eventlog.EventLog(str(tmp_path / "_events"))
+    log.append(_submission("a"))
+    log.append({"type": "quality_check", "shipment_key": "b", "passed": False, "reasons": ["reason_blurry"]})
+    log.append(_submission("c", "fallback_triple"))
+
+    path = str(tmp_path / "_dashboard" / "aggregates.json")
+    aggregates = dashboard.Aggregates(path)
+    assert aggregates.refresh(log) == 3
+    assert aggregates.submitted == {"a", "c"}
+    records = {key: {"key": key, "status": "AT_DROP_OFF_LOCATION"} for key in ("a", "b", "c", "d")}
+    records["e"] = {"key": "e", "status": "DELIVERED"}  # full CSV mode keeps every status
+    assert [r["key"] for r in dashboard.missing_pods(records, aggregates.submitted)] == ["b", "d"]
+
+    # A restart resumes from the checkpoint, submitted keys included
+    log.append(_submission("d"))
+    resumed = dashboard.Aggregates(path)
+    assert resumed.submitted == {"a", "c"} and resumed.next_offset == 3
+    assert resumed.refresh(log) == 1
+    assert resumed.submitted == {"a", "c", "d"}
+    assert resumed.summary()["submissions"] == 3
+
+
+def test_submitted_keys_appended_not_rewritten(tmp_path):
+    log = eventlog.EventLog(str(tmp_path / "_events"))
+    path = str(tmp_path / "_dashboard" / "aggregates.json")
+    keys_path = str(tmp_path / "_dashboard" / "submitted_keys")
+    for key in ("a", "b", "a"):
+        log.append(_submission(key))
+    dashboard.Aggregates(path).refresh(log)
+    with open(keys_path, "rb") as f:
+        assert f.read() == b"a\nb\n"
+
+    log.append(_submission("c"))
+    aggregates = dashboard.Aggregates(path)
+    stat = os.stat(keys_path)
+    aggregates.refresh(log)
+    with open(keys_path, "rb") as f:
+        f.seek(stat.st_size)
+        assert f.read() == b"c\n"  # only the new key was written
+
+    # Keys appended by a save that died before its checkpoint are dropped and re-folded
+    with open(keys_path, "ab") as f:
+        f.write(b"d\n")
+    log.append(_submission("d"))
+    resumed = dashboard.Aggregates(path)
+    assert resumed.submitted == {"a", "b", "c"}
+    resumed.refresh(log)
+    with open(keys_path, "rb") as f:
+        assert f.read() == b"a\nb\nc\nd\n"
+
+
+def test_old_checkpoint_without_keys_replays(tmp_path):
+    log = eventlog.EventLog(str(tmp_path / "_events"))
+    log.append(_submission("a"))
+    path = str(tmp_path / "_dashboard" / "aggregates.json")
+    dashboard.Aggregates(path).refresh(log)
+    with open(path, "r", encoding="utf-8") as f:
+        state = json.load(f)
+    del state["submitted_keys"]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+
+    aggregates = dashboard.Aggregates(path)
+    assert aggregates.next_offset == 0
+    aggregates.refresh(log)
+    assert aggregates.submitted == {"a"} and aggregates.summary()["submissions"] == 1
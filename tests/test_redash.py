@@ -0,0 +1,82 @@
+import pytest
+
+import redash
+import app as pod
+from conftest import configure_app
+from fake_redash import FakeRedash, make_shipments
+
+
+@pytest.fixture
+def fresh_fake():
+    """A fake of our own: these tests move shipments between statuses."""
+    rows = make_shipments(50, dropoff_ratio=0.4, seed=11)
+    for row in rows[:10]:
+        row["updated_at"] = "2026-02-01T00:00:00"  # ties on updated_at across page boundaries
+    fake = FakeRedash(rows).start()
+    yield fake
+    fake.stop()
+
+
+def test_keyset_paging_returns_each_row_once(fresh_fake):
+    rows, watermark = redash.fetch(fresh_fake.delta_url, redash.ANY_STATUS, page_size=7)
+    assert len(rows) == 50 == len({r["key"] for r in rows})
+    assert [(r["updated_at"], r["key"]) for r in rows] == sorted((r["updated_at"], r["key"]) for r in rows)
+    assert watermark == max(r["updated_at"] for r in fresh_fake.rows)
+
+    dropoff, _ = redash.fetch(fresh_fake.delta_url, redash.DROPOFF_STATUS, page_size=7)
+    assert sorted(r["key"] for r in dropoff) == sorted(fresh_fake.dropoff_keys())
+
+
+def test_fetch_after_watermark(fresh_fake):
+    _, watermark = redash.fetch(fresh_fake.delta_url, redash.ANY_STATUS)
+    # Rows stamped exactly at the watermark are read again; nothing older is
+    again, same = redash.fetch(fresh_fake.delta_url, redash.ANY_STATUS, watermark)
+    assert same == watermark and {r["updated_at"] for r in again} == {watermark}
+    key = fresh_fake.rows[0]["key"]
+    fresh_fake.touch(key, "DELIVERED")
+    changes, new_watermark = redash.fetch(fresh_fake.delta_url, redash.ANY_STATUS, watermark)
+    assert key in [r["key"] for r in changes] and new_watermark > watermark
+    assert [r["key"] for r in redash.fetch(fresh_fake.delta_url, redash.ANY_STATUS, new_watermark)[0]] == [key]
+
+
+def test_overlap_rereads_the_window(fresh_fake):
+    assert redash.overlap("2026-03-01T00:01:00") == "2026-03-01T00:00:00"
+    newest = max(fresh_fake.rows, key=lambda r: (r["updated_at"], r["key"]))
+    changes, _ = redash.fetch(fresh_fake.delta_url, redash.ANY_STATUS, redash.overlap(newest["updated_at"]))
+    assert newest["key"] in [r["key"] for r in changes]
+
+
+def test_delta_refresh_merges_upserts_and_removals(tmp_path, fresh_fake):
+    with pytest.MonkeyPatch.context() as mp:
+        configure_app(mp, str(tmp_path), fresh_fake, delta=True)
+        store = pod.get_shipment_store()
+        assert store.refresh()
+        assert sorted(store.records) == sorted(fresh_fake.dropoff_keys())
+
+        left = fresh_fake.dropoff_keys()[0]
+        arrived = next(r["key"] for r in fresh_fake.rows if r["status"] != redash.DROPOFF_STATUS)
+        fresh_fake.touch(left, "DELIVERED")
+        fresh_fake.touch(arrived, redash.DROPOFF_STATUS)
+        sent = fresh_fake.bytes_sent
+        assert store.refresh()
+        assert left not in store.records and arrived in store.records
+        assert sorted(store.records) == sorted(fresh_fake.dropoff_keys())
+        assert fresh_fake.bytes_sent - sent < 5000  # the two changed rows, not the table
+
+
+def test_full_fetch_watermark_comes_from_redash(tmp_path):
+    fake = FakeRedash(make_shipments(30, dropoff_ratio=0.0, seed=5)).start()
+    try:
+        with pytest.MonkeyPatch.context() as mp:
+            configure_app(mp, str(tmp_path), fake, delta=True)
+            upserts, removed, watermark = pod.fetch_shipment_changes(None)
+            assert (upserts, removed, watermark) == ([], [], redash.EPOCH)  # no local clock involved
+
+            fake.touch(fake.rows[3]["key"], redash.DROPOFF_STATUS)
+            upserts, removed, watermark = pod.fetch_shipment_changes(watermark)
+            assert [r["key"] for r in upserts] == [fake.rows[3]["key"]]
+            assert watermark == max(r["updated_at"] for r in fake.rows)
+            upserts, removed, _ = pod.fetch_shipment_changes(watermark)
+            assert [r["key"] for r in upserts] == [fake.rows[3]["key"]] and removed == []
+    finally:
+        fake.stop()
@@ -0,0 +1,21 @@
+import http.client
+
+import pytest
+
+import resumable
+from conftest import free_port
+
+
+@pytest.mark.parametrize("length", ["-1", "+5", "1e3", ""])
+def test_patch_rejects_invalid_content_length(tmp_path, length):
+    port = free_port()
+    resumable.start_server(port, str(tmp_path), addr="127.0.0.1")
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    conn.putrequest("PATCH", "/uploads/" + "a" * 16)
+    conn.putheader("Upload-Offset", "0")
+    conn.putheader("Content-Length", length)
+    conn.endheaders()
+    response = conn.getresponse()  # answered without waiting for a body
+    assert response.status == 400
+    assert b"Content-Length" in response.read()
+    conn.close()
@@ -0,0 +1,190 @@
+import os
+import sys
+import json
+import time
+import subprocess
+from datetime import datetime, timedelta
+
+import pytest
+import requests
+
+import shards
+import archive
+import app as pod
+from conftest import ROOT, free_port
+
+
+class Cluster:
+    """Storage nodes as separate `shards.py serve` processes, each restartable on its port."""
+
+    def __init__(self, storage: str):
+        self.storage = storage
+        self.urls: list[str] = []
+        self.procs: dict[int, subprocess.Popen] = {}
+
+    def add(self) -> str:
+        self.urls.append(f"http://127.0.0.1:{free_port()}")
+        self.start(len(self.urls) - 1)
+        return self.urls[-1]
+
+    def dir(self, i: int) -> str:
+        return os.path.join(self.storage, f"node{i}")
+
+    def start(self, i: int):
+        port = self.urls[i].rsplit(":", 1)[1]
+        self.procs[i] = subprocess.Popen([sys.executable, os.path.join(ROOT, "shards.py"), "serve",
+                                          "--addr", "127.0.0.1", "--port", port, "--storage", self.dir(i)],
+                                         env={**os.environ, "POD_SHARD_HANDOFF_SECONDS": "0.2"})
+        deadline = time.monotonic() + 20
+        while True:
+            try:
+                requests.get(self.urls[i] + "/healthz", timeout=1)
+                return
+            except requests.ConnectionError:
+                if self.procs[i].poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError(f"storage node {i} did not start")
+                time.sleep(0.05)
+
+    def stop(self, *nodes: str):
+        for url in nodes:
+            proc = self.procs.pop(self.urls.index(url))
+            proc.terminate()
+            proc.wait(10)
+
+    def restart(self, *nodes: str):
+        for url in nodes:
+            self.start(self.urls.index(url))
+
+    def client(self, replicas: int = 2) -> shards.ShardClient:
+        return shards.ShardClient(self.urls, replicas)  # fresh: no nodes remembered as down
+
+    def keys(self, url: str) -> set[str]:
+        return {k for k in requests.get(url + "/keys").text.split("\n") if k}
+
+
+@pytest.fixture
+def cluster(tmp_path):
+    cluster = Cluster(str(tmp_path))
+    yield cluster
+    for proc in cluster.procs.values():
+        proc.terminate()
+    for proc in cluster.procs.values():
+        proc.wait(10)
+
+
+def _nodes(count: int, cluster: Cluster) -> list[str]:
+    return [cluster.add() for _ in range(count)]
+
+
+def _metadata(key: str, days_old: float = 0) -> bytes:
+    uploaded_at = (datetime.now() - timedelta(days=days_old)).isoformat()
+    return json.dumps({"shipment_key": key, "uploaded_at": uploaded_at}).encode()
+
+
+def test_write_needs_quorum(cluster, monkeypatch):
+    nodes = _nodes(3, cluster)
+    key, meta = "quorum-1", _metadata("quorum-1")
+    assert len(cluster.client(replicas=3).put(key, "metadata.json", meta)) == 3
+
+    cluster.stop(*nodes[:2])
+    with pytest.raises(shards.ShardError):
+        cluster.client(replicas=3).put(key, "pod_0.jpg", b"photo")
+    assert cluster.client(replicas=3).get(key, "metadata.json") == meta  # one node still answers
+
+    cluster.stop(nodes[2])
+    with pytest.raises(shards.ShardError):
+        cluster.client(replicas=3).get(key, "metadata.json")
+    # The app reports unreachable storage instead of "not submitted"
+    monkeypatch.setattr(pod, "SHARD_NODES", nodes)
+    monkeypatch.setattr(pod, "SHARD_REPLICAS", 3)
+    with pytest.raises(shards.ShardError):
+        pod.get_existing_submission(key)
+
+
+def test_handoff_is_found_and_handed_back(cluster):
+    _nodes(4, cluster)
+    key, meta = "handoff-1", _metadata("handoff-1")
+    owner_a, owner_b, spare_a, spare_b = cluster.client().ring.preference(key)
+
+    cluster.stop(owner_a, owner_b)
+    writer = cluster.client()
+    assert sorted(writer.put(key, "metadata.json", meta)) == sorted([spare_a, spare_b])
+    # Another app node, with no hints of its own, walks past the down owners
+    assert cluster.client().get(key, "metadata.json") == meta
+
+    cluster.restart(owner_a, owner_b)
+    assert writer.get(key, "metadata.json") == meta  # its hints point at the stand-ins
+    deadline = time.monotonic() + 10
+    while [key in cluster.keys(url) for url in (owner_a, owner_b, spare_a, spare_b)] != [True, True, False, False]:
+        assert time.monotonic() < deadline, "stand-ins did not hand the key back"
+        time.sleep(0.1)
+    assert cluster.client().get(key, "metadata.json") == meta
+    stats = cluster.client().rebalance()
+    assert (stats["copied"], stats["removed"]) == (0, 0)
+
+
+def test_miss_asks_only_the_owners(cluster):
+    _nodes(5, cluster)
+    client = cluster.client()
+    calls = []
+    call = client._call
+    client._call = lambda node, *args, **kwargs: calls.append(node) or call(node, *args, **kwargs)
+    assert client.get("never-submitted", "metadata.json") is None
+    assert sorted(calls) == sorted(client.owners("never-submitted"))
+
+
+def test_rebalance_after_adding_a_node_converges(cluster):
+    _nodes(3, cluster)
+    keys = {f"ship-{i}": _metadata(f"ship-{i}") for i in range(30)}
+    for key, meta in keys.items():
+        cluster.client().put(key, "metadata.json", meta)
+
+    cluster.add()
+    client = cluster.client()
+    stats = client.rebalance()
+    assert stats["copied"] > 0 and stats["removed"] > 0 and not stats["unreachable"]
+    for url in cluster.urls:
+        assert cluster.keys(url) == {k for k in keys if url in client.owners(k)}
+    again = cluster.client().rebalance()
+    assert (again["copied"], again["removed"]) == (0, 0)
+    assert all(client.get(key, "metadata.json") == meta for key, meta in keys.items())
+
+
+def test_archived_keys_leave_with_rebalance(cluster):
+    _nodes(2, cluster)
+    keys = {f"old-{i}": _metadata(f"old-{i}", days_old=100) for i in range(20)}
+    for key, meta in keys.items():
+        cluster.client(replicas=1).put(key, "pod_0.jpg", os.urandom(500))
+        cluster.client(replicas=1).put(key, "metadata.json", meta)
+    for i in range(2):
+        archive.ArchiveStore(cluster.dir(i)).compact(older_than_days=90)
+        assert not any(os.path.isdir(os.path.join(cluster.dir(i), k)) for k in keys)
+
+    cluster.add()
+    client = cluster.client(replicas=1)
+    stats = client.rebalance()
+    moved = [k for k in keys if client.owners(k) == [cluster.urls[2]]]
+    assert moved and stats["removed"] == len(moved)
+    for i, url in enumerate(cluster.urls[:2]):
+        listed = cluster.keys(url)
+        for key in moved:
+            assert key not in listed
+            assert requests.get(f"{url}/objects/{key}/").status_code == 404
+            assert requests.get(f"{url}/objects/{key}/metadata.json").status_code == 404
+    again = cluster.client(replicas=1).rebalance()
+    assert (again["copied"], again["removed"]) == (0, 0)
+    for key, meta in keys.items():
+        assert client.get(key, "metadata.json") == meta
+        assert client.names(key) == ["metadata.json", "pod_0.jpg"]
+
+    # A key placed back on its old node is served again, also once archived a second time
+    key = moved[0]
+    source = cluster.urls.index(shards.ShardClient(cluster.urls[:2], 1).owners(key)[0])
+    assert archive.ArchiveStore(cluster.dir(source)).list_files(key) == []
+    data = _metadata(key, days_old=200)
+    assert shards.ShardClient([cluster.urls[source]], 1).put(key, "metadata.json", data)
+    assert requests.get(f"{cluster.urls[source]}/objects/{key}/").json() == ["metadata.json"]
+    archive.ArchiveStore(cluster.dir(source)).compact(older_than_days=90)
+    assert key in cluster.keys(cluster.urls[source])
+    assert requests.get(f"{cluster.urls[source]}/objects/{key}/").json() == ["metadata.json"]
+    assert requests.get(f"{cluster.urls[source]}/objects/{key}/metadata.json").content == data
@@ -0,0 +1,40 @@
+import shipment_store
+
+
+def _store(tmp_path, rows):
+    calls = []
+
+    def fetch_records():
+        calls.append(1)
+        return list(rows)
+
+    store = shipment_store.ShipmentStore(fetch_records, str(tmp_path / "snapshot.json"))
+    return store, calls
+
+
+def test_misses_refresh_at_most_once_per_interval(tmp_path):
+    rows = [{"key": "a"}]
+    store, calls = _store(tmp_path, rows)
+    assert store.get("a") == {"key": "a"} and len(calls) == 1
+    for i in range(5):
+        assert store.get(f"unknown{i}") is None
+    assert len(calls) == 1  # the first fetch was just now
+
+    store.miss_refresh_seconds = 0.0
+    rows.append({"key": "b"})
+    assert store.get("b") == {"key": "b"} and len(calls) == 2
+
+
+def test_failed_miss_refresh_is_rate_limited_too(tmp_path):
+    store, calls = _store(tmp_path, [{"key": "a"}])
+    store.get("a")
+    store.refreshed_at -= store.miss_refresh_seconds  # the last refresh is old
+
+    def down():
+        calls.append(1)
+        raise ConnectionError("redash down")
+
+    store.fetch_records = down
+    for i in range(5):
+        assert store.get(f"unknown{i}") is None
+    assert len(calls) == 2 and store.get("a") == {"key": "a"}
@@ -0,0 +1,221 @@
+"""
+Upload Buffer Manager
+=====================
+Bounds the memory held by drivers' uploaded photos across sessions.
+
+Streamlit keeps every file a session uploads in its in-memory uploaded-file
+manager until the session ends. The attempt-indexed uploaders
+(`pod_upload_{n}`, `fallback_{i}`) mean a driver who retries keeps every
+rejected photo alive. This module tracks one live buffer per logical slot
+("pod", "fallback_1", ...) per session and:
+
+- releases a slot's previous file as soon as a new one supersedes it, and
+  releases all of a session's files once the POD is submitted;
+- enforces a per-session and a global in-memory budget by spilling the least
+  recently used buffers to a temp-file spool. The file is mmapped read-only
+  and unlinked immediately, so nothing leaks on disk and the kernel can page
+  it out;
+- reports live buffer bytes as `pod_upload_buffer_bytes{state=memory|spooled}`.
+
+Spilling rewrites records inside Streamlit's MemoryUploadedFileManager under
+its own lock. Those are internals, so it is only done on the Streamlit
+versions in SPILL_STREAMLIT_VERSIONS; elsewhere buffers are still released
+but never spilled.
+
+All functions are no-ops outside a Streamlit script run.
+"""
+
+import os
+import mmap
+import time
+import tempfile
+import threading
+
+import metrics
+
+DEFAULT_SESSION_BUDGET = 24 * 1024 * 1024
+DEFAULT_GLOBAL_BUDGET = 512 * 1024 * 1024
+SPILL_STREAMLIT_VERSIONS = ((1, 30), (2, 0))  # [min, max) with a known MemoryUploadedFileManager layout
+
+_spill_supported = None
+
+
+def _can_spill(file_mgr) -> bool:
+    """Whether file_mgr is an in-memory manager whose internals we know how to rewrite."""
+    global _spill_supported
+    if _spill_supported is None:
+        import streamlit
+
+        try:
+            version = tuple(int(p) for p in streamlit.__version__.split(".")[:2])
+        except ValueError:
+            version = (0, 0)
+        low, high = SPILL_STREAMLIT_VERSIONS
+        _spill_supported = low <= version < high
+        if not _spill_supported:
+            metrics.inc("pod_upload_spill_unsupported_total")
+    return (_spill_supported and isinstance(getattr(file_mgr, "file_storage", None), dict)
+            and hasattr(getattr(file_mgr, "_lock", None), "acquire"))
+
+
+def _spool(data) -> mmap.mmap:
+    fd, path = tempfile.mkstemp(prefix="pod_spool_", dir=_manager.spool_dir)
+    try:
+        with open(fd, "wb", closefd=False) as f:
+            f.write(data)
+        return mmap.mmap(fd, len(data), access=mmap.ACCESS_READ)
+    finally:
+        os.close(fd)
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+class _Buffer:
+    __slots__ = ("session_id", "slot", "file_id", "size", "spooled", "last_used")
+
+    def __init__(self, session_id: str, slot: str, file_id: str, size: int):
+        self.session_id = session_id
+        self.slot = slot
+        self.file_id = file_id
+        self.size = size
+        self.spooled = False
+        self.last_used = time.monotonic()
+
+
+class UploadBufferManager:
+    def __init__(self):
+        self.session_budget = DEFAULT_SESSION_BUDGET
+        self.global_budget = DEFAULT_GLOBAL_BUDGET
+        self.spool_dir = None
+        self._buffers: dict[tuple, _Buffer] = {}
+        self._lock = threading.Lock()
+
+    # ── accounting ──
+    def stats(self) -> dict:
+        with self._lock:
+            memory = sum(b.size for b in self._buffers.values() if not b.spooled)
+            spooled = sum(b.size for b in self._buffers.values() if b.spooled)
+            sessions = len({b.session_id for b in self._buffers.values()})
+        return {"memory_bytes": memory, "spooled_bytes": spooled, "buffers": len(self._buffers), "sessions": sessions}
+
+    def _report(self):
+        memory = spooled = 0
+        for b in self._buffers.values():
+            if b.spooled:
+                spooled += b.size
+            else:
+                memory += b.size
+        metrics.set_gauge("pod_upload_buffer_bytes", memory, state="memory")
+        metrics.set_gauge("pod_upload_buffer_bytes", spooled, state="spooled")
+
+    # ── mutations (caller holds no lock) ──
+    def track(self, file_mgr, session_id: str, slot: str, file_id: str, size: int):
+        with self._lock:
+            self._sweep(file_mgr)
+            key = (session_id, slot)
+            buf = self._buffers.get(key)
+            if buf is not None and buf.file_id != file_id:
+                self._drop(file_mgr, buf)
+                buf = None
+            if buf is None:
+                buf = self._buffers[key] = _Buffer(session_id, slot, file_id, size)
+            buf.last_used = time.monotonic()
+            self._enforce(file_mgr, session_id)
+            self._report()
+
+    def release(self, file_mgr, session_id: str, slots=None):
+        with self._lock:
+            for key, buf in list(self._buffers.items()):
+                if key[0] == session_id and (slots is None or key[1] in slots):
+                    self._drop(file_mgr, buf)
+            self._report()
+
+    # ── internals (lock held) ──
+    def _drop(self, file_mgr, buf: _Buffer):
+        self._buffers.pop((buf.session_id, buf.slot), None)
+        file_mgr.remove_file(buf.session_id, buf.file_id)
+        metrics.inc("pod_upload_buffers_released_total")
+
+    def _spill(self, file_mgr, buf: _Buffer) -> bool:
+        if buf.size == 0 or not _can_spill(file_mgr):
+            return False  # not a manager we know how to spill from
+        with file_mgr._lock:
+            session = file_mgr.file_storage.get(buf.session_id)
+            rec = session.get(buf.file_id) if session is not None else None
+            if rec is None:
+                return False
+            if isinstance(rec.data, bytes):
+                session[buf.file_id] = rec._replace(data=_spool(rec.data))
+        buf.spooled = True
+        metrics.inc("pod_upload_buffers_spooled_total")
+        return True
+
+    def _spill_until(self, file_mgr, candidates: list, budget: int):
+        in_memory = sum(b.size for b in candidates if not b.spooled)
+        for buf in sorted((b for b in candidates if not b.spooled), key=lambda b: b.last_used):
+            if in_memory <= budget:
+                break
+            if self._spill(file_mgr, buf):
+                in_memory -= buf.size
+
+    def _enforce(self, file_mgr, session_id: str):
+        session = [b for b in self._buffers.values() if b.session_id == session_id]
+        self._spill_until(file_mgr, session, self.session_budget)
+        self._spill_until(file_mgr, list(self._buffers.values()), self.global_budget)
+
+    def _sweep(self, file_mgr):
+        """Forget buffers of sessions Streamlit has already torn down."""
+        if not self._buffers:
+            return
+        if _can_spill(file_mgr):
+            with file_mgr._lock:
+                live = {(sid, fid) for sid, files in file_mgr.file_storage.items() for fid in files}
+        else:
+            live = {(b.session_id, rec.file_id) for b in self._buffers.values()
+                    for rec in file_mgr.get_files(b.session_id, [b.file_id])}
+        for key, buf in list(self._buffers.items()):
+            if (buf.session_id, buf.file_id) not in live:
+                del self._buffers[key]
+
+
+_manager = UploadBufferManager()
+
+
+def configure(session_budget: int, global_budget: int, spool_dir: str | None = None):
+    _manager.session_budget = session_budget
+    _manager.global_budget = global_budget
+    _manager.spool_dir = spool_dir
+
+
+def _context():
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+    ctx = get_script_run_ctx(suppress_warning=True)
+    if ctx is None or getattr(ctx, "uploaded_file_mgr", None) is None:
+        return None
+    return ctx
+
+
+def track(slot: str, uploaded_file):
+    """Register the file currently shown in `slot`, releasing whatever it replaced."""
+    ctx = _context()
+    if ctx is None:
+        return
+    if uploaded_file is None:
+        _manager.release(ctx.uploaded_file_mgr, ctx.session_id, {slot})
+        return
+    _manager.track(ctx.uploaded_file_mgr, ctx.session_id, slot, uploaded_file.file_id, uploaded_file.size)
+
+
+def release(*slots: str):
+    """Release the given slots for this session, or all of them if none are given."""
+    ctx = _context()
+    if ctx is None:
+        return
+    _manager.release(ctx.uploaded_file_mgr, ctx.session_id, set(slots) if slots else None)
+
+
+def stats() -> dict:
+    return _manager.stats()